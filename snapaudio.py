@@ -0,0 +1,133 @@
+import os
+import tempfile
+import subprocess
+
+import numpy as np
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+import snapcache
+
+# --- 音频波形 / 响度条：流式解码，按像素列归约成 min / max / RMS ---
+#
+# ffmpeg 把音轨解码成单声道 8kHz s16le 写到管道，这里按块读取，每块内用
+# reduceat 向量化归约到所在的像素列，再与已有结果合并；内存只与块大小和
+# 输出宽度有关，与时长无关，几个小时的文件也一样。
+
+SAMPLE_RATE = 8000
+CHUNK_SAMPLES = SAMPLE_RATE * 10
+STRIP_WIDTH = 1800
+STRIP_HEIGHT = 120
+STRIP_MARGIN = 60  # 与信息文字左边距 +60 对齐
+PEAK_COLOR = (255, 255, 255, 110)
+RMS_COLOR = (255, 255, 255, 235)
+SILENCE_DB = -60.0
+
+
+def audio_envelope(video_file, duration_ms, width=STRIP_WIDTH, sample_rate=SAMPLE_RATE):
+    """返回 {"min", "max", "rms"}，各为长度 width 的 float32 数组（满幅 = 1.0）；没有音轨时返回 None"""
+    total = max(1, int(duration_ms * sample_rate / 1000))
+    mins = np.full(width, np.inf, dtype=np.float32)
+    maxs = np.full(width, -np.inf, dtype=np.float32)
+    sq_sum = np.zeros(width, dtype=np.float64)
+    counts = np.zeros(width, dtype=np.int64)
+    proc = subprocess.Popen([
+        "ffmpeg", "-hide_banner", "-loglevel", "error",
+        "-i", video_file,
+        "-vn", "-sn", "-map", "0:a:0?",
+        "-ac", "1", "-ar", str(sample_rate),
+        "-f", "s16le", "pipe:1",
+    ], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    offset = 0
+    try:
+        while True:
+            data = proc.stdout.read(CHUNK_SAMPLES * 2)
+            if not data:
+                break
+            samples = np.frombuffer(data[:len(data) // 2 * 2], dtype="<i2").astype(np.float32) / 32768.0
+            idx = np.arange(offset, offset + len(samples), dtype=np.int64)
+            bins = np.minimum(idx * width // total, width - 1)
+            # bins 单调不减，按列的起点分段归约
+            starts = np.flatnonzero(np.r_[True, bins[1:] != bins[:-1]])
+            cols = bins[starts]
+            mins[cols] = np.minimum(mins[cols], np.minimum.reduceat(samples, starts))
+            maxs[cols] = np.maximum(maxs[cols], np.maximum.reduceat(samples, starts))
+            sq_sum[cols] += np.add.reduceat(samples.astype(np.float64) ** 2, starts)
+            counts[cols] += np.diff(np.r_[starts, len(samples)])
+            offset += len(samples)
+    finally:
+        proc.stdout.close()
+        proc.wait()
+    if offset == 0:
+        return None
+    empty = counts == 0
+    mins[empty] = 0.0
+    maxs[empty] = 0.0
+    rms = np.sqrt(sq_sum / np.maximum(counts, 1)).astype(np.float32)
+    return {"min": mins, "max": maxs, "rms": rms}
+
+
+def cached_envelope(video_file, duration_ms, cache=None, width=STRIP_WIDTH):
+    key = None
+    if cache:
+        key = cache.key("wave", snapcache.fingerprint(video_file), width, SAMPLE_RATE)
+        cached = cache.get(key)
+        if cached:
+            with np.load(cached) as z:
+                return {k: z[k] for k in ("min", "max", "rms")}
+    env = audio_envelope(video_file, duration_ms, width)
+    if env is not None and key:
+        fd, tmp = tempfile.mkstemp(suffix=".npz")
+        os.close(fd)
+        np.savez(tmp, **env)
+        cache.put(key, tmp, move=True)
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    return env
+
+
+def render_strip(env, height=STRIP_HEIGHT):
+    """波形条 RGBA 数组 [height, width, 4]：浅色为峰值，实色为 RMS 响度，均按 dB 刻度以中线对称绘制"""
+    mid = (height - 1) / 2.0
+    rows = np.abs(np.arange(height, dtype=np.float32)[:, None] - mid)
+
+    def level(amplitude):
+        db = 20 * np.log10(np.maximum(amplitude, 1e-6))
+        return np.clip((db - SILENCE_DB) / -SILENCE_DB, 0, 1)[None, :] * mid
+
+    peak = rows <= level(np.maximum(np.abs(env["min"]), np.abs(env["max"])))
+    loud = rows <= level(env["rms"])
+    strip = np.zeros((height, len(env["rms"]), 4), dtype=np.uint8)
+    strip[peak] = PEAK_COLOR
+    strip[loud] = RMS_COLOR
+    strip[int(mid), :] = RMS_COLOR  # 中线
+    return strip
+
+
+def attach_strip(info_img, env, height=STRIP_HEIGHT):
+    """把波形条接在信息图下方（原地修改 info_img）"""
+    strip = render_strip(env, height)
+    if Image is not None:
+        header = Image.open(info_img).convert("RGBA")
+        out = Image.new("RGBA", (header.width, header.height + height + 10), (0, 0, 0, 0))
+        out.paste(header, (0, 0))
+        out.paste(Image.fromarray(strip, "RGBA"), (STRIP_MARGIN, header.height))
+        out.save(info_img)
+        return info_img
+    raw = info_img + ".rgba"
+    strip.tofile(raw)
+    try:
+        w, h = strip.shape[1], strip.shape[0]
+        subprocess.run([
+            "magick", info_img,
+            "-background", "none", "-gravity", "south", "-splice", f"0x{h + 10}",
+            "(", "-size", f"{w}x{h}", "-depth", "8", f"rgba:{raw}", ")",
+            "-gravity", "southwest", "-geometry", f"+{STRIP_MARGIN}+10", "-composite",
+            info_img,
+        ])
+    finally:
+        os.remove(raw)
+    return info_img
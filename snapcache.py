@@ -0,0 +1,257 @@
+import os
+import sys
+import json
+import time
+import shutil
+import sqlite3
+import hashlib
+import argparse
+import threading
+import collections
+
+# --- 内容寻址的中间产物缓存（抽出的帧、带时间戳的格子、信息图、最终故事板） ---
+#
+# 键 = 阶段名 + sha256(源文件指纹 + 阶段参数)；源文件指纹由大小、修改时间和
+# 首/中/尾三段内容的哈希组成，大文件也只需读取 192KB。
+# 超出容量时按最近访问时间（LRU）淘汰。
+#
+# 用法:
+#   python snapcache.py stats
+#   python snapcache.py evict --max-size 1024
+#   python snapcache.py clear
+
+DEFAULT_ROOT = os.path.join(os.path.expanduser("~"), ".visualsnap", "cache")
+DEFAULT_MAX_MB = int(os.environ.get("VISUALSNAP_CACHE_MAX_MB", "2048"))
+SAMPLE_SIZE = 64 * 1024
+FINGERPRINT_MEMO_SIZE = 512  # 进程内记忆的指纹数，长期运行的服务按最近使用淘汰
+
+_fingerprints = collections.OrderedDict()
+_fingerprints_lock = threading.Lock()
+
+
+def fingerprint(path):
+    """文件指纹：大小 + mtime + 首/中/尾各 64KB 内容哈希（进程内按 stat 结果记忆）"""
+    path = os.path.realpath(path)
+    st = os.stat(path)
+    memo_key = (path, st.st_size, st.st_mtime_ns)
+    with _fingerprints_lock:
+        fp = _fingerprints.get(memo_key)
+        if fp:
+            _fingerprints.move_to_end(memo_key)
+            return fp
+    h = hashlib.blake2b(digest_size=16)
+    h.update(f"{st.st_size}:{st.st_mtime_ns}:".encode())
+    with open(path, "rb") as f:
+        if st.st_size <= 3 * SAMPLE_SIZE:
+            h.update(f.read())
+        else:
+            for offset in (0, st.st_size // 2 - SAMPLE_SIZE // 2, st.st_size - SAMPLE_SIZE):
+                f.seek(offset)
+                h.update(f.read(SAMPLE_SIZE))
+    fp = h.hexdigest()
+    with _fingerprints_lock:
+        _fingerprints[memo_key] = fp
+        while len(_fingerprints) > FINGERPRINT_MEMO_SIZE:
+            _fingerprints.popitem(last=False)
+    return fp
+
+
+class ArtifactCache:
+    def __init__(self, root=None, max_mb=None):
+        self.root = root or DEFAULT_ROOT
+        self.max_bytes = int((DEFAULT_MAX_MB if max_mb is None else max_mb) * 1024 * 1024)
+        os.makedirs(os.path.join(self.root, "objects"), exist_ok=True)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(os.path.join(self.root, "index.db"), check_same_thread=False, timeout=30)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS entries (
+                key TEXT PRIMARY KEY,
+                stage TEXT,
+                relpath TEXT,
+                size INTEGER,
+                created REAL,
+                last_access REAL
+            )""")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS entries_lru ON entries(last_access)")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS counters (
+                stage TEXT PRIMARY KEY,
+                hits INTEGER DEFAULT 0,
+                misses INTEGER DEFAULT 0
+            )""")
+        self.conn.commit()
+
+    def key(self, stage, *parts):
+        """由阶段名与任意可 JSON 序列化的参数生成缓存键"""
+        digest = hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+        return f"{stage}/{digest}"
+
+    def _count(self, stage, hit):
+        column = "hits" if hit else "misses"
+        self.conn.execute(f"INSERT INTO counters (stage, {column}) VALUES (?, 1) "
+                          f"ON CONFLICT(stage) DO UPDATE SET {column} = {column} + 1", (stage,))
+
+    def get(self, key):
+        """命中则返回缓存文件路径，否则返回 None"""
+        stage = key.split("/", 1)[0]
+        with self.lock:
+            row = self.conn.execute("SELECT relpath FROM entries WHERE key=?", (key,)).fetchone()
+            path = os.path.join(self.root, row[0]) if row else None
+            if path and not os.path.exists(path):
+                self.conn.execute("DELETE FROM entries WHERE key=?", (key,))
+                path = None
+            if path:
+                self.conn.execute("UPDATE entries SET last_access=? WHERE key=?", (time.time(), key))
+            self._count(stage, path is not None)
+            self.conn.commit()
+        return path
+
+    def fetch(self, key, dest):
+        """命中则复制到 dest 并返回 True；复制到临时文件再替换，不改动 dest 原有的 inode（可能是硬链接）"""
+        path = self.get(key)
+        if not path:
+            return False
+        tmp = f"{dest}.{os.getpid()}.{threading.get_ident()}.fetch"
+        try:
+            shutil.copyfile(path, tmp)
+            os.replace(tmp, dest)
+        except OSError:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            return False
+        return True
+
+    def put(self, key, src, move=False):
+        """把 src 存入缓存，返回缓存中的路径"""
+        if self.max_bytes <= 0 or not os.path.exists(src):
+            return src
+        stage, digest = key.split("/", 1)
+        ext = os.path.splitext(src)[1]
+        relpath = os.path.join("objects", stage, digest[:2], digest + ext)
+        path = os.path.join(self.root, relpath)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        if move:
+            shutil.move(src, tmp)
+        else:
+            shutil.copyfile(src, tmp)
+        os.replace(tmp, path)
+        now = time.time()
+        with self.lock:
+            self.conn.execute("INSERT OR REPLACE INTO entries (key, stage, relpath, size, created, last_access) "
+                              "VALUES (?, ?, ?, ?, ?, ?)", (key, stage, relpath, os.path.getsize(path), now, now))
+            self.conn.commit()
+        self.evict()
+        return path
+
+    def total_size(self):
+        with self.lock:
+            return self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+
+    def evict(self, max_bytes=None):
+        """按 LRU 淘汰直到总大小不超过上限，返回删除的条目数"""
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        removed = 0
+        with self.lock:
+            total = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+            if total <= max_bytes:
+                return 0
+            for key, relpath, size in self.conn.execute(
+                    "SELECT key, relpath, size FROM entries ORDER BY last_access").fetchall():
+                if total <= max_bytes:
+                    break
+                try:
+                    os.remove(os.path.join(self.root, relpath))
+                except FileNotFoundError:
+                    pass
+                except OSError:
+                    continue  # Windows 下正在被读取的文件暂时删不掉
+                self.conn.execute("DELETE FROM entries WHERE key=?", (key,))
+                total -= size
+                removed += 1
+            self.conn.commit()
+        return removed
+
+    def stats(self):
+        with self.lock:
+            stages = {}
+            for stage, count, size in self.conn.execute(
+                    "SELECT stage, COUNT(*), COALESCE(SUM(size), 0) FROM entries GROUP BY stage"):
+                stages[stage] = {"entries": count, "bytes": size, "hits": 0, "misses": 0}
+            for stage, hits, misses in self.conn.execute("SELECT stage, hits, misses FROM counters"):
+                s = stages.setdefault(stage, {"entries": 0, "bytes": 0})
+                s["hits"], s["misses"] = hits, misses
+        for s in stages.values():
+            lookups = s["hits"] + s["misses"]
+            s["hit_rate"] = round(s["hits"] / lookups, 3) if lookups else None
+        return stages
+
+    def clear(self):
+        with self.lock:
+            shutil.rmtree(os.path.join(self.root, "objects"), ignore_errors=True)
+            os.makedirs(os.path.join(self.root, "objects"), exist_ok=True)
+            self.conn.execute("DELETE FROM entries")
+            self.conn.execute("DELETE FROM counters")
+            self.conn.commit()
+
+
+_default_cache = None
+
+
+def default_cache():
+    """进程内共享的默认缓存"""
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = ArtifactCache()
+    return _default_cache
+
+
+_inherited = []  # fork 前的缓存对象，留着引用，避免子进程回收时关闭父进程的 SQLite 连接
+
+
+def _reset_in_child():
+    # SQLite 连接不能跨 fork 使用：进程池 fork 出的子进程第一次调用 default_cache() 时重新打开；
+    # fork 时可能被其他线程持有的锁也换成新的
+    global _default_cache, _fingerprints_lock
+    if _default_cache is not None:
+        _inherited.append(_default_cache)
+        _default_cache = None
+    _fingerprints_lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_in_child)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="visualsnap 中间产物缓存")
+    parser.add_argument("--root", default=DEFAULT_ROOT, help="缓存目录")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("stats", help="显示各阶段的条目数、大小与命中率")
+    evict = sub.add_parser("evict", help="按 LRU 淘汰到指定大小")
+    evict.add_argument("--max-size", type=float, default=DEFAULT_MAX_MB, help="上限（MB）")
+    sub.add_parser("clear", help="清空缓存")
+    args = parser.parse_args(argv)
+
+    cache = ArtifactCache(args.root)
+    if args.command == "stats":
+        stages = cache.stats()
+        total = sum(s["bytes"] for s in stages.values())
+        print(f"缓存目录: {cache.root}")
+        print(f"总大小: {total / 1024 / 1024:.1f} MB / 上限 {cache.max_bytes / 1024 / 1024:.0f} MB")
+        print(f"{'阶段':<12}{'条目':>8}{'大小(MB)':>10}{'命中':>8}{'未命中':>8}{'命中率':>8}")
+        for stage, s in sorted(stages.items()):
+            rate = "-" if s["hit_rate"] is None else f"{s['hit_rate'] * 100:.0f}%"
+            print(f"{stage:<12}{s['entries']:>8}{s['bytes'] / 1024 / 1024:>10.1f}{s['hits']:>8}{s['misses']:>8}{rate:>8}")
+    elif args.command == "evict":
+        removed = cache.evict(int(args.max_size * 1024 * 1024))
+        print(f"[INFO] 淘汰 {removed} 个条目")
+    elif args.command == "clear":
+        cache.clear()
+        print("[INFO] 缓存已清空")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,789 @@
+import os
+import json
+import glob
+import math
+import time
+import shutil
+import subprocess
+import bisect
+import hashlib
+import tempfile
+import functools
+import dataclasses
+import concurrent.futures
+
+import snapcache
+import snapinfo
+import snapproxy
+import snaplog
+
+try:
+    from PIL import Image, ImageDraw, ImageFont
+except ImportError:  # 没有 Pillow 时退回 ImageMagick 逐版式拼接
+    Image = None
+
+try:
+    import snapscore
+except ImportError:  # 没有 numpy 时不支持窗口择优
+    snapscore = None
+
+try:
+    import snapaudio
+except ImportError:  # 没有 numpy 时不支持音频波形
+    snapaudio = None
+
+try:
+    import snapframes
+except ImportError:  # 没有 numpy 时不使用帧存储
+    snapframes = None
+
+try:
+    import snapdecode
+except ImportError:  # 没有 numpy 时只能用 ffmpeg 命令行抽帧
+    snapdecode = None
+
+# 后台任务（音频波形等），与抽帧并行
+_background = concurrent.futures.ThreadPoolExecutor(max_workers=2, thread_name_prefix="snap-bg")
+
+# --- 无界面的抽帧 / 故事板流水线，供 GUI 与后台服务共用 ---
+
+log = snaplog.get_logger("core")
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+PATTERN_DIR = os.path.join(SCRIPT_DIR, "pattern")
+VIDEO_EXTS = (".mp4", ".mkv", ".avi", ".mov", ".ts")
+STORYBOARD_FORMATS = ("jpg", "png", "webp")
+LAYOUTS_FILE = os.path.join(SCRIPT_DIR, "layouts.json")
+TIMESTAMP_FONTS = ["consolai.ttf", "Consolas-Italic.ttf", "DejaVuSansMono-Oblique.ttf", "DejaVuSansMono.ttf"]
+PIPELINE_VERSION = 3  # 修改抽帧/标注/拼接参数时递增，使旧缓存失效
+TEMP_FILES = ["out.png", "output.txt", "montaged.png", "Snaps.png", "Tiles.jpg"]
+
+
+def ms_to_timestamp(t_ms):
+    """毫秒 -> HH.MM.SS.mmm（用于文件名与时间戳标注）"""
+    totalSec = t_ms // 1000
+    ms = t_ms % 1000
+    h = totalSec // 3600
+    m = (totalSec % 3600) // 60
+    s = totalSec % 60
+    return f"{h:02}.{m:02}.{s:02}.{ms:03}"
+
+
+def screenshot_path(out_dir, t_ms):
+    return os.path.join(out_dir, f"Screenshot={ms_to_timestamp(t_ms)}=.jpg")
+
+
+def timestamp_from_path(path):
+    """Screenshot=HH.MM.SS.mmm=.jpg -> HH.MM.SS.mmm"""
+    parts = os.path.basename(path).split("=")
+    return parts[1] if len(parts) == 3 else None
+
+
+def timestamp_to_ms(timestamp):
+    """HH.MM.SS.mmm -> 毫秒"""
+    h, m, s, ms = (int(x) for x in timestamp.split("."))
+    return ((h * 60 + m) * 60 + s) * 1000 + ms
+
+
+def is_video_file(path):
+    return path.lower().endswith(VIDEO_EXTS)
+
+
+def content_hash(path):
+    """小文件（截图、pattern、模板）的完整内容哈希"""
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+# --- 帧集合：按时间排序，同一时间点只保留一帧 ---
+class FrameRecord:
+    __slots__ = ("t_ms", "path", "buffer", "source", "scores", "widget")
+
+    def __init__(self, t_ms, path=None, buffer=None, source="manual", scores=None, widget=None):
+        self.t_ms = int(t_ms)
+        self.path = path  # 截图文件
+        self.buffer = buffer  # 或帧存储中的像素视图
+        self.source = source  # manual / auto / restored
+        self.scores = scores
+        self.widget = widget  # GUI 中对应的缩略图
+
+    @property
+    def timestamp(self):
+        return ms_to_timestamp(self.t_ms)
+
+    def __repr__(self):
+        return f"FrameRecord({self.timestamp}, {self.source})"
+
+
+class FrameCollection:
+    """按 t_ms 排序的帧记录。按时间查记录 O(1)（字典），求位置 O(log n)（二分）；
+    插入 / 删除是 list.insert / del，需要移动其后的元素，为 O(n)。帧数在数百到数千之间，
+    移动的是一段连续的整数指针（一次 memmove），比纯 Python 的平衡树更快，GUI 中插入缩略图控件本身也是 O(n)"""
+
+    def __init__(self, records=()):
+        self._times = []
+        self._records = {}
+        for record in records:
+            self.add(record)
+
+    def add(self, record):
+        """插入并返回 (所在位置, 是否新增)；时间点已存在时保留原记录"""
+        i = bisect.bisect_left(self._times, record.t_ms)
+        if record.t_ms in self._records:
+            return i, False
+        self._times.insert(i, record.t_ms)
+        self._records[record.t_ms] = record
+        return i, True
+
+    def remove(self, t_ms):
+        """删除并返回该时间点的记录，不存在时返回 None"""
+        record = self._records.pop(int(t_ms), None)
+        if record is not None:
+            del self._times[bisect.bisect_left(self._times, record.t_ms)]
+        return record
+
+    def get(self, t_ms):
+        return self._records.get(int(t_ms))
+
+    def index(self, t_ms):
+        return bisect.bisect_left(self._times, int(t_ms))
+
+    def clear(self):
+        self._times.clear()
+        self._records.clear()
+
+    def __contains__(self, t_ms):
+        return int(t_ms) in self._records
+
+    def __len__(self):
+        return len(self._times)
+
+    def __iter__(self):
+        return (self._records[t] for t in self._times)
+
+
+# --- 版式 ---
+@dataclasses.dataclass(frozen=True)
+class LayoutProfile:
+    name: str
+    columns: int = 3
+    cell_width: int = 600
+    gap: int = 5  # 每个格子四周的留白（同 montage -geometry +5+5）
+    canvas_width: int = 1920
+    header: bool = True
+    pattern: str = None  # None: 使用当前选择的 pattern；"none": 白底；其他: pattern 文件名
+
+
+LAYOUT_PROFILES = {
+    "default": LayoutProfile("default"),
+    "4col": LayoutProfile("4col", columns=4, cell_width=460),
+    "preview": LayoutProfile("preview", columns=4, cell_width=200, gap=2, canvas_width=840, header=False),
+    "print": LayoutProfile("print", columns=3, cell_width=1280, gap=10, canvas_width=3900),
+}
+
+
+def load_layout_profiles():
+    """内置版式 + layouts.json 中的自定义版式（同名覆盖）"""
+    profiles = dict(LAYOUT_PROFILES)
+    if os.path.exists(LAYOUTS_FILE):
+        with open(LAYOUTS_FILE, "r", encoding="utf-8") as f:
+            for name, fields in json.load(f).items():
+                profiles[name] = LayoutProfile(name, **fields)
+    return profiles
+
+
+def parse_layout(spec, profiles=None):
+    """版式名，或形如 4x 的列数写法（其余参数取默认）"""
+    profiles = profiles or load_layout_profiles()
+    if spec in profiles:
+        return profiles[spec]
+    columns = str(spec).lower().rstrip("x")
+    if columns.isdigit() and 1 <= int(columns) <= 12:
+        if int(columns) == 3:
+            return profiles["default"]
+        return LayoutProfile(f"{columns}x", columns=int(columns))
+    raise ValueError(f"未知版式: {spec}")
+
+
+def storyboard_name(video_file, profile=None, fmt="jpg"):
+    suffix = "" if profile is None or profile.name == "default" else f"-{profile.name}"
+    return f"Storyboard-{os.path.basename(video_file)}{suffix}.{fmt}"
+
+
+def profile_pattern(profile, pattern_file):
+    if profile.pattern is None:
+        return pattern_file
+    if profile.pattern == "none":
+        return None
+    return find_pattern(profile.pattern) or pattern_file
+
+
+# --- 探测 ---
+def probe_duration_ms(video_file, cache=None):
+    """视频轨时长（ms），没有时用容器时长；探测结果按视频缓存"""
+    tracks = snapinfo.probe(video_file, cache)
+    for track in snapinfo.tracks_of(tracks, "Video") + snapinfo.tracks_of(tracks, "General"):
+        if track.get("Duration"):
+            return int(float(track["Duration"]) * 1000)
+    raise RuntimeError(f"无法获取时长: {video_file}")
+
+
+def snap_times(duration_ms, steps, offset=1000):
+    """在 [offset, duration - offset] 内均匀取 steps 个时间点"""
+    if steps <= 1:
+        return [duration_ms // 2]
+    return [offset + int(i * (duration_ms - 2 * offset) / (steps - 1)) for i in range(steps)]
+
+
+def refine_time(video_file, t_ms, best_window_ms, duration_ms=None, cache=None, proxy=None):
+    """best_window_ms > 0 时在 t_ms 附近的窗口内挑最清晰、曝光最好的一帧，返回 (时间, 得分)
+    proxy: snapproxy.Proxy，给出时在低分辨率代理上解码打分，返回的仍是源文件上的时间"""
+    if not best_window_ms or snapscore is None:
+        return t_ms, {}
+    if proxy is not None:
+        best, scores = snapscore.best_in_window(proxy.path, proxy.to_proxy(t_ms), best_window_ms,
+                                                duration_ms=duration_ms, cache=cache)
+        return proxy.to_source(best), scores
+    return snapscore.best_in_window(video_file, t_ms, best_window_ms, duration_ms=duration_ms, cache=cache)
+
+
+# --- 抽帧与标注 ---
+def open_decoder(video_file, decoder=None, cache=None):
+    """decoder: None（直接调用 ffmpeg）、ffmpeg、pyav 或 auto（测速后选最快的）"""
+    if not decoder:
+        return None
+    if snapdecode is None:
+        log.warning(f"解码后端 {decoder} 需要 numpy，改用 ffmpeg 命令行")
+        return None
+    return snapdecode.open_backend(video_file, decoder, cache)
+
+
+def extract_frame(video_file, t_ms, outfile, cache=None, backend=None):
+    """在 t_ms 处抽取一帧（有缓存时同一源文件同一时间点只抽一次）；backend 为 snapdecode 后端，默认用 ffmpeg。
+    先写到临时文件再替换 outfile：已有的 outfile 可能与原图存储中的原图是同一个 inode"""
+    key = None
+    if cache:
+        key = cache.key("frame", snapcache.fingerprint(video_file), t_ms, PIPELINE_VERSION)
+        if cache.fetch(key, outfile):
+            return outfile
+    tmp = outfile + ".extract.jpg"
+    if backend is not None:
+        backend.save_frame(t_ms, tmp)
+    else:
+        h, m, s, ms = ms_to_timestamp(t_ms).split(".")
+        subprocess.run([
+            "ffmpeg", "-hide_banner", "-loglevel", "error", "-y",
+            "-ss", f"{h}:{m}:{s}.{ms}",
+            "-i", video_file,
+            "-frames:v", "1",
+            "-q:v", "2",
+            tmp
+        ])
+    if os.path.exists(tmp):
+        os.replace(tmp, outfile)
+        if key:
+            cache.put(key, outfile)
+    return outfile
+
+
+def annotate_timestamp(image_file, timestamp, cache=None, width=600):
+    """缩放到 width 宽并在左下角写入时间戳。结果写到新文件再替换 image_file，
+    不改动原来的 inode（原图可能以硬链接保存在原图存储中）"""
+    out_file = image_file + ".annotated.jpg"
+    key = None
+    if cache:
+        key = cache.key("cell", content_hash(image_file), timestamp, width, PIPELINE_VERSION)
+        if cache.fetch(key, out_file):
+            os.replace(out_file, image_file)
+            return
+    subprocess.run([
+        "magick", image_file,
+        "-resize", f"{width}x",
+        "-gravity", "SouthWest",
+        "-font", "Consolas-Italic",
+        "-pointsize", str(round(24 * width / 600)),
+        "-fill", "white",
+        "-stroke", "black",
+        "-strokewidth", "4",
+        "-annotate", "+10+10", timestamp,
+        "-fill", "white",
+        "-stroke", "none",
+        "-annotate", "+10+10", timestamp,
+        out_file
+    ])
+    if not os.path.exists(out_file):
+        break_link(image_file)  # 未标注的截图留在原处，之后的原地写入不能改到原图
+        return
+    os.replace(out_file, image_file)
+    if key:
+        cache.put(key, image_file)
+
+
+def break_link(path):
+    """path 与其他文件共享 inode（原图存储的硬链接）时换成独立副本"""
+    try:
+        if os.stat(path).st_nlink <= 1:
+            return
+    except FileNotFoundError:
+        return
+    tmp = path + ".unlink.tmp"
+    shutil.copyfile(path, tmp)
+    os.replace(tmp, path)
+
+
+# --- 抽帧预算：帧数随时长增长、按章节长度分配、按实测单帧耗时封顶 ---
+COST_SAMPLES = 2  # 测量单帧耗时时抽取的帧数
+
+
+@dataclasses.dataclass(frozen=True)
+class FrameBudget:
+    density: float = 8.0  # 基础帧数 = density * sqrt(时长分钟数)：2 分钟约 11 帧，3 小时约 107 帧
+    min_frames: int = 6
+    max_frames: int = 120
+    target_s: float = None  # 抽帧总耗时目标（秒），按实测单帧耗时折算成帧数上限；None 表示不限
+    min_chapter_ms: int = 5000  # 更短的章节并入相邻章节
+
+    def base_frames(self, duration_ms):
+        frames = round(self.density * math.sqrt(max(duration_ms, 0) / 60000))
+        return max(self.min_frames, min(self.max_frames, frames))
+
+
+def chapter_spans(video_file, duration_ms, cache=None, min_ms=0):
+    """章节区间 [(起点, 终点)]；没有章节时整段视频为一章"""
+    starts = [t for t, _ in snapinfo.chapters(snapinfo.probe(video_file, cache)) if 0 < t < duration_ms]
+    bounds = [0] + starts + [duration_ms]
+    spans = []
+    for start, end in zip(bounds, bounds[1:]):
+        if spans and end - start < min_ms:
+            spans[-1] = (spans[-1][0], end)
+        else:
+            spans.append((start, end))
+    if len(spans) > 1 and spans[0][1] - spans[0][0] < min_ms:
+        spans[:2] = [(spans[0][0], spans[1][1])]
+    return spans
+
+
+def allocate_frames(spans, total):
+    """按章节长度比例分配 total 帧（最大余数法）；帧数不少于章节数时每章至少一帧"""
+    lengths = [end - start for start, end in spans]
+    whole = sum(lengths) or 1
+    counts = [1 if total >= len(spans) else 0 for _ in spans]
+    shares = [(total - sum(counts)) * length / whole for length in lengths]
+    counts = [c + int(share) for c, share in zip(counts, shares)]
+    by_remainder = sorted(range(len(spans)), key=lambda i: shares[i] - int(shares[i]), reverse=True)
+    for i in by_remainder[:total - sum(counts)]:
+        counts[i] += 1
+    return counts
+
+
+def frame_cost(video_file, duration_ms, best_window_ms=0, cache=None, backend=None):
+    """单帧抽取（含窗口择优）的实测耗时（秒），按视频、解码后端与择优窗口缓存"""
+    key = None
+    if cache:
+        key = cache.key("cost", snapcache.fingerprint(video_file), backend.name if backend else "cli",
+                        best_window_ms, COST_SAMPLES)
+        cached = cache.get(key)
+        if cached:
+            with open(cached, "r", encoding="utf-8") as f:
+                return json.load(f)["seconds"]
+    # 测量时不读缓存，否则命中的帧会让耗时偏低
+    work_dir = tempfile.mkdtemp(prefix="visualsnap-cost-")
+    start = time.perf_counter()
+    try:
+        for i in range(COST_SAMPLES):
+            t_ms = int(duration_ms * (i + 1) / (COST_SAMPLES + 1))
+            t_ms, _ = refine_time(video_file, t_ms, best_window_ms, duration_ms)
+            extract_frame(video_file, t_ms, screenshot_path(work_dir, t_ms), backend=backend)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    seconds = (time.perf_counter() - start) / COST_SAMPLES
+    if key:
+        fd, tmp = tempfile.mkstemp(suffix=".json")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump({"seconds": seconds}, f)
+        cache.put(key, tmp, move=True)
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    return seconds
+
+
+def budget_times(video_file, budget, duration_ms=None, best_window_ms=0, cache=None, backend=None):
+    """按预算给出抽帧时间点：每章内均匀分布在各小段的中点，避开章节边界的黑场与片头卡"""
+    duration_ms = duration_ms or probe_duration_ms(video_file, cache)
+    spans = chapter_spans(video_file, duration_ms, cache, budget.min_chapter_ms)
+    total = budget.base_frames(duration_ms)
+    note = ""
+    if budget.target_s:
+        cost = frame_cost(video_file, duration_ms, best_window_ms, cache, backend)
+        if cost > 0 and budget.target_s / cost < total:
+            total = max(1, int(budget.target_s / cost))
+            note = f"，受 {budget.target_s:g}s 目标耗时限制（单帧 {cost:.2f}s）"
+    times = []
+    for (start, end), count in zip(spans, allocate_frames(spans, total)):
+        times += [start + int((i + 0.5) * (end - start) / count) for i in range(count)]
+    log.info(f"抽帧预算: 时长 {ms_to_timestamp(duration_ms)}，{len(spans)} 章，{len(times)} 帧{note}")
+    return times
+
+
+# --- 视频信息图片 ---
+def start_waveform(video_file, duration_ms=None, cache=None):
+    """在后台线程计算音频包络，返回 Future（不支持时返回 None）"""
+    if snapaudio is None:
+        return None
+
+    def job():
+        return snapaudio.cached_envelope(video_file, duration_ms or probe_duration_ms(video_file, cache), cache=cache)
+    return _background.submit(job)
+
+
+def generate_video_info_image(video_file, work_dir, cache=None, waveform=None):
+    """waveform: snapaudio 的包络结果，给出时在信息文字下方加波形条"""
+    out_img = os.path.join(work_dir, "out.png")
+    key = None
+    if cache:
+        key = cache.key("info", snapcache.fingerprint(video_file), os.path.basename(video_file),
+                        waveform is not None, PIPELINE_VERSION)
+        if cache.fetch(key, out_img):
+            return out_img
+    lines = snapinfo.header_lines(video_file, snapinfo.probe(video_file, cache))
+    if snapinfo.Image is not None:
+        strip = None
+        if waveform is not None:
+            strip = snapinfo.Image.fromarray(snapaudio.render_strip(waveform), "RGBA")
+        snapinfo.render_header(lines, strip).save(out_img, compress_level=1)
+    else:
+        snapinfo.render_header_magick(lines, out_img)
+        if waveform is not None:
+            snapaudio.attach_strip(out_img, waveform)
+    if key:
+        cache.put(key, out_img)
+    return out_img
+
+
+# --- 拼接故事板 ---
+def compose_storyboard(video_file, files, pattern_file, work_dir, info_img=None, out_dir=None, profile=None, fmt="jpg",
+                       cache=None):
+    """montage 截图 -> 扩展到画布宽度 -> 叠加信息图 -> 平铺 pattern 背景，返回最终文件路径"""
+    profile = profile or LAYOUT_PROFILES["default"]
+    pattern_file = profile_pattern(profile, pattern_file)
+    info_img = info_img if profile.header else None
+    out_dir = out_dir or work_dir
+    final_file = os.path.join(out_dir, storyboard_name(video_file, profile, fmt))
+    key = None
+    if cache:
+        # 信息图由视频指纹唯一决定，截图按内容计算
+        key = cache.key("storyboard", snapcache.fingerprint(video_file), bool(info_img),
+                        [content_hash(f) for f in files], content_hash(pattern_file) if pattern_file else None,
+                        dataclasses.astuple(profile), fmt, PIPELINE_VERSION)
+        if cache.fetch(key, final_file):
+            return final_file
+    montage_file = os.path.join(work_dir, "montaged.png")
+    subprocess.run(["magick", "montage"] + files + [
+        "-background", "none",
+        "-geometry", f"{profile.cell_width}x+{profile.gap}+{profile.gap}",
+        "-tile", f"{profile.columns}x", montage_file])
+
+    # 扩展到画布宽度，垂直居中
+    subprocess.run([
+        "magick", montage_file,
+        "-background", "none",
+        "-gravity", "center",
+        "-extent", f"{profile.canvas_width}x",
+        montage_file
+    ])
+
+    # 合并视频信息图片和 montage
+    if info_img and os.path.exists(info_img):
+        snaps_file = os.path.join(work_dir, "Snaps.png")
+        subprocess.run(["magick", "montage", info_img, montage_file, "-background", "none",
+                        "-geometry", f"{profile.canvas_width}x+0+0", "-tile", "1x2", snaps_file])
+        final_input = snaps_file
+    else:
+        final_input = montage_file
+
+    # Pattern处理
+    width, height = map(int, subprocess.check_output(["magick", "identify", "-format", "%w %h", final_input]).decode().strip().split())
+    tiles_file = os.path.join(work_dir, "Tiles.jpg")
+    if pattern_file:
+        subprocess.run(["magick", "-size", f"{width}x{height}", "tile:" + pattern_file, tiles_file])
+    else:
+        subprocess.run(["magick", "-size", f"{width}x{height}", "canvas:white", tiles_file])
+
+    subprocess.run(["magick", "composite", "-type", "truecolor", final_input, tiles_file, final_file])
+    if key:
+        cache.put(key, final_file)
+    return final_file
+
+
+# --- 多版式：帧只解码一次，各版式并行拼接 ---
+@functools.lru_cache(maxsize=16)
+def timestamp_font(size):
+    for name in TIMESTAMP_FONTS:
+        try:
+            return ImageFont.truetype(name, size)
+        except OSError:
+            continue
+    return ImageFont.load_default()
+
+
+def draw_timestamp(cell, timestamp, scale):
+    """与 annotate_timestamp 相同的样式：左下角 +10+10，白字黑描边"""
+    draw = ImageDraw.Draw(cell)
+    font = timestamp_font(max(8, round(24 * scale)))
+    margin = round(10 * scale)
+    left, top, right, bottom = draw.textbbox((0, 0), timestamp, font=font)
+    draw.text((margin - left, cell.height - margin - bottom), timestamp, font=font, fill="white",
+              stroke_width=max(1, round(2 * scale)), stroke_fill="black")
+
+
+@functools.lru_cache(maxsize=8)
+def load_pattern(pattern_file):
+    img = Image.open(pattern_file).convert("RGB")
+    img.load()
+    return img
+
+
+def tile_pattern(pattern_file, width, height):
+    if not pattern_file:
+        return Image.new("RGB", (width, height), "white")
+    tile = load_pattern(pattern_file)
+    row = Image.new("RGB", (width, tile.height))
+    for x in range(0, width, tile.width):
+        row.paste(tile, (x, 0))
+    canvas = Image.new("RGB", (width, height))
+    for y in range(0, height, tile.height):
+        canvas.paste(row, (0, y))
+    return canvas
+
+
+def decode_frame(path, max_width):
+    img = Image.open(path)
+    # JPEG 可在解码时直接按 1/2、1/4、1/8 缩小，多数版式用不到原始分辨率
+    img.draft("RGB", (max_width, max_width * img.height // max(img.width, 1)))
+    img = img.convert("RGB")
+    img.load()
+    return img
+
+
+def render_profile(decoded, header, profile, pattern_file, out_file):
+    """decoded: [(Image, 时间戳或 None)]，时间戳为 None 表示图片已自带时间戳"""
+    scale = profile.cell_width / 600
+    cells = []
+    for img, timestamp in decoded:
+        height = max(1, round(img.height * profile.cell_width / img.width))
+        cell = img.resize((profile.cell_width, height), Image.LANCZOS)
+        if cell.mode != "RGB":  # 帧存储中的 RGBX
+            cell = cell.convert("RGB")
+        if timestamp:
+            draw_timestamp(cell, timestamp, scale)
+        cells.append(cell)
+    columns = min(profile.columns, len(cells))
+    rows = math.ceil(len(cells) / columns)
+    cell_height = max(c.height for c in cells)
+    pitch_w = profile.cell_width + 2 * profile.gap
+    pitch_h = cell_height + 2 * profile.gap
+    grid_width = columns * pitch_w
+    width = max(profile.canvas_width, grid_width)
+
+    header_img = None
+    if header is not None and profile.header:
+        header_img = header if header.width == width else header.resize(
+            (width, round(header.height * width / header.width)), Image.LANCZOS)
+    top = header_img.height if header_img else 0
+
+    canvas = tile_pattern(profile_pattern(profile, pattern_file), width, top + rows * pitch_h)
+    if header_img:
+        canvas.paste(header_img, (0, 0), header_img)
+    x0 = (width - grid_width) // 2
+    for i, cell in enumerate(cells):
+        row, col = divmod(i, columns)
+        x = x0 + col * pitch_w + profile.gap
+        y = top + row * pitch_h + profile.gap + (cell_height - cell.height) // 2
+        canvas.paste(cell, (x, y))
+    canvas.save(out_file, quality=92)
+    return out_file
+
+
+def stored_frames(frames, store):
+    """把带时间戳的帧放进帧存储（已在其中的跳过），返回各帧在存储中的时间（不可用时为 None）"""
+    times = []
+    for path, timestamp in frames:
+        t_ms = None
+        if store is not None and timestamp:
+            t_ms = timestamp_to_ms(timestamp)
+            if t_ms not in store:
+                if os.path.exists(path):
+                    store.put_image(t_ms, path)
+                else:
+                    t_ms = None
+        times.append(t_ms)
+    return times
+
+
+def render_layouts(video_file, frames, profiles, pattern_file, out_dir, info_img=None, fmt="jpg", cache=None,
+                   work_dir=None, store=None):
+    """frames: [(图片路径, 时间戳或 None)]；一次解码，按多个版式并行输出，返回输出路径列表
+    store: 可选的 snapframes.FrameStore，帧从映射内存读取，不再解码截图文件"""
+    if Image is None:
+        store = None
+    stored = stored_frames(frames, store)
+    results = [None] * len(profiles)
+    keys = [None] * len(profiles)
+    if cache:
+        frame_hashes = [(store.frame_hash(t) if t is not None else content_hash(path), timestamp)
+                        for (path, timestamp), t in zip(frames, stored)]
+        for i, profile in enumerate(profiles):
+            pattern = profile_pattern(profile, pattern_file)
+            keys[i] = cache.key("layout", snapcache.fingerprint(video_file), frame_hashes,
+                                bool(info_img and profile.header), content_hash(pattern) if pattern else None,
+                                dataclasses.astuple(profile), fmt, PIPELINE_VERSION)
+            out_file = os.path.join(out_dir, storyboard_name(video_file, profile, fmt))
+            if cache.fetch(keys[i], out_file):
+                results[i] = out_file
+    todo = [i for i, r in enumerate(results) if r is None]
+    if not todo:
+        return results
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=min(8, max(len(todo), len(frames)))) as pool:
+        if Image is not None:
+            max_width = max(profiles[i].cell_width for i in todo)
+            def load(i):
+                path, timestamp = frames[i]
+                if stored[i] is not None:
+                    return store.image(stored[i]), timestamp
+                return decode_frame(path, max_width), timestamp
+            decoded = list(pool.map(load, range(len(frames))))
+            header = None
+            if info_img and os.path.exists(info_img):
+                header = Image.open(info_img).convert("RGBA")
+                header.load()
+            futures = {i: pool.submit(render_profile, decoded, header, profiles[i], pattern_file,
+                                      os.path.join(out_dir, storyboard_name(video_file, profiles[i], fmt)))
+                       for i in todo}
+        else:
+            work_dir = work_dir or out_dir
+            futures = {i: pool.submit(_render_profile_magick, video_file, frames, profiles[i], pattern_file,
+                                      os.path.join(work_dir, f"layout-{profiles[i].name}"), out_dir, info_img, fmt)
+                       for i in todo}
+        for i, fut in futures.items():
+            results[i] = fut.result()
+            if keys[i]:
+                cache.put(keys[i], results[i])
+    return results
+
+
+def _render_profile_magick(video_file, frames, profile, pattern_file, profile_dir, out_dir, info_img, fmt):
+    os.makedirs(profile_dir, exist_ok=True)
+    try:
+        files = []
+        for idx, (path, timestamp) in enumerate(frames):
+            cell = os.path.join(profile_dir, f"cell-{idx:04}.jpg")
+            shutil.copyfile(path, cell)
+            if timestamp:
+                annotate_timestamp(cell, timestamp, width=profile.cell_width)
+            files.append(cell)
+        return compose_storyboard(video_file, files, pattern_file, profile_dir, info_img=info_img, out_dir=out_dir,
+                                  profile=profile, fmt=fmt)
+    finally:
+        shutil.rmtree(profile_dir, ignore_errors=True)
+
+
+def cleanup_temp_files(work_dir):
+    temp_files = [os.path.join(work_dir, f) for f in TEMP_FILES]
+    temp_files += glob.glob(os.path.join(work_dir, "Screenshot=*.jpg"))
+    for f in temp_files:
+        try:
+            os.remove(f)
+        except FileNotFoundError:
+            pass
+
+
+def find_pattern(name):
+    """按文件名在 pattern/ 目录中查找"""
+    path = os.path.join(PATTERN_DIR, os.path.basename(name))
+    return path if os.path.isfile(path) else None
+
+
+def default_pattern_file():
+    if os.path.isdir(PATTERN_DIR):
+        for f in sorted(os.listdir(PATTERN_DIR)):
+            if f.lower().endswith((".jpg", ".png")):
+                return os.path.join(PATTERN_DIR, f)
+    return None
+
+
+# --- 一步到位：自动抽帧 + 生成故事板（无界面） ---
+def auto_storyboard_key(cache, video_file, steps=30, pattern_file=None, profiles=None, fmt="jpg", best_window_ms=0,
+                        waveform=False, proxy=False, budget=None):
+    """整条流水线结果的缓存键：源文件不变、参数不变时可直接复用"""
+    profiles = profiles or [LAYOUT_PROFILES["default"]]
+    return cache.key("auto", snapcache.fingerprint(video_file), os.path.basename(video_file), steps,
+                     content_hash(pattern_file) if pattern_file else None,
+                     [dataclasses.astuple(p) for p in profiles], fmt, best_window_ms,
+                     bool(waveform and snapaudio), bool(proxy and best_window_ms),
+                     dataclasses.astuple(budget) if budget else None,
+                     PIPELINE_VERSION)
+
+
+def auto_storyboard(video_file, steps=30, pattern_file=None, out_dir=None, progress=None, profiles=None, fmt="jpg",
+                    cache=None, best_window_ms=0, waveform=False, decoder=None, proxy=False, budget=None):
+    """等价于 GUI 中 Open -> 自动抽帧 -> 生成故事板；按 profiles 输出多个版式，返回路径列表
+    decoder: 抽帧用的解码后端（ffmpeg / pyav / auto），默认直接调用 ffmpeg
+    proxy: 择优打分在低分辨率代理上进行（大文件），最终帧仍从源文件抽取
+    budget: FrameBudget，给出时忽略 steps，按时长、章节与目标耗时决定抽帧时间点"""
+    progress = progress or (lambda msg: None)
+    profiles = profiles or [LAYOUT_PROFILES["default"]]
+    out_dir = out_dir or os.path.dirname(os.path.abspath(video_file))
+    key = None
+    if cache and len(profiles) == 1:
+        key = auto_storyboard_key(cache, video_file, steps, pattern_file, profiles, fmt, best_window_ms, waveform,
+                                  proxy, budget)
+        final_file = os.path.join(out_dir, storyboard_name(video_file, profiles[0], fmt))
+        if cache.fetch(key, final_file):
+            progress("命中缓存")
+            return [final_file]
+    work_dir = tempfile.mkdtemp(prefix="visualsnap-")
+    backend = None
+    try:
+        duration_ms = probe_duration_ms(video_file, cache)
+        backend = open_decoder(video_file, decoder, cache)
+        proxy_file = None
+        if proxy and best_window_ms and snapscore is not None:
+            progress("生成低分辨率代理...")
+            proxy_file = snapproxy.ensure_proxy(video_file)
+        want_header = any(p.header for p in profiles)
+        waveform_future = start_waveform(video_file, duration_ms, cache) if waveform and want_header else None
+        if budget:
+            times = budget_times(video_file, budget, duration_ms, best_window_ms, cache, backend)
+        else:
+            times = snap_times(duration_ms, steps)
+        collection = FrameCollection()
+        for idx, t_ms in enumerate(times):
+            t_ms, scores = refine_time(video_file, t_ms, best_window_ms, duration_ms, cache=cache, proxy=proxy_file)
+            if t_ms in collection:  # 择优后与相邻点落在同一帧
+                continue
+            outfile = screenshot_path(work_dir, t_ms)
+            progress(f"[{idx+1}/{len(times)}] 截图时间 {ms_to_timestamp(t_ms)}")
+            extract_frame(video_file, t_ms, outfile, cache=cache, backend=backend)
+            if os.path.exists(outfile):
+                collection.add(FrameRecord(t_ms, outfile, source="auto", scores=scores))
+        frames = [(r.path, r.timestamp) for r in collection]
+        if not frames:
+            raise RuntimeError(f"未能从 {video_file} 抽取任何帧")
+        progress("生成视频信息图片...")
+        info_img = None
+        if want_header:
+            envelope = waveform_future.result() if waveform_future else None
+            info_img = generate_video_info_image(video_file, work_dir, cache=cache, waveform=envelope)
+        progress("拼接截图...")
+        results = render_layouts(video_file, frames, profiles, pattern_file, out_dir, info_img=info_img, fmt=fmt,
+                                 cache=cache, work_dir=work_dir)
+        if key:
+            cache.put(key, results[0])
+        return results
+    finally:
+        if backend is not None:
+            backend.close()
+        shutil.rmtree(work_dir, ignore_errors=True)
@@ -0,0 +1,407 @@
+import os
+import re
+import sys
+import json
+import math
+import time
+import bisect
+import contextlib
+import threading
+import shutil
+import argparse
+import tempfile
+import subprocess
+
+import numpy as np
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+try:
+    import av
+except ImportError:  # 没有 PyAV 时只有 ffmpeg 命令行后端
+    av = None
+
+import snapcache
+import snapinfo
+import snaplog
+
+# --- 可替换的解码后端：按时间取帧，统一返回 RGB uint8 数组 [h, w, 3] ---
+#
+#   ffmpeg  每帧启动一次 ffmpeg 进程（现有行为），输出 rawvideo 到管道
+#   pyav    进程内 libav：容器只打开一次，解码器上下文在多次 seek 之间复用；
+#           目标时间在已解码位置之后不远时直接顺序解码，不再 seek
+#
+# 用法:
+#   python snapdecode.py bench D:/rec/a.mkv --samples 8
+# 选 auto 时对视频做一次小规模测速，选出最快的后端并按视频指纹缓存结果。
+
+log = snaplog.get_logger("decode")
+SEQUENTIAL_WINDOW_MS = 3000  # 目标在当前位置之后这么近时顺序解码比 seek 更快
+SHOWINFO_PTS = re.compile(r"pts_time:\s*([-0-9.]+)")
+RING_MAX_MB = int(os.environ.get("VISUALSNAP_RING_MAX_MB", "512"))
+RING_SPAN_MS = 2000  # 暂停位置前后各预解码的时长上限
+BENCH_SAMPLES = 6
+JPEG_QUALITY = 95
+
+
+class DecodeBackend:
+    name = None
+
+    def __init__(self, video_file):
+        self.video_file = video_file
+
+    def frame_at(self, t_ms, width=None):
+        """t_ms 处（或之后第一帧）的 RGB 数组；width 给出时等比缩放"""
+        raise NotImplementedError
+
+    def save_frame(self, t_ms, outfile):
+        """把 t_ms 处的原始分辨率帧保存为 JPEG，返回 outfile"""
+        Image.fromarray(self.frame_at(t_ms)).save(outfile, quality=JPEG_QUALITY)
+        return outfile
+
+    def frames_between(self, start_ms, end_ms):
+        """顺序解码 [start_ms, end_ms) 内的每一帧，逐个产出 (t_ms, RGB 数组)"""
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class FFmpegCLIBackend(DecodeBackend):
+    name = "ffmpeg"
+
+    def __init__(self, video_file, cache=None):
+        super().__init__(video_file)
+        video = (snapinfo.tracks_of(snapinfo.probe(video_file, cache), "Video") or [{}])[0]
+        w, h = int(video.get("Width", 0)), int(video.get("Height", 0))
+        # mediainfo 给出的是存储尺寸；ffmpeg 默认按旋转元数据转正，竖拍视频的宽高要对调
+        if round(float(video.get("Rotation") or 0)) % 180 == 90:
+            w, h = h, w
+        self.size = (w, h)
+
+    def _frame_size(self):
+        w, h = self.size
+        if not w or not h:
+            # 尺寸为 0 时 read(0) 永远读不到结尾
+            raise RuntimeError(f"无法获取视频尺寸: {self.video_file}")
+        return w, h
+
+    def frame_at(self, t_ms, width=None):
+        w, h = self._frame_size()
+        if width and w:
+            w, h = width, max(2, round(h * width / w / 2) * 2)
+        proc = subprocess.run([
+            "ffmpeg", "-hide_banner", "-loglevel", "error",
+            "-ss", f"{t_ms / 1000:.3f}",
+            "-i", self.video_file,
+            "-frames:v", "1", "-an", "-sn",
+            "-vf", f"scale={w}:{h}",
+            "-f", "rawvideo", "-pix_fmt", "rgb24", "pipe:1",
+        ], capture_output=True)
+        if len(proc.stdout) < w * h * 3:
+            raise RuntimeError(f"ffmpeg 未能解码 {t_ms}ms: {proc.stderr.decode('utf-8', 'replace').strip()}")
+        return np.frombuffer(proc.stdout[:w * h * 3], dtype=np.uint8).reshape(h, w, 3)
+
+    def frames_between(self, start_ms, end_ms):
+        # 一个 ffmpeg 进程顺序输出整段；帧时间取自 showinfo（相对 -ss 位置）。
+        # 输出固定缩放到 self.size，元数据与实际帧尺寸不一致时也能按帧切分
+        w, h = self._frame_size()
+        proc = subprocess.Popen([
+            "ffmpeg", "-hide_banner", "-nostats", "-loglevel", "info",
+            "-ss", f"{start_ms / 1000:.3f}",
+            "-i", self.video_file,
+            "-t", f"{(end_ms - start_ms) / 1000:.3f}",
+            "-an", "-sn", "-vf", f"showinfo,scale={w}:{h}", "-fps_mode", "passthrough",
+            "-f", "rawvideo", "-pix_fmt", "rgb24", "pipe:1",
+        ], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        pts = []
+
+        def read_pts():
+            for line in proc.stderr:
+                m = SHOWINFO_PTS.search(line.decode("utf-8", "replace"))
+                if m:
+                    pts.append(float(m.group(1)))
+        reader = threading.Thread(target=read_pts, daemon=True)
+        reader.start()
+        try:
+            n = 0
+            while True:
+                data = proc.stdout.read(w * h * 3)
+                if len(data) < w * h * 3:
+                    break
+                # showinfo 在帧送出前打印，等它追上当前帧
+                deadline = time.time() + 1
+                while len(pts) <= n and reader.is_alive() and time.time() < deadline:
+                    time.sleep(0.001)
+                t = pts[n] if n < len(pts) else (pts[-1] if pts else 0.0)
+                # 向下取整，再用这个时间 -ss 仍落在同一帧
+                yield math.floor(start_ms + t * 1000), np.frombuffer(data, dtype=np.uint8).reshape(h, w, 3)
+                n += 1
+        finally:
+            proc.kill()
+            proc.wait()
+
+    def save_frame(self, t_ms, outfile):
+        # 与 snapcore.extract_frame 相同，由 ffmpeg 直接编码 JPEG
+        subprocess.run([
+            "ffmpeg", "-hide_banner", "-loglevel", "error", "-y",
+            "-ss", f"{t_ms / 1000:.3f}",
+            "-i", self.video_file,
+            "-frames:v", "1", "-q:v", "2",
+            outfile
+        ])
+        return outfile
+
+
+class PyAVBackend(DecodeBackend):
+    name = "pyav"
+
+    def __init__(self, video_file, cache=None):
+        if av is None:
+            raise RuntimeError("需要安装 PyAV (pip install av)")
+        super().__init__(video_file)
+        self.container = av.open(video_file)
+        self.stream = self.container.streams.video[0]
+        self.stream.thread_type = "AUTO"
+        # 时间戳不从 0 开始的文件（如 MPEG-TS），对外的时间与 ffmpeg -ss / mpv 一样相对流起点
+        start = self.stream.start_time
+        self.start_ms = float(start * self.stream.time_base * 1000) if start is not None else 0.0
+        self.decoder = None  # 当前解码位置上的帧迭代器
+        self.last_ms = None  # 最近一次解码出的帧时间
+
+    def _frames(self):
+        if self.decoder is None:
+            self.decoder = self.container.decode(self.stream)
+        return self.decoder
+
+    def _seek(self, t_ms):
+        # 只在 seek 时重置迭代器，解码器上下文由容器保留
+        self.container.seek(int((t_ms + self.start_ms) / 1000 / self.stream.time_base), stream=self.stream,
+                            backward=True)
+        self.decoder = None
+        self.last_ms = None
+
+    def decode_at(self, t_ms):
+        if self.last_ms is None or not (self.last_ms < t_ms <= self.last_ms + SEQUENTIAL_WINDOW_MS):
+            self._seek(t_ms)
+        frame = None
+        for frame in self._frames():
+            if frame.time is None:
+                continue
+            self.last_ms = frame.time * 1000 - self.start_ms
+            if self.last_ms >= t_ms - 1:
+                return frame
+        if frame is None:
+            raise RuntimeError(f"PyAV 未能解码 {t_ms}ms")
+        return frame  # 超出结尾时返回最后一帧
+
+    def frame_at(self, t_ms, width=None):
+        frame = self.decode_at(t_ms)
+        if width:
+            height = max(2, round(frame.height * width / frame.width / 2) * 2)
+            return frame.to_ndarray(format="rgb24", width=width, height=height)
+        return frame.to_ndarray(format="rgb24")
+
+    def save_frame(self, t_ms, outfile):
+        self.decode_at(t_ms).to_image().save(outfile, quality=JPEG_QUALITY)
+        return outfile
+
+    def frames_between(self, start_ms, end_ms):
+        self._seek(start_ms)
+        for frame in self._frames():
+            if frame.time is None:
+                continue
+            self.last_ms = frame.time * 1000 - self.start_ms
+            if self.last_ms >= end_ms:
+                break
+            if self.last_ms >= start_ms - 1:
+                yield math.floor(self.last_ms), frame.to_ndarray(format="rgb24")
+
+    def close(self):
+        self.decoder = None
+        self.container.close()
+
+
+BACKENDS = {"ffmpeg": FFmpegCLIBackend, "pyav": PyAVBackend}
+
+
+def available_backends():
+    names = ["ffmpeg"]
+    if av is not None and Image is not None:
+        names.append("pyav")
+    return names
+
+
+def benchmark(video_file, backends=None, samples=BENCH_SAMPLES, cache=None):
+    """各后端按相同的一组时间点取帧的总耗时（秒），出错的后端记为 None"""
+    duration_ms = max(1, int(duration_ms_of(video_file, cache)))
+    times = [int(duration_ms * (i + 0.5) / samples) for i in range(samples)]
+    results = {}
+    for name in backends or available_backends():
+        start = time.perf_counter()
+        try:
+            with BACKENDS[name](video_file, cache=cache) as backend:
+                work_dir = tempfile.mkdtemp(prefix="visualsnap-bench-")
+                try:
+                    for t_ms in times:
+                        backend.save_frame(t_ms, os.path.join(work_dir, f"{t_ms}.jpg"))
+                finally:
+                    shutil.rmtree(work_dir, ignore_errors=True)
+            results[name] = time.perf_counter() - start
+        except Exception as e:
+            log.warning(f"后端 {name} 测速失败: {e}")
+            results[name] = None
+    return results
+
+
+def duration_ms_of(video_file, cache=None):
+    for track in snapinfo.tracks_of(snapinfo.probe(video_file, cache), "General"):
+        if track.get("Duration"):
+            return float(track["Duration"]) * 1000
+    return 0
+
+
+def fastest_backend(video_file, cache=None):
+    """对视频测速一次并缓存结论，返回最快的后端名"""
+    names = available_backends()
+    if len(names) == 1:
+        return names[0]
+    key = None
+    if cache:
+        key = cache.key("decoder", snapcache.fingerprint(video_file), names)
+        cached = cache.get(key)
+        if cached:
+            with open(cached, "r", encoding="utf-8") as f:
+                return json.load(f)["backend"]
+    results = {k: v for k, v in benchmark(video_file, names, cache=cache).items() if v is not None}
+    best = min(results, key=results.get) if results else "ffmpeg"
+    log.info(f"解码后端测速 {results}，选用 {best}")
+    if key:
+        fd, tmp = tempfile.mkstemp(suffix=".json")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump({"backend": best, "seconds": results}, f)
+        cache.put(key, tmp, move=True)
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    return best
+
+
+def open_backend(video_file, name="auto", cache=None):
+    """按名称（ffmpeg / pyav / auto）为一个任务打开解码后端"""
+    if name in (None, "", "auto"):
+        name = fastest_backend(video_file, cache)
+    if name not in BACKENDS:
+        raise ValueError(f"未知解码后端: {name}")
+    return BACKENDS[name](video_file, cache=cache)
+
+
+# --- 播放头附近的预解码环形缓冲：逐帧步进与截图都直接取这里的帧 ---
+class FrameRing:
+    """按时间排序的已解码帧，总字节数不超过 max_mb；fill 在后台线程中运行，可被新的 fill 取消"""
+
+    def __init__(self, max_mb=RING_MAX_MB, span_ms=RING_SPAN_MS):
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.span_ms = span_ms
+        self.lock = threading.Lock()
+        self.times = []
+        self.frames = {}
+        self.bytes = 0
+        self.generation = 0  # 每次 fill / clear 递增，旧的填充线程看到后退出
+        self.thread = None
+
+    def clear(self):
+        with self.lock:
+            self.generation += 1
+            self.times, self.frames, self.bytes = [], {}, 0
+
+    def _add(self, generation, center_ms, t_ms, pixels):
+        with self.lock:
+            if generation != self.generation:
+                return False
+            if t_ms in self.frames:
+                return True
+            bisect.insort(self.times, t_ms)
+            self.frames[t_ms] = pixels
+            self.bytes += pixels.nbytes
+            # 超出上限时淘汰离中心最远的一帧
+            while self.bytes > self.max_bytes and len(self.times) > 1:
+                far = self.times[0] if center_ms - self.times[0] > self.times[-1] - center_ms else self.times[-1]
+                self.times.remove(far)
+                self.bytes -= self.frames.pop(far).nbytes
+                if far == t_ms:
+                    return False  # 这一方向已经装满
+            return True
+
+    def fill(self, open_backend, center_ms):
+        """后台解码 center_ms 前后各 span_ms 内的帧；open_backend() 在线程内创建自己的解码后端"""
+        self.clear()
+        with self.lock:
+            generation = self.generation
+        start_ms = max(0, center_ms - self.span_ms)
+
+        def job():
+            try:
+                with open_backend() as backend, \
+                        contextlib.closing(backend.frames_between(start_ms, center_ms + self.span_ms)) as frames:
+                    # 每帧检查是否已被新的 fill / clear 取消；退出时关闭生成器，ffmpeg 进程随之结束
+                    for t_ms, pixels in frames:
+                        if generation != self.generation:
+                            break
+                        if not self._add(generation, center_ms, t_ms, pixels) and t_ms > center_ms:
+                            break
+            except Exception as e:
+                log.warning(f"预解码失败: {e}")
+        self.thread = threading.Thread(target=job, name="frame-ring", daemon=True)
+        self.thread.start()
+
+    def nearest(self, t_ms):
+        """最接近 t_ms 的缓冲帧时间，缓冲为空时返回 None"""
+        with self.lock:
+            if not self.times:
+                return None
+            i = bisect.bisect_left(self.times, t_ms)
+            candidates = self.times[max(0, i - 1):i + 1]
+        return min(candidates, key=lambda t: abs(t - t_ms))
+
+    def step(self, t_ms, delta):
+        """从 t_ms 所在帧前进 / 后退 delta 帧，返回 (时间, 帧)；超出缓冲范围时返回 None"""
+        with self.lock:
+            if not self.times:
+                return None
+            # 当前帧 = 时间不晚于 t_ms 的最后一帧（容许 1ms 取整误差）
+            j = bisect.bisect_right(self.times, t_ms + 1) - 1 + delta
+            if not 0 <= j < len(self.times):
+                return None
+            t = self.times[j]
+            return t, self.frames[t]
+
+    def get(self, t_ms):
+        with self.lock:
+            return self.frames.get(t_ms)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="解码后端测速")
+    sub = parser.add_subparsers(dest="command", required=True)
+    b = sub.add_parser("bench", help="比较各后端在该视频上的取帧速度")
+    b.add_argument("video")
+    b.add_argument("--samples", type=int, default=BENCH_SAMPLES)
+    args = parser.parse_args(argv)
+
+    results = benchmark(args.video, samples=args.samples)
+    for name, seconds in sorted(results.items(), key=lambda x: (x[1] is None, x[1])):
+        line = "失败" if seconds is None else f"{seconds:.2f}s ({seconds / args.samples * 1000:.0f} ms/帧)"
+        print(f"{name:<8}{line}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,264 @@
+import os
+import sys
+import json
+import time
+import shutil
+import hashlib
+import argparse
+import threading
+
+import numpy as np
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+import snapcache
+
+# --- 解码后帧的持久化存储：每个视频一个内存映射的像素文件 + 一个小索引 ---
+#
+# 帧缩放到 STORE_WIDTH 宽后以 RGBX（每像素 4 字节）顺序追加到 frames.rgbx，
+# index.json 记录每帧的时间、偏移、尺寸和像素哈希。读取时直接在 np.memmap 上
+# 切片，Pillow（Image.frombuffer RGBX）与 Qt（QImage Format_RGBX8888）都能
+# 原样包装这段内存，缩略图、拼接、缓存键计算都不再解码 JPEG。
+# 重新打开同一视频时按指纹找到同一目录，帧直接可用。
+#
+# 用法:
+#   python snapframes.py list
+#   python snapframes.py prune --max-size 1024
+#   python snapframes.py clear
+
+DEFAULT_ROOT = os.path.join(os.path.expanduser("~"), ".visualsnap", "frames")
+DEFAULT_MAX_MB = int(os.environ.get("VISUALSNAP_FRAMES_MAX_MB", "4096"))
+STORE_WIDTH = 1280  # 覆盖内置版式中最大的格子宽度（print: 1280）
+CHANNELS = 4
+DATA_FILE = "frames.rgbx"
+INDEX_FILE = "index.json"
+COMPACT_RATIO = 0.5  # 已移除帧占像素文件的比例超过此值时，打开存储时重写文件
+
+
+class FrameStore:
+    def __init__(self, video_file, root=None, width=STORE_WIDTH):
+        self.video_file = video_file
+        self.width = width
+        self.dir = os.path.join(root or DEFAULT_ROOT, snapcache.fingerprint(video_file))
+        self.data_file = os.path.join(self.dir, DATA_FILE)
+        self.index_file = os.path.join(self.dir, INDEX_FILE)
+        self.lock = threading.RLock()
+        self.entries = {}  # t_ms -> {"offset", "width", "height", "hash"}
+        self._mm = None
+        os.makedirs(self.dir, exist_ok=True)
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.index_file):
+            return
+        with open(self.index_file, "r", encoding="utf-8") as f:
+            index = json.load(f)
+        size = os.path.getsize(self.data_file) if os.path.exists(self.data_file) else 0
+        for e in index.get("frames", []):
+            # 写入中途退出时像素文件可能比索引短，丢弃不完整的条目
+            if e["offset"] + e["width"] * e["height"] * CHANNELS <= size:
+                self.entries[e["t_ms"]] = {k: e[k] for k in ("offset", "width", "height", "hash")}
+        os.utime(self.index_file)  # 供 prune 按最近使用淘汰
+
+    def _save_index(self):
+        index = {"video": os.path.basename(self.video_file), "width": self.width,
+                 "frames": [dict(t_ms=t, **e) for t, e in sorted(self.entries.items())]}
+        tmp = self.index_file + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(index, f)
+        os.replace(tmp, self.index_file)
+
+    def _mapped(self):
+        """整个像素文件的只读映射；文件追加变长后重新映射"""
+        size = os.path.getsize(self.data_file) if os.path.exists(self.data_file) else 0
+        if self._mm is None or len(self._mm) < size:
+            self._mm = np.memmap(self.data_file, dtype=np.uint8, mode="r") if size else None
+        return self._mm
+
+    # --- 写入 ---
+    def put(self, t_ms, pixels):
+        """pixels: uint8 [h, w, 3 或 4]；同一时间点已存在时不重复写入"""
+        t_ms = int(t_ms)
+        with self.lock:
+            if t_ms in self.entries:
+                return self.entries[t_ms]["hash"]
+            if pixels.shape[2] == 3:
+                rgbx = np.empty(pixels.shape[:2] + (CHANNELS,), dtype=np.uint8)
+                rgbx[..., :3] = pixels
+                rgbx[..., 3] = 255
+                pixels = rgbx
+            data = np.ascontiguousarray(pixels, dtype=np.uint8).tobytes()
+            with open(self.data_file, "ab") as f:
+                offset = f.tell()
+                f.write(data)
+            digest = hashlib.blake2b(data, digest_size=16).hexdigest()
+            self.entries[t_ms] = {"offset": offset, "width": pixels.shape[1], "height": pixels.shape[0],
+                                  "hash": digest}
+            self._save_index()
+            return digest
+
+    def put_image(self, t_ms, path):
+        """解码一张截图（JPEG 解码时直接缩小）并存入；返回像素哈希"""
+        if int(t_ms) in self.entries:
+            return self.entries[int(t_ms)]["hash"]
+        img = Image.open(path)
+        img.draft("RGB", (self.width, self.width * img.height // max(img.width, 1)))
+        img = img.convert("RGB")
+        if img.width > self.width:
+            img = img.resize((self.width, max(1, round(img.height * self.width / img.width))), Image.LANCZOS)
+        return self.put(t_ms, np.asarray(img.convert("RGBX")))
+
+    def remove(self, t_ms):
+        """只从索引中移除，像素数据留到 compact 时回收"""
+        with self.lock:
+            if self.entries.pop(int(t_ms), None) is not None:
+                self._save_index()
+
+    def live_bytes(self):
+        return sum(e["width"] * e["height"] * CHANNELS for e in self.entries.values())
+
+    def compact(self):
+        """重写像素文件，只保留索引中仍存在的帧"""
+        with self.lock:
+            mm = self._mapped()
+            if mm is None:
+                return
+            tmp = self.data_file + ".tmp"
+            entries = {}
+            with open(tmp, "wb") as f:
+                for t, e in sorted(self.entries.items()):
+                    n = e["width"] * e["height"] * CHANNELS
+                    entries[t] = dict(e, offset=f.tell())
+                    f.write(mm[e["offset"]:e["offset"] + n].tobytes())
+            self._mm = None
+            mm = None
+            os.replace(tmp, self.data_file)
+            self.entries = entries
+            self._save_index()
+
+    def compact_if_wasteful(self, ratio=COMPACT_RATIO):
+        """已移除帧占用的空间超过 ratio 时 compact；返回回收的字节数"""
+        size = self.disk_size()
+        dead = size - self.live_bytes()
+        if size == 0 or dead <= size * ratio:
+            return 0
+        self.compact()
+        return dead
+
+    # --- 读取（零拷贝） ---
+    def __contains__(self, t_ms):
+        return int(t_ms) in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def times(self):
+        return sorted(self.entries)
+
+    def frame_hash(self, t_ms):
+        e = self.entries.get(int(t_ms))
+        return e["hash"] if e else None
+
+    def frame(self, t_ms):
+        """只读的 uint8 [h, w, 4] 视图，直接指向映射的文件内容；不存在时返回 None"""
+        with self.lock:
+            e = self.entries.get(int(t_ms))
+            if e is None:
+                return None
+            mm = self._mapped()
+        n = e["width"] * e["height"] * CHANNELS
+        return mm[e["offset"]:e["offset"] + n].reshape(e["height"], e["width"], CHANNELS)
+
+    def image(self, t_ms):
+        """以 PIL Image（RGBX）包装映射内存，不复制像素"""
+        pixels = self.frame(t_ms)
+        if pixels is None:
+            return None
+        h, w = pixels.shape[:2]
+        return Image.frombuffer("RGBX", (w, h), pixels, "raw", "RGBX", 0, 1)
+
+    def disk_size(self):
+        return os.path.getsize(self.data_file) if os.path.exists(self.data_file) else 0
+
+
+# --- 存储目录管理 ---
+def list_stores(root=None):
+    """[(目录, 视频名, 帧数, 字节数, 最近使用时间)]，最近使用的在前"""
+    root = root or DEFAULT_ROOT
+    stores = []
+    if not os.path.isdir(root):
+        return stores
+    for name in os.listdir(root):
+        d = os.path.join(root, name)
+        index_file = os.path.join(d, INDEX_FILE)
+        if not os.path.isfile(index_file):
+            continue
+        try:
+            with open(index_file, "r", encoding="utf-8") as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            index = {}
+        data_file = os.path.join(d, DATA_FILE)
+        size = os.path.getsize(data_file) if os.path.exists(data_file) else 0
+        stores.append((d, index.get("video", name), len(index.get("frames", [])), size,
+                       os.path.getmtime(index_file)))
+    stores.sort(key=lambda s: s[4], reverse=True)
+    return stores
+
+
+def prune(max_bytes=None, root=None, keep=None):
+    """按最近使用淘汰整个视频的帧存储，直到总大小不超过上限；keep 中的目录不删。返回删除数"""
+    max_bytes = DEFAULT_MAX_MB * 1024 * 1024 if max_bytes is None else max_bytes
+    stores = list_stores(root)
+    total = sum(s[3] for s in stores)
+    removed = 0
+    for d, _, _, size, _ in reversed(stores):
+        if total <= max_bytes:
+            break
+        if keep and d in keep:
+            continue
+        shutil.rmtree(d, ignore_errors=True)
+        total -= size
+        removed += 1
+    return removed
+
+
+def open_store(video_file, root=None):
+    """打开（或创建）视频的帧存储，并顺带把其他视频的存储控制在上限以内"""
+    store = FrameStore(video_file, root)
+    # 刚打开时还没有指向像素文件的视图，此时重写文件是安全的（Windows 上映射中的文件不能替换）
+    store.compact_if_wasteful()
+    prune(root=root, keep={store.dir})
+    return store
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="visualsnap 解码帧存储")
+    parser.add_argument("--root", default=DEFAULT_ROOT, help="存储目录")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("list", help="列出各视频的帧数与大小")
+    p = sub.add_parser("prune", help="按最近使用淘汰到指定大小")
+    p.add_argument("--max-size", type=float, default=DEFAULT_MAX_MB, help="上限（MB）")
+    sub.add_parser("clear", help="删除全部帧存储")
+    args = parser.parse_args(argv)
+
+    if args.command == "list":
+        stores = list_stores(args.root)
+        print(f"存储目录: {args.root}")
+        for d, video, count, size, used in stores:
+            print(f"{time.strftime('%Y-%m-%d %H:%M', time.localtime(used))}  {count:>5} 帧  "
+                  f"{size / 1024 / 1024:>8.1f} MB  {video}")
+        print(f"合计 {sum(s[3] for s in stores) / 1024 / 1024:.1f} MB")
+    elif args.command == "prune":
+        removed = prune(int(args.max_size * 1024 * 1024), args.root)
+        print(f"[INFO] 删除 {removed} 个视频的帧存储")
+    elif args.command == "clear":
+        shutil.rmtree(args.root, ignore_errors=True)
+        print("[INFO] 帧存储已清空")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
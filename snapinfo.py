@@ -0,0 +1,240 @@
+import os
+import re
+import json
+import tempfile
+import threading
+import functools
+import collections
+import subprocess
+
+try:
+    from PIL import Image, ImageDraw, ImageFont
+except ImportError:  # 没有 Pillow 时退回 magick 渲染
+    Image = None
+
+import snapcache
+
+# --- 视频信息图：结构化探测 + 进程内渲染 ---
+#
+# mediainfo --Output=JSON 的结果按视频指纹缓存，文字排版与 template_mediainfo.txt
+# 保持一致；字体对象和每行的标签图只加载 / 渲染一次，之后每个视频只画取值部分。
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+HEADER_SIZE = (1920, 320)
+HEADER_ORIGIN = (60, 60)  # 同 magick -annotate +60+60，y 为首行基线
+FONT_SIZE = 24
+STROKE_WIDTH = 1  # magick -strokewidth 2 描边向内外各占一半
+HEADER_FONTS = [
+    os.path.join(SCRIPT_DIR, "YaHei-Consolas-Hybrid.ttf"),
+    "YaHei-Consolas-Hybrid.ttf",
+    "msyh.ttc",
+    "NotoSansMonoCJK-Regular.ttc",
+    "DejaVuSansMono.ttf",
+]
+LANGUAGES = {
+    "en": "English", "zh": "Chinese", "ja": "Japanese", "ko": "Korean", "fr": "French", "de": "German",
+    "es": "Spanish", "it": "Italian", "ru": "Russian", "pt": "Portuguese", "th": "Thai",
+}
+
+PROBE_MEMO_SIZE = 128  # 进程内记忆的探测结果数，按最近使用淘汰
+_probe_memo = collections.OrderedDict()
+_probe_lock = threading.Lock()
+
+
+def _reset_in_child():
+    # 进程池 fork 时其他线程可能正持有锁，子进程换一把新的
+    global _probe_lock
+    _probe_lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_in_child)
+
+
+# --- 探测 ---
+def probe(video_file, cache=None):
+    """mediainfo JSON 的 track 列表，进程内与磁盘缓存都按视频指纹索引"""
+    fp = snapcache.fingerprint(video_file)
+    with _probe_lock:
+        if fp in _probe_memo:
+            _probe_memo.move_to_end(fp)
+            return _probe_memo[fp]
+    key = cache.key("probe", fp) if cache else None
+    data = None
+    if key:
+        cached = cache.get(key)
+        if cached:
+            with open(cached, "r", encoding="utf-8") as f:
+                data = json.load(f)
+    if data is None:
+        out = subprocess.check_output(["mediainfo", "--Output=JSON", video_file])
+        data = json.loads(out.decode("utf-8", "replace"))
+        if key:
+            fd, tmp = tempfile.mkstemp(suffix=".json")
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(data, f)
+            cache.put(key, tmp, move=True)
+            if os.path.exists(tmp):
+                os.remove(tmp)
+    media = data.get("media") or {}
+    tracks = media.get("track") or []
+    with _probe_lock:
+        _probe_memo[fp] = tracks
+        while len(_probe_memo) > PROBE_MEMO_SIZE:
+            _probe_memo.popitem(last=False)
+    return tracks
+
+
+def tracks_of(tracks, kind):
+    return [t for t in tracks if t.get("@type") == kind]
+
+
+def _num(value, default=0.0):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return default
+
+
+def size_string(size):
+    value, unit = float(size), "Bytes"
+    for unit in ("Bytes", "KiB", "MiB", "GiB", "TiB"):
+        if value < 1024 or unit == "TiB":
+            break
+        value /= 1024
+    if unit == "Bytes":
+        return f"{int(value)} Bytes"
+    digits = 0 if value >= 100 else 1 if value >= 10 else 2
+    return f"{value:.{digits}f} {unit}"
+
+
+def duration_string(ms):
+    ms = int(round(ms))
+    return f"{ms // 3600000:02}:{ms // 60000 % 60:02}:{ms // 1000 % 60:02}.{ms % 1000:03}"
+
+
+def bitrate_string(bps):
+    if not bps:
+        return ""
+    if bps >= 10_000_000:
+        return f"{bps / 1e6:.1f} Mb/s"
+    return f"{round(bps / 1000):,} kb/s".replace(",", " ")
+
+
+CHAPTER_KEY = re.compile(r"^_(\d+)_(\d{2})_(\d{2})[_.](\d{3})")  # Menu 轨 extra 中的 _00_05_12_345
+CHAPTER_LANG = re.compile(r"^[a-z]{2,3}:")
+
+
+def chapters(tracks):
+    """Menu 轨中的章节 [(起点 ms, 标题)]，按时间排序；没有章节时为空"""
+    marks = {}
+    for menu in tracks_of(tracks, "Menu"):
+        for key, title in (menu.get("extra") or {}).items():
+            m = CHAPTER_KEY.match(key)
+            if m:
+                h, mi, s, ms = map(int, m.groups())
+                marks.setdefault(((h * 60 + mi) * 60 + s) * 1000 + ms, CHAPTER_LANG.sub("", str(title)))
+    return sorted(marks.items())
+
+
+def header_lines(video_file, tracks):
+    """与 template_mediainfo.txt 相同的内容，返回 [(标签, 取值)]"""
+    general = (tracks_of(tracks, "General") or [{}])[0]
+    size = int(_num(general.get("FileSize"), os.path.getsize(video_file)))
+    duration_ms = _num(general.get("Duration")) * 1000
+    lines = [
+        ("Name...............: ", os.path.basename(video_file)),
+        ("Size...............: ", f"{size_string(size)} ({size} bytes)"),
+        ("Duration...........: ", f"{duration_string(duration_ms)} ({int(duration_ms)}ms)"),
+    ]
+    for v in tracks_of(tracks, "Video"):
+        bitrate = int(_num(v.get("BitRate")))
+        codec = " ".join(x for x in (v.get("InternetMediaType"), v.get("Format"), v.get("Format_Profile")) if x)
+        lines += [
+            ("Framerate..........: ", f"{v.get('FrameRate', '')} fps"),
+            ("Resolution.........: ", f"{v.get('Width', '')}x{v.get('Height', '')}"),
+            ("Codec..............: ", codec),
+            ("Bitrate............: ", f"{bitrate_string(bitrate)} ({bitrate} b/s)"),
+        ]
+    for a in tracks_of(tracks, "Audio"):
+        language = a.get("Language")
+        fields = [
+            f"{a.get('Channels', '')} chnls",
+            a.get("Format", ""),
+            bitrate_string(int(_num(a.get("BitRate")))),
+            a.get("BitRate_Mode", ""),
+            f"{a.get('SamplingRate', '')}Hz",
+            LANGUAGES.get(language, language or ""),
+        ]
+        lines.append(("Audio..............: ", " ".join(f for f in fields if f)))
+    subs = [LANGUAGES.get(t.get("Language"), t.get("Language")) or "Unknown" for t in tracks_of(tracks, "Text")]
+    if subs:
+        lines.append(("Subs...............: ", ",".join(subs) + "."))
+    return lines
+
+
+# --- 渲染 ---
+@functools.lru_cache(maxsize=8)
+def header_font(size=FONT_SIZE):
+    for name in HEADER_FONTS:
+        try:
+            return ImageFont.truetype(name, size)
+        except OSError:
+            continue
+    return ImageFont.load_default()
+
+
+def line_height():
+    ascent, descent = header_font().getmetrics()
+    return ascent + descent + 2
+
+
+def text_image(text):
+    """单行文字（白字黑描边）渲染成 RGBA 图，返回 (图, 相对基线起点的偏移)"""
+    font = header_font()
+    left, top, right, bottom = font.getbbox(text, anchor="ls", stroke_width=STROKE_WIDTH)
+    img = Image.new("RGBA", (max(1, right - left), max(1, bottom - top)), (0, 0, 0, 0))
+    ImageDraw.Draw(img).text((-left, -top), text, font=font, anchor="ls", fill="white",
+                             stroke_width=STROKE_WIDTH, stroke_fill="black")
+    return img, (left, top)
+
+
+# 标签行在各视频间完全相同，只渲染一次
+label_image = functools.lru_cache(maxsize=32)(text_image)
+
+
+def render_header(lines, strip=None):
+    """lines: [(标签, 取值)]；strip: 可选的波形条 RGBA 图，接在画布下方。返回 PIL Image"""
+    width, height = HEADER_SIZE
+    extra = strip.height + 10 if strip is not None else 0
+    canvas = Image.new("RGBA", (width, height + extra), (0, 0, 0, 0))
+    x0, y = HEADER_ORIGIN
+    step = line_height()
+    label_width = header_font().getlength(lines[0][0]) if lines else 0
+    for label, value in lines:
+        for x, text, render in ((x0, label, label_image), (x0 + label_width, value, text_image)):
+            if not text:
+                continue
+            img, (dx, dy) = render(text)
+            canvas.alpha_composite(img, (int(x + dx), int(y + dy)))
+        y += step
+    if strip is not None:
+        canvas.alpha_composite(strip, (HEADER_ORIGIN[0], height))
+    return canvas
+
+
+def render_header_magick(lines, out_img):
+    """无 Pillow 时的退路：文字直接作为参数交给 magick，不经过 shell、不写临时文件"""
+    # -annotate 会解释 % 转义
+    text = "\n".join(label + value for label, value in lines).replace("%", "%%")
+    subprocess.run([
+        "magick", "-size", f"{HEADER_SIZE[0]}x{HEADER_SIZE[1]}", "xc:transparent",
+        "-font", "YaHei-Consolas-Hybrid.ttf",
+        "-fill", "white", "-pointsize", str(FONT_SIZE),
+        "-stroke", "black", "-strokewidth", "2",
+        "-annotate", f"+{HEADER_ORIGIN[0]}+{HEADER_ORIGIN[1]}", text,
+        "-fill", "white", "-stroke", "none",
+        "-annotate", f"+{HEADER_ORIGIN[0]}+{HEADER_ORIGIN[1]}", text,
+        out_img
+    ])
+    return out_img
@@ -0,0 +1,250 @@
+import os
+import sys
+import queue
+import atexit
+import logging
+import threading
+import collections
+import logging.handlers
+
+# --- 分级、限流、异步的日志：代替 print 与 mpv 的 log_handler=print ---
+#
+# 调用方（包括 mpv 事件线程）只把记录放进有界环形缓冲，从不等待 I/O；缓冲满时丢弃最旧的记录并计数。
+# 后台线程（logging.handlers.QueueListener）把记录写到控制台、可选的日志文件和内存历史，
+# 界面的调试窗口从内存历史中轮询新行。同一来源（logger + 级别 + 调用位置，mpv 消息按组件）
+# 每秒超过 RATE_BURST 条时只保留前几条，下一条放行的记录会注明省略了多少条；WARN 及以上从不限流。
+#
+# 用法:
+#   import snaplog
+#   log = snaplog.get_logger("core")
+#   log.info("打开视频: %s", path)
+#   snaplog.setup()                      # 入口脚本中调用一次
+#   mpv.MPV(log_handler=snaplog.mpv_log_handler, loglevel=snaplog.mpv_loglevel())
+#
+# 环境变量: VISUALSNAP_LOG_LEVEL=DEBUG/INFO/WARN，VISUALSNAP_LOG_FILE=路径
+
+DEFAULT_LEVEL = os.environ.get("VISUALSNAP_LOG_LEVEL", "INFO").upper()
+DEFAULT_FILE = os.environ.get("VISUALSNAP_LOG_FILE") or None
+RING_SIZE = 4096  # 等待写出的记录上限
+HISTORY_SIZE = 2000  # 调试窗口可回看的行数
+RATE_BURST = 5  # 同一来源每 RATE_INTERVAL 秒最多输出的条数
+RATE_INTERVAL = 1.0
+RATE_MAX_SOURCES = 1024  # 记录的来源数超过此值时清掉已过窗口的来源
+ROOT = "visualsnap"
+
+LEVEL_TAGS = {logging.DEBUG: "DEBUG", logging.INFO: "INFO", logging.WARNING: "WARN",
+              logging.ERROR: "ERROR", logging.CRITICAL: "FATAL"}
+MPV_LEVELS = {"fatal": logging.CRITICAL, "error": logging.ERROR, "warn": logging.WARNING, "info": logging.INFO,
+              "status": logging.INFO, "v": logging.DEBUG, "debug": logging.DEBUG, "trace": logging.DEBUG}
+
+
+def parse_level(level):
+    if isinstance(level, int):
+        return level
+    level = str(level).upper()
+    return logging.WARNING if level == "WARN" else logging.getLevelName(level)
+
+
+class RingBuffer:
+    """有界、不阻塞写入的队列；满时丢弃最旧的记录。接口与 queue.Queue 中 QueueHandler / QueueListener 用到的部分一致"""
+
+    def __init__(self, size=RING_SIZE):
+        self.items = collections.deque(maxlen=size)
+        self.cond = threading.Condition(threading.Lock())
+        self.dropped = 0
+
+    def put_nowait(self, item):
+        with self.cond:
+            if len(self.items) == self.items.maxlen:
+                self.dropped += 1
+            self.items.append(item)
+            self.cond.notify()
+
+    def get(self, block=True, timeout=None):
+        with self.cond:
+            if block and not self.items:
+                self.cond.wait_for(lambda: self.items, timeout)
+            if not self.items:
+                raise queue.Empty
+            return self.items.popleft()
+
+    def task_done(self):
+        pass
+
+
+class RateLimitFilter(logging.Filter):
+    """按来源限流，被省略的条数附在下一条放行的记录上；WARN 及以上的记录总是放行"""
+
+    def __init__(self, burst=RATE_BURST, interval=RATE_INTERVAL, max_sources=RATE_MAX_SOURCES):
+        super().__init__()
+        self.burst = burst
+        self.interval = interval
+        self.max_sources = max_sources
+        self.lock = threading.Lock()
+        self.sites = {}  # 来源 -> [窗口起点, 窗口内条数, 省略条数]
+
+    @staticmethod
+    def source(record):
+        # mpv 的所有消息来自同一行代码，按组件区分；其他记录按调用位置区分（f-string 每条消息文本都不同）
+        component = getattr(record, "mpv_component", None)
+        if component is not None:
+            return record.name, record.levelno, component
+        return record.name, record.levelno, record.pathname, record.lineno
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        key = self.source(record)
+        now = record.created
+        with self.lock:
+            site = self.sites.get(key)
+            if site is None or now - site[0] >= self.interval:
+                suppressed = site[2] if site else 0
+                if site is None and len(self.sites) >= self.max_sources:
+                    self.sites = {k: v for k, v in self.sites.items() if now - v[0] < self.interval}
+                    if len(self.sites) >= self.max_sources:  # 一个窗口内的来源就已超限（大量不同的消息）
+                        self.sites.clear()
+                self.sites[key] = [now, 1, 0]
+            elif site[1] < self.burst:
+                site[1] += 1
+                suppressed = 0
+            else:
+                site[2] += 1
+                return False
+        if suppressed:
+            record.msg = f"{record.getMessage()}（此前 {suppressed} 条同类日志已省略）"
+            record.args = None
+        return True
+
+
+class Formatter(logging.Formatter):
+    """与原先 print 相同的 [INFO] / [WARN] / [DEBUG] 前缀，前面加时间"""
+
+    def format(self, record):
+        record.tag = LEVEL_TAGS.get(record.levelno, record.levelname)
+        return super().format(record)
+
+
+class HistoryHandler(logging.Handler):
+    """把格式化后的行保存在内存中，供调试窗口按序号增量读取"""
+
+    def __init__(self, size=HISTORY_SIZE):
+        super().__init__()
+        self.lines = collections.deque(maxlen=size)  # (序号, 级别, 文本)
+        self.seq = 0
+
+    def emit(self, record):
+        line = self.format(record)
+        with self.lock:
+            self.seq += 1
+            self.lines.append((self.seq, record.levelno, line))
+
+    def since(self, seq, level=logging.NOTSET):
+        """返回 (最新序号, [(级别, 文本)])，只含序号大于 seq 且不低于 level 的行"""
+        with self.lock:
+            return self.seq, [(lv, line) for s, lv, line in self.lines if s > seq and lv >= level]
+
+
+_state = {"ring": None, "listener": None, "history": None}
+_setup_lock = threading.Lock()
+
+
+def get_logger(name):
+    return logging.getLogger(f"{ROOT}.{name}")
+
+
+def setup(level=None, log_file=DEFAULT_FILE, console=True):
+    """入口脚本调用一次（重复调用只调整级别）：安装环形缓冲与后台写出线程，返回内存历史"""
+    level = parse_level(level or DEFAULT_LEVEL)
+    with _setup_lock:
+        root = logging.getLogger(ROOT)
+        root.setLevel(level)
+        if _state["listener"] is not None:
+            return _state["history"]
+        formatter = Formatter("%(asctime)s [%(tag)s] %(message)s", "%H:%M:%S")
+        handlers = []
+        if console:
+            stream = logging.StreamHandler(sys.stdout)
+            stream.setFormatter(formatter)
+            handlers.append(stream)
+        if log_file:
+            file_handler = logging.FileHandler(log_file, encoding="utf-8")
+            file_handler.setFormatter(Formatter("%(asctime)s [%(tag)s] %(name)s: %(message)s"))
+            handlers.append(file_handler)
+        history = HistoryHandler()
+        history.setFormatter(formatter)
+        handlers.append(history)
+
+        ring = RingBuffer()
+        queue_handler = logging.handlers.QueueHandler(ring)
+        queue_handler.addFilter(RateLimitFilter())
+        root.handlers[:] = [queue_handler]
+        root.propagate = False
+        listener = logging.handlers.QueueListener(ring, *handlers, respect_handler_level=True)
+        listener.start()
+        _state.update(ring=ring, listener=listener, history=history)
+    atexit.register(shutdown)
+    return history
+
+
+def set_level(level):
+    logging.getLogger(ROOT).setLevel(parse_level(level))
+
+
+def current_level():
+    """当前级别的标签（DEBUG / INFO / WARN ...）"""
+    level = logging.getLogger(ROOT).getEffectiveLevel()
+    return LEVEL_TAGS.get(level, logging.getLevelName(level))
+
+
+def shutdown():
+    """写出缓冲中剩余的记录并停止后台线程"""
+    with _setup_lock:
+        listener, _state["listener"] = _state["listener"], None
+    if listener is not None:
+        listener.stop()
+
+
+def history():
+    return _state["history"]
+
+
+def dropped():
+    """因缓冲满而丢弃的记录数"""
+    return _state["ring"].dropped if _state["ring"] is not None else 0
+
+
+def _restart_in_child():
+    # 进程池 fork 出的子进程没有后台线程，重新启动一个，否则子进程的日志会留在缓冲中
+    listener = _state["listener"]
+    if listener is not None:
+        ring = RingBuffer()
+        for handler in logging.getLogger(ROOT).handlers:
+            if isinstance(handler, logging.handlers.QueueHandler):
+                handler.queue = ring
+        _state["ring"] = ring
+        _state["listener"] = logging.handlers.QueueListener(ring, *listener.handlers, respect_handler_level=True)
+        _state["listener"].start()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_restart_in_child)
+
+
+# --- mpv ---
+_mpv_log = get_logger("mpv")
+
+
+def mpv_log_handler(loglevel, component, message):
+    """python-mpv 的 log_handler：在 mpv 事件线程中调用，只做级别判断和入队"""
+    level = MPV_LEVELS.get(loglevel, logging.INFO)
+    if _mpv_log.isEnabledFor(level):
+        _mpv_log.log(level, "mpv/%s: %s", component, message.rstrip(), extra={"mpv_component": component})
+
+
+def mpv_loglevel():
+    """按当前级别决定让 libmpv 送来哪些消息，级别之外的消息在 libmpv 内部就被丢弃"""
+    level = logging.getLogger(ROOT).getEffectiveLevel()
+    if level <= logging.DEBUG:
+        return "v"
+    return "info" if level <= logging.INFO else "warn"
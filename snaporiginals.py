@@ -0,0 +1,255 @@
+import os
+import sys
+import json
+import time
+import shutil
+import hashlib
+import zipfile
+import argparse
+import threading
+
+try:
+    import fcntl
+except ImportError:  # Windows 没有 reflink，直接用硬链接或归档
+    fcntl = None
+
+import snaplog
+
+# --- 全分辨率原图存储：代替逐帧 shutil.copy 到 backup/ ---
+#
+# 原图按内容哈希去重，存放方式依次尝试：
+#   link    硬链接（同一文件系统，零写入；之后的标注写新文件再 os.replace，不会改动原 inode）
+#   reflink FICLONE 写时复制克隆（btrfs / xfs 等，跨目录不能硬链接时）
+#   archive 追加到每个视频一个的 originals.zip（不压缩，顺序写入）
+# index.json 记录 文件名 -> 哈希 与 哈希 -> 存放方式；超过保留天数或容量上限时按时间淘汰。
+#
+# 用法:
+#   python snaporiginals.py stats D:/rec/backup/a
+#   python snaporiginals.py prune D:/rec/backup/a --days 7
+
+log = snaplog.get_logger("originals")
+DEFAULT_DAYS = float(os.environ.get("VISUALSNAP_ORIGINALS_DAYS", "30"))
+DEFAULT_MAX_MB = float(os.environ.get("VISUALSNAP_ORIGINALS_MAX_MB", "2048"))
+FICLONE = 0x40049409
+INDEX_FILE = "index.json"
+ARCHIVE_FILE = "originals.zip"
+
+
+def file_hash(path):
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def reflink(src, dst):
+    if fcntl is None:
+        raise OSError("reflink 不可用")
+    with open(src, "rb") as s, open(dst, "wb") as d:
+        try:
+            fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+        except OSError:
+            d.close()
+            os.remove(dst)
+            raise
+
+
+def store_dir(video_file):
+    """视频对应的原图目录：与视频同目录的 backup/<视频名>/，保证与截图在同一文件系统"""
+    name = os.path.splitext(os.path.basename(video_file))[0]
+    return os.path.join(os.path.dirname(os.path.abspath(video_file)), "backup", name)
+
+
+class OriginalsStore:
+    def __init__(self, root, days=DEFAULT_DAYS, max_mb=DEFAULT_MAX_MB):
+        self.root = root
+        self.days = days
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.objects_dir = os.path.join(root, "objects")
+        self.archive_file = os.path.join(root, ARCHIVE_FILE)
+        self.index_file = os.path.join(root, INDEX_FILE)
+        self.lock = threading.Lock()
+        self.names = {}  # 文件名 -> {"hash", "added"}
+        self.objects = {}  # 哈希 -> {"mode", "size"}
+        self.mode = None  # 首次失败后不再尝试更快的方式
+        os.makedirs(self.objects_dir, exist_ok=True)
+        if os.path.exists(self.index_file):
+            with open(self.index_file, "r", encoding="utf-8") as f:
+                index = json.load(f)
+            self.names, self.objects = index.get("names", {}), index.get("objects", {})
+            self.mode = index.get("mode")
+
+    def _save(self):
+        tmp = self.index_file + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"mode": self.mode, "names": self.names, "objects": self.objects}, f)
+        os.replace(tmp, self.index_file)
+
+    def _object_path(self, digest):
+        return os.path.join(self.objects_dir, digest + ".jpg")
+
+    def _store(self, src, digest):
+        dst = self._object_path(digest)
+        if os.path.exists(dst):  # 索引丢失后残留的对象
+            os.remove(dst)
+        modes = ["link", "reflink", "archive"]
+        if self.mode in modes:
+            modes = modes[modes.index(self.mode):]
+        for mode in modes:
+            try:
+                if mode == "link":
+                    os.link(src, dst)
+                elif mode == "reflink":
+                    reflink(src, dst)
+                else:
+                    with zipfile.ZipFile(self.archive_file, "a", zipfile.ZIP_STORED) as z:
+                        # 已回收但归档尚未重写时成员仍在，直接复用，避免追加同名成员
+                        if digest + ".jpg" not in z.namelist():
+                            z.write(src, digest + ".jpg")
+                if self.mode != mode:
+                    log.info(f"原图存储方式: {mode}")
+                self.mode = mode
+                return mode
+            except OSError:
+                continue
+        raise OSError(f"无法保存原图: {src}")
+
+    def add(self, path):
+        """在标注之前调用：保存 path 的当前内容，返回存放方式（内容已存在时为 "dedup"）"""
+        digest = file_hash(path)
+        name = os.path.basename(path)
+        with self.lock:
+            if digest in self.objects:
+                mode = "dedup"
+            else:
+                mode = self._store(path, digest)
+                self.objects[digest] = {"mode": mode, "size": os.path.getsize(path)}
+            self.names[name] = {"hash": digest, "added": time.time()}
+            self._save()
+        return mode
+
+    def __contains__(self, name):
+        return os.path.basename(name) in self.names
+
+    def path(self, name):
+        """原图的可读路径；归档中的原图解压到 unpacked/ 后返回，不存在时返回 None"""
+        with self.lock:
+            entry = self.names.get(os.path.basename(name))
+            if entry is None:
+                return None
+            digest = entry["hash"]
+            if self.objects[digest]["mode"] != "archive":
+                return self._object_path(digest)
+            out = os.path.join(self.root, "unpacked", digest + ".jpg")
+            if not os.path.exists(out):
+                os.makedirs(os.path.dirname(out), exist_ok=True)
+                with zipfile.ZipFile(self.archive_file) as z, z.open(digest + ".jpg") as src, \
+                        open(out + ".tmp", "wb") as dst:
+                    shutil.copyfileobj(src, dst)
+                os.replace(out + ".tmp", out)
+            return out
+
+    def remove(self, name):
+        with self.lock:
+            if self.names.pop(os.path.basename(name), None) is not None:
+                self._collect()
+                self._save()
+
+    def _collect(self):
+        """删除不再被任何文件名引用的原图；归档中的死数据超过一半时重写归档"""
+        live = {e["hash"] for e in self.names.values()}
+        for digest in [d for d in self.objects if d not in live]:
+            obj = self.objects.pop(digest)
+            if obj["mode"] != "archive":
+                try:
+                    os.remove(self._object_path(digest))
+                except FileNotFoundError:
+                    pass
+            try:
+                os.remove(os.path.join(self.root, "unpacked", digest + ".jpg"))
+            except FileNotFoundError:
+                pass
+        if not os.path.exists(self.archive_file):
+            return
+        archived = {d for d, o in self.objects.items() if o["mode"] == "archive"}
+        with zipfile.ZipFile(self.archive_file) as z:
+            members = z.infolist()
+            dead = sum(m.file_size for m in members if m.filename[:-4] not in archived)
+            if dead * 2 <= sum(m.file_size for m in members):
+                return
+            tmp = self.archive_file + ".tmp"
+            with zipfile.ZipFile(tmp, "w", zipfile.ZIP_STORED) as out:
+                for m in members:
+                    if m.filename[:-4] in archived:
+                        with z.open(m) as src, out.open(m.filename, "w") as dst:
+                            shutil.copyfileobj(src, dst)
+        os.replace(tmp, self.archive_file)
+
+    def prune(self, days=None, max_bytes=None):
+        """保留策略：删除超过 days 天的原图，再按添加时间从旧到新删到总大小不超过 max_bytes。返回删除数"""
+        days = self.days if days is None else days
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        with self.lock:
+            before = len(self.names)
+            if days and days > 0:
+                cutoff = time.time() - days * 86400
+                self.names = {n: e for n, e in self.names.items() if e["added"] >= cutoff}
+            if max_bytes and max_bytes > 0:
+                total = sum(o["size"] for o in self.objects.values())
+                for name, entry in sorted(self.names.items(), key=lambda x: x[1]["added"]):
+                    if total <= max_bytes:
+                        break
+                    del self.names[name]
+                    digest = entry["hash"]
+                    if digest in self.objects and not any(e["hash"] == digest for e in self.names.values()):
+                        total -= self.objects[digest]["size"]
+            removed = before - len(self.names)
+            if removed:
+                self._collect()
+                self._save()
+        return removed
+
+    def stats(self):
+        with self.lock:
+            modes = {}
+            for obj in self.objects.values():
+                m = modes.setdefault(obj["mode"], {"objects": 0, "bytes": 0})
+                m["objects"] += 1
+                m["bytes"] += obj["size"]
+            return {"names": len(self.names), "objects": len(self.objects), "modes": modes}
+
+
+def open_store(video_file, **kwargs):
+    """打开视频的原图存储并按保留策略清理"""
+    store = OriginalsStore(store_dir(video_file), **kwargs)
+    removed = store.prune()
+    if removed:
+        log.info(f"按保留策略删除 {removed} 张原图")
+    return store
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="visualsnap 原图存储")
+    sub = parser.add_subparsers(dest="command", required=True)
+    s = sub.add_parser("stats", help="显示原图数量与存放方式")
+    s.add_argument("root", help="原图目录（backup/<视频名>）")
+    p = sub.add_parser("prune", help="按保留策略清理")
+    p.add_argument("root")
+    p.add_argument("--days", type=float, default=DEFAULT_DAYS, help="保留天数（0 表示不限）")
+    p.add_argument("--max-size", type=float, default=DEFAULT_MAX_MB, help="容量上限（MB，0 表示不限）")
+    args = parser.parse_args(argv)
+
+    store = OriginalsStore(args.root)
+    if args.command == "stats":
+        stats = store.stats()
+        print(f"文件名 {stats['names']}，去重后 {stats['objects']} 张")
+        for mode, m in stats["modes"].items():
+            print(f"  {mode:<8}{m['objects']:>6} 张 {m['bytes'] / 1024 / 1024:>8.1f} MB")
+    elif args.command == "prune":
+        removed = store.prune(args.days, int(args.max_size * 1024 * 1024))
+        print(f"[INFO] 删除 {removed} 张原图")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,180 @@
+import os
+import sys
+import json
+import argparse
+import subprocess
+import concurrent.futures
+
+import snapcache
+import snaplog
+
+# --- 低分辨率代理：4K/8K HEVC 等大文件的预览、拖动与择优打分都在代理上进行 ---
+#
+# 代理是短 GOP（每 PROXY_GOP 帧一个关键帧）的 H.264 小文件，逐帧直通（-fps_mode passthrough）
+# 不丢帧、不补帧，每一帧与源文件的帧一一对应。ffmpeg -ss 与 mpv time-pos 的时间都相对容器的
+# 起始时间（format start_time），而代理带有 AAC 音轨，容器起点与视频起点可能不同。因此对两个文件
+# 各自测量"第一帧视频相对本文件容器起点的时间"，两者之差记录在元数据里，to_source / to_proxy 据此换算。
+# 最终故事板的帧仍从源文件按换算后的时间抽取。
+# 代理按源文件指纹存放在单独的目录（不进 snapcache：一个代理可能比整个缓存上限还大，放进去会被立即淘汰），
+# 同一文件只生成一次；目录总大小超过 DEFAULT_MAX_MB 时按最近使用淘汰其他视频的代理。
+#
+# 用法:
+#   python snapproxy.py D:/rec/a.mkv --height 360
+#   python snapproxy.py --prune --max-size 4096
+
+log = snaplog.get_logger("proxy")
+PROXY_HEIGHT = 360
+PROXY_GOP = 12
+PROXY_CRF = 28
+META_VERSION = 2  # offset_ms 的含义改变时递增，旧代理重新生成
+DEFAULT_ROOT = os.path.join(os.path.expanduser("~"), ".visualsnap", "proxies")
+DEFAULT_MAX_MB = int(os.environ.get("VISUALSNAP_PROXY_MAX_MB", "8192"))
+
+_builder = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="snap-proxy")
+
+
+class Proxy:
+    def __init__(self, path, offset_ms=0.0, frames=None):
+        self.path = path
+        self.offset_ms = offset_ms  # 源文件与代理的首帧相对各自容器起点的时间之差（ms）
+        self.frames = frames
+
+    def to_source(self, t_ms):
+        """代理上的相对时间 -> 源文件上同一帧的相对时间（ms）"""
+        return max(0, int(round(t_ms + self.offset_ms)))
+
+    def to_proxy(self, t_ms):
+        return max(0, int(round(t_ms - self.offset_ms)))
+
+
+def first_frame_ms(path):
+    """(第一帧视频相对容器起始时间的 ms, 视频帧数或 None)"""
+    out = subprocess.check_output([
+        "ffprobe", "-v", "error", "-select_streams", "v:0", "-read_intervals", "%+#1",
+        "-show_entries", "frame=best_effort_timestamp_time:stream=nb_frames:format=start_time",
+        "-of", "json", path
+    ])
+    info = json.loads(out)
+    frame = (info.get("frames") or [{}])[0].get("best_effort_timestamp_time")
+    container = (info.get("format") or {}).get("start_time")
+    frames = (info.get("streams") or [{}])[0].get("nb_frames")
+
+    def seconds(value):
+        return float(value) if value not in (None, "N/A") else 0.0
+    return ((seconds(frame) - seconds(container)) * 1000,
+            int(frames) if frames not in (None, "N/A") else None)
+
+
+def build_proxy(video_file, out_file, height=PROXY_HEIGHT):
+    """用 ffmpeg 生成代理文件，返回 out_file"""
+    subprocess.run([
+        "ffmpeg", "-hide_banner", "-loglevel", "error", "-y",
+        "-i", video_file,
+        "-map", "0:v:0", "-map", "0:a:0?",
+        "-vf", f"scale=-2:{height}",
+        "-fps_mode", "passthrough",
+        "-c:v", "libx264", "-preset", "veryfast", "-crf", str(PROXY_CRF),
+        "-g", str(PROXY_GOP), "-keyint_min", str(PROXY_GOP), "-sc_threshold", "0",
+        "-pix_fmt", "yuv420p",
+        "-c:a", "aac", "-b:a", "96k", "-ac", "2",
+        out_file
+    ], check=True)
+    return out_file
+
+
+def proxy_paths(video_file, height=PROXY_HEIGHT, root=None):
+    """(代理文件, 元数据文件)；文件名包含源文件指纹与编码参数"""
+    name = f"{snapcache.fingerprint(video_file)}-{height}p-g{PROXY_GOP}-crf{PROXY_CRF}"
+    root = root or DEFAULT_ROOT
+    return os.path.join(root, name + ".mp4"), os.path.join(root, name + ".json")
+
+
+def ensure_proxy(video_file, height=PROXY_HEIGHT, root=None):
+    """返回 Proxy；已生成过时直接复用"""
+    path, meta_path = proxy_paths(video_file, height, root)
+    if os.path.exists(path) and os.path.exists(meta_path):
+        with open(meta_path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta.get("version") == META_VERSION:
+            os.utime(path)  # 供 prune 按最近使用淘汰
+            return Proxy(path, meta["offset_ms"], meta.get("frames"))
+
+    log.info(f"生成代理: {video_file}")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # 在目标目录中生成再改名，中途退出不会留下看似完整的代理
+    tmp = f"{os.path.splitext(path)[0]}.{os.getpid()}.tmp.mp4"
+    try:
+        build_proxy(video_file, tmp, height)
+        source_first, source_frames = first_frame_ms(video_file)
+        proxy_first, proxy_frames = first_frame_ms(tmp)
+        if source_frames and proxy_frames and source_frames != proxy_frames:
+            log.warning(f"代理帧数 {proxy_frames} 与源文件 {source_frames} 不一致，时间换算可能有偏差")
+        meta = {"version": META_VERSION, "offset_ms": source_first - proxy_first, "frames": proxy_frames}
+        os.replace(tmp, path)
+        with open(meta_path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        os.replace(meta_path + ".tmp", meta_path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    removed = prune(root=os.path.dirname(path), keep={path})
+    if removed:
+        log.info(f"按容量上限删除 {removed} 个旧代理")
+    return Proxy(path, meta["offset_ms"], meta["frames"])
+
+
+def prune(max_bytes=None, root=None, keep=None):
+    """按最近使用删除代理，直到总大小不超过上限；keep 中的代理不删（包括正在播放的）。返回删除数"""
+    max_bytes = DEFAULT_MAX_MB * 1024 * 1024 if max_bytes is None else max_bytes
+    root = root or DEFAULT_ROOT
+    if not os.path.isdir(root):
+        return 0
+    proxies = []
+    for name in os.listdir(root):
+        path = os.path.join(root, name)
+        if name.endswith(".mp4") and not name.endswith(".tmp.mp4"):
+            proxies.append((os.path.getmtime(path), os.path.getsize(path), path))
+    total = sum(size for _, size, _ in proxies)
+    removed = 0
+    for _, size, path in sorted(proxies):
+        if total <= max_bytes:
+            break
+        if keep and path in keep:
+            continue
+        try:
+            os.remove(path)
+        except OSError:
+            continue  # Windows 下正在播放的代理删不掉
+        try:
+            os.remove(os.path.splitext(path)[0] + ".json")
+        except FileNotFoundError:
+            pass
+        total -= size
+        removed += 1
+    return removed
+
+
+def start_proxy(video_file, height=PROXY_HEIGHT):
+    """在后台生成代理，返回 Future；多个视频按提交顺序逐个生成"""
+    return _builder.submit(ensure_proxy, video_file, height)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="生成低分辨率代理")
+    parser.add_argument("video", nargs="?")
+    parser.add_argument("--height", type=int, default=PROXY_HEIGHT)
+    parser.add_argument("--prune", action="store_true", help="按容量上限删除旧代理")
+    parser.add_argument("--max-size", type=float, default=DEFAULT_MAX_MB, help="代理目录上限（MB）")
+    args = parser.parse_args(argv)
+    if args.prune:
+        removed = prune(int(args.max_size * 1024 * 1024))
+        print(f"[INFO] 删除 {removed} 个代理")
+    if args.video:
+        proxy = ensure_proxy(args.video, height=args.height)
+        print(f"[INFO] 代理: {proxy.path}（与源文件的时间差 {proxy.offset_ms:.1f}ms）")
+    elif not args.prune:
+        parser.error("需要视频路径或 --prune")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,90 @@
+import os
+import re
+import json
+import tempfile
+import subprocess
+
+import numpy as np
+
+import snapcache
+
+# --- 窗口内择优：在目标时间附近低分辨率解码一小段，按清晰度/曝光打分选最佳帧 ---
+#
+# 每个窗口只启动一次 ffmpeg、顺序读一遍；帧缩到 SCORE_SIZE 的灰度图后整体做向量化计算：
+#   清晰度 = 拉普拉斯算子响应的方差（运动模糊、转场叠化时明显偏低）
+#   曝光   = 灰度直方图 5%~95% 分位的跨度，减去过暗/过曝像素占比
+
+SCORE_SIZE = (320, 180)
+SHOWINFO_PTS = re.compile(r"pts_time:\s*([-0-9.]+)")
+SHARPNESS_WEIGHT = 0.7
+SPREAD_WEIGHT = 0.3
+CLIPPED_PENALTY = 0.5
+
+
+def decode_window(video_file, start_ms, window_ms, size=SCORE_SIZE):
+    """从 start_ms 起顺序解码 window_ms 内的所有帧，返回 (各帧时间 ms, uint8 数组 [n, h, w])"""
+    w, h = size
+    proc = subprocess.run([
+        "ffmpeg", "-hide_banner", "-nostats", "-loglevel", "info",
+        "-ss", f"{start_ms / 1000:.3f}",
+        "-i", video_file,
+        "-t", f"{window_ms / 1000:.3f}",
+        "-an", "-sn",
+        "-vf", f"showinfo,scale={w}:{h}:flags=area,format=gray",
+        "-fps_mode", "passthrough",
+        "-f", "rawvideo", "-pix_fmt", "gray", "pipe:1",
+    ], capture_output=True)
+    frames = np.frombuffer(proc.stdout, dtype=np.uint8)
+    n = frames.size // (w * h)
+    frames = frames[:n * w * h].reshape(n, h, w)
+    # showinfo 的 pts_time 相对于 -ss 位置
+    pts = [float(m) for m in SHOWINFO_PTS.findall(proc.stderr.decode("utf-8", "replace"))]
+    if len(pts) < n:
+        pts += [pts[-1] if pts else 0.0] * (n - len(pts))
+    # 向下取整：-ss 定位到不早于该时间的第一帧，向上取整会落到下一帧
+    times = np.floor(start_ms + np.asarray(pts[:n]) * 1000).astype(np.int64)
+    return times, frames
+
+
+def score_frames(frames):
+    """frames: uint8 [n, h, w]，返回每帧的各项得分（均为长度 n 的数组）"""
+    f = frames.astype(np.float32)
+    lap = (f[:, :-2, 1:-1] + f[:, 2:, 1:-1] + f[:, 1:-1, :-2] + f[:, 1:-1, 2:]) - 4.0 * f[:, 1:-1, 1:-1]
+    sharpness = lap.reshape(len(f), -1).var(axis=1)
+    flat = frames.reshape(len(frames), -1)
+    p5, p95 = np.percentile(flat, [5, 95], axis=1)
+    spread = (p95 - p5) / 255.0
+    clipped = ((flat <= 2) | (flat >= 253)).mean(axis=1)
+    sharp_norm = sharpness / max(float(sharpness.max()), 1e-6)
+    score = SHARPNESS_WEIGHT * sharp_norm + SPREAD_WEIGHT * spread - CLIPPED_PENALTY * clipped
+    return {"sharpness": sharpness, "spread": spread, "clipped": clipped, "score": score}
+
+
+def best_in_window(video_file, t_ms, window_ms=1000, duration_ms=None, cache=None):
+    """返回 (最佳帧时间 ms, 该帧得分 dict)；窗口内解码失败时退回 t_ms"""
+    start_ms = max(0, t_ms - window_ms // 2)
+    if duration_ms:
+        start_ms = max(0, min(start_ms, duration_ms - window_ms))
+    key = None
+    if cache:
+        key = cache.key("best", snapcache.fingerprint(video_file), start_ms, window_ms, SCORE_SIZE)
+        cached = cache.get(key)
+        if cached:
+            with open(cached, "r", encoding="utf-8") as f:
+                result = json.load(f)
+            return result["t_ms"], result["scores"]
+
+    times, frames = decode_window(video_file, start_ms, window_ms)
+    if len(frames) == 0:
+        return t_ms, {}
+    scores = score_frames(frames)
+    best = int(np.argmax(scores["score"]))
+    result = {"t_ms": int(times[best]), "scores": {k: round(float(v[best]), 4) for k, v in scores.items()}}
+    if key:
+        fd, tmp = tempfile.mkstemp(suffix=".json")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(result, f)
+        cache.put(key, tmp, move=True)
+        if os.path.exists(tmp):  # 缓存被禁用时 put 不会移走文件
+            os.remove(tmp)
+    return result["t_ms"], result["scores"]
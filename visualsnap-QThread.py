@@ -1,10 +1,15 @@
 import sys
 import os
-import datetime
-import subprocess
-import shutil
-import glob
+import queue
 from PyQt5 import QtWidgets, QtCore, QtGui
+import snapcore
+import snapcache
+import snaporiginals
+import snapproxy
+import snaplog
+
+snaplog.setup()
+log = snaplog.get_logger("gui")
 
 # --- 确保 mpv DLL 能被找到 ---
 def ensure_mpv_dll_loaded(extra_dirs=None):
@@ -33,12 +38,12 @@ def ensure_mpv_dll_loaded(extra_dirs=None):
                     except Exception:
                         pass
                 os.environ["PATH"] = dll_dir + os.pathsep + os.environ.get("PATH", "")
-                print(f"[mpv-dll] 加入 DLL 目录：{dll_dir}, 用文件：{dll}")
+                log.info(f"[mpv-dll] 加入 DLL 目录：{dll_dir}, 用文件：{dll}")
                 break
         if found:
             break
     if not found:
-        print("[mpv-dll] 未找到 libmpv DLL，可能会导入失败")
+        log.warning("[mpv-dll] 未找到 libmpv DLL，可能会导入失败")
 
 # 确保在 import mpv 前加载 DLL
 ensure_mpv_dll_loaded(extra_dirs=None)
@@ -57,13 +62,15 @@ class StoryboardWorker(QtCore.QThread):
     progress = QtCore.pyqtSignal(str)
     finished = QtCore.pyqtSignal(str)
 
-    def __init__(self, parent=None):
+    def __init__(self, parent=None, profiles=None):
         super().__init__(parent)
         self.main = parent  # 传入主窗口引用
+        self.profiles = profiles or [snapcore.LAYOUT_PROFILES["default"]]
 
     def run(self):
         main = self.main
-        if not main.screenshots:
+        records = list(main.frames)  # 按时间排序
+        if not records:
             self.finished.emit("没有截图，无法生成 Storyboard")
             return
 
@@ -71,28 +78,15 @@ class StoryboardWorker(QtCore.QThread):
         self.progress.emit("[INFO] 生成视频信息图片...")
         info_img = main.generate_video_info_image()
 
-        # 拼接截图
-        files = [x[0] for x in main.screenshots]
-        montage_file = os.path.join(main.video_dir, "montaged.png")
-        self.progress.emit("[INFO] 拼接截图...")
-        subprocess.run(["magick", "montage"] + files + ["-background", "none", "-geometry", "600x+5+5", "-tile", "3x", montage_file])
-
-        # 扩展到 1920 宽度，垂直居中
-        subprocess.run([
-            "magick", montage_file,
-            "-background", "none",
-            "-gravity", "center",
-            "-extent", "1920x",
-            montage_file
-        ])
-
-        # 合并视频信息图片和 montage
-        if info_img and os.path.exists(info_img):
-            snaps_file = os.path.join(main.video_dir, "Snaps.png")
-            subprocess.run(["magick", "montage", info_img, montage_file, "-background", "none", "-geometry", "+0+0", "-tile", "1x2", snaps_file])
-            final_input = snaps_file
-        else:
-            final_input = montage_file
+        # 拼接截图：优先用帧存储或原图存储中未加时间戳的原图，各版式按自己的尺寸重新标注
+        frames = []
+        for record in records:
+            original = main.original_path(record.path)
+            if record.buffer is not None or original:
+                frames.append((original or record.path, record.timestamp))
+            else:
+                frames.append((record.path, None))
+        self.progress.emit(f"[INFO] 拼接截图（{len(self.profiles)} 个版式）...")
 
         # Pattern处理
         pattern_idx = main.pattern_combo.currentIndex()
@@ -100,34 +94,185 @@ class StoryboardWorker(QtCore.QThread):
             pattern_file = main.pattern_files[pattern_idx]
         else:
             pattern_file = None
-        width, height = map(int, subprocess.check_output(["magick", "identify", "-format", "%w %h", final_input]).decode().strip().split())
-        tiles_file = os.path.join(main.video_dir, "Tiles.jpg")
-        if pattern_file:
-            subprocess.run(["magick", "-size", f"{width}x{height}", "tile:" + pattern_file, tiles_file])
-        else:
-            subprocess.run(["magick", "-size", f"{width}x{height}", "canvas:white", tiles_file])
-
-        final_file = os.path.join(main.video_dir, f"Storyboard-{os.path.basename(main.video_file)}.jpg")
-        subprocess.run(["magick", "composite", "-type", "truecolor", final_input, tiles_file, final_file])
+        outputs = snapcore.render_layouts(main.video_file, frames, self.profiles, pattern_file, main.video_dir,
+                                          info_img=info_img, cache=main.cache, store=main.frame_store)
+        final_file = ", ".join(outputs)
 
         self.progress.emit(f"生成 Storyboard: {final_file}")
-        print(f"[INFO] 完成！输出文件: {final_file}")
+        log.info(f"完成！输出文件: {final_file}")
 
         # --- 清理临时文件 ---
-        temp_files = [
-            os.path.join(main.video_dir, f) for f in ["out.png", "output.txt", "montaged.png", "Snaps.png", "Tiles.jpg"]
-        ]
-        temp_files += glob.glob(os.path.join(main.video_dir, "Screenshot=*.jpg"))
-        for f in temp_files:
-            try:
-                os.remove(f)
-            except FileNotFoundError:
-                pass
+        snapcore.cleanup_temp_files(main.video_dir)
 
         self.finished.emit(final_file)
-        
+
+
+# --- 手动截图的后台处理：GUI 线程只向 mpv 请求截图，备份 / 标注 / 缩略图在这里完成 ---
+CAPTURE_QUEUE_SIZE = 32
+CAPTURE_TIMEOUT = 10  # 等待 mpv 写完截图文件的秒数
+
+
+class CaptureWorker(QtCore.QThread):
+    captured = QtCore.pyqtSignal(int, str, object)  # t_ms, 文件路径, 缩略图 QImage
+    failed = QtCore.pyqtSignal(int, str)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.jobs = queue.Queue(maxsize=CAPTURE_QUEUE_SIZE)
+
+    def submit(self, t_ms, outfile, pending, pixels=None, context=None):
+        """pending: mpv command_async 返回的 future（同步截图时为 None），或在这里执行的抽帧函数；
+        pixels: 预解码缓冲中的 RGB 帧，给出时由这里直接写出截图；
+        context: 提交时的 (截图目录, 原图存储, 帧存储, 缓存)，工作线程不读主窗口的属性。队列满时返回 False"""
+        try:
+            self.jobs.put_nowait((t_ms, outfile, pending, pixels, context))
+        except queue.Full:
+            return False
+        return True
+
+    def stop(self):
+        self.jobs.put(None)
+        self.wait(CAPTURE_TIMEOUT * 1000)
+
+    def run(self):
+        # 单个消费者按提交顺序处理，信号也按同样顺序到达 GUI 线程
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                break
+            t_ms, outfile, pending, pixels, (video_dir, originals, store, cache) = job
+            try:
+                if callable(pending):
+                    pending()  # 从源文件抽取（播放的是代理时）
+                elif pending is not None:
+                    pending.result(timeout=CAPTURE_TIMEOUT)
+                if pixels is not None:
+                    save_pixels(pixels, outfile)
+                if not os.path.exists(outfile):
+                    raise RuntimeError("mpv 未写出截图文件")
+                stamp_capture(outfile, snapcore.ms_to_timestamp(t_ms), video_dir, originals, store, cache)
+                self.captured.emit(t_ms, outfile, self.thumbnail_image(t_ms, outfile, store))
+            except Exception as e:
+                self.failed.emit(t_ms, str(e))
+
+    def thumbnail_image(self, t_ms, outfile, store):
+        # 工作线程里只能用 QImage，QPixmap 留给 GUI 线程
+        pixels = store.frame(t_ms) if store is not None else None
+        if pixels is None:
+            return QtGui.QImage(outfile).scaledToWidth(120)
+        # 拷出映射内存：GUI 线程可能在 compact / 换视频时释放映射
+        pixels = pixels.copy()
+        h, w = pixels.shape[:2]
+        return QtGui.QImage(pixels.data, w, h, w * 4, QtGui.QImage.Format_RGBX8888).scaledToWidth(
+            120, QtCore.Qt.SmoothTransformation)
+
+
+def save_pixels(pixels, outfile):
+    """把 RGB 帧写成 JPEG；没有 Pillow 时用 QImage（可在工作线程中使用）"""
+    if snapcore.Image is not None:
+        snapcore.Image.fromarray(pixels).save(outfile, quality=95)
+        return
+    h, w = pixels.shape[:2]
+    data = pixels.tobytes()
+    if not QtGui.QImage(data, w, h, w * 3, QtGui.QImage.Format_RGB888).save(outfile, None, 95):
+        raise RuntimeError(f"写出截图失败: {outfile}")
+
+
+def stamp_capture(image_file, timestamp, video_dir, originals=None, store=None, cache=None):
+    """为截图添加时间戳：保存原图、记录 keyframes.txt、存入帧存储后标注"""
+    log.info(f"为截图 {image_file} 添加时间戳 {timestamp}")
+    # 保存原始截图（硬链接 / reflink / 归档，按内容去重）
+    if originals is not None:
+        try:
+            mode = originals.add(image_file)
+            log.info(f"已保存原图 ({mode}) -> {originals.root}")
+        except Exception as e:
+            log.warning(f"保存原图失败: {e}")
+
+    # 写入 keyframes.txt
+    keyframes_file = os.path.join(video_dir, "keyframes.txt")
+    with open(keyframes_file, "a", encoding="utf-8") as f:
+        f.write(timestamp + "\n")
+
+    # 标注前先把原图存入帧存储
+    if store is not None:
+        try:
+            store.put_image(snapcore.timestamp_to_ms(timestamp), image_file)
+        except OSError as e:
+            log.warning(f"存入帧存储失败: {e}")
+
+    # 使用 ImageMagick 添加时间戳
+    snapcore.annotate_timestamp(image_file, timestamp, cache=cache)
+
+
+# --- 调试日志窗口：代替控制台输出，F12 显示 / 隐藏 ---
+class LogView(QtWidgets.QDockWidget):
+    LEVELS = [("DEBUG", "DEBUG"), ("INFO", "INFO"), ("WARN", "WARN")]
+
+    def __init__(self, parent=None, player=None):
+        super().__init__("调试日志", parent)
+        self.player = player
+        self.seq = 0  # 已显示到的历史序号
+
+        widget = QtWidgets.QWidget()
+        layout = QtWidgets.QVBoxLayout(widget)
+        layout.setContentsMargins(2, 2, 2, 2)
+        row = QtWidgets.QHBoxLayout()
+        self.level_combo = QtWidgets.QComboBox()
+        for label, level in self.LEVELS:
+            self.level_combo.addItem(label, level)
+        self.level_combo.setCurrentIndex(max(0, self.level_combo.findData(snaplog.current_level())))
+        self.level_combo.currentIndexChanged.connect(self.set_level)
+        clear_btn = QtWidgets.QPushButton("清空")
+        clear_btn.clicked.connect(lambda: self.text.clear())
+        self.dropped_label = QtWidgets.QLabel()
+        row.addWidget(QtWidgets.QLabel("级别:"))
+        row.addWidget(self.level_combo)
+        row.addWidget(clear_btn)
+        row.addStretch(1)
+        row.addWidget(self.dropped_label)
+        layout.addLayout(row)
+
+        self.text = QtWidgets.QPlainTextEdit()
+        self.text.setReadOnly(True)
+        self.text.setMaximumBlockCount(snaplog.HISTORY_SIZE)
+        self.text.setFont(QtGui.QFontDatabase.systemFont(QtGui.QFontDatabase.FixedFont))
+        layout.addWidget(self.text)
+        self.setWidget(widget)
+
+        # 只在可见时轮询内存历史，日志线程与界面之间没有逐条的信号
+        self.timer = QtCore.QTimer(self)
+        self.timer.setInterval(250)
+        self.timer.timeout.connect(self.poll)
+        self.visibilityChanged.connect(self.on_visibility_changed)
+
+    def on_visibility_changed(self, visible):
+        if visible:
+            self.poll()
+            self.timer.start()
+        else:
+            self.timer.stop()
+
+    def poll(self):
+        history = snaplog.history()
+        if history is None:
+            return
+        self.seq, lines = history.since(self.seq)
+        if lines:
+            self.text.appendPlainText("\n".join(line for _, line in lines))
+        dropped = snaplog.dropped()
+        self.dropped_label.setText(f"缓冲溢出丢弃 {dropped} 条" if dropped else "")
+
+    def set_level(self):
+        snaplog.set_level(self.level_combo.currentData())
+        if self.player is not None and hasattr(self.player, "set_loglevel"):
+            self.player.set_loglevel(snaplog.mpv_loglevel())
+
+
 class VideoStoryboard(QtWidgets.QMainWindow):
     flash_signal = QtCore.pyqtSignal(str)  # ✅ 定义信号，放在类体里
+    pause_changed = QtCore.pyqtSignal(bool)  # mpv 事件线程 -> GUI 线程
+    proxy_ready = QtCore.pyqtSignal(object)  # 代理生成线程 -> GUI 线程
     def __init__(self):
         super().__init__()
         self.setWindowTitle("Video Storyboard")
@@ -172,12 +317,78 @@ class VideoStoryboard(QtWidgets.QMainWindow):
         pattern_row_layout.addWidget(self.pattern_combo, 1)
 
         auto_layout.addRow("抽帧数:", self.steps_input)
+
+        # 帧数预算：按时长与章节决定帧数，按目标耗时封顶（代替固定抽帧数）
+        budget_row_widget = QtWidgets.QWidget()
+        budget_row_layout = QtWidgets.QHBoxLayout(budget_row_widget)
+        budget_row_layout.setContentsMargins(0, 0, 0, 0)
+        self.budget_check = QtWidgets.QCheckBox("按时长/章节")
+        self.budget_target_input = QtWidgets.QSpinBox()
+        self.budget_target_input.setRange(0, 3600)
+        self.budget_target_input.setSingleStep(10)
+        self.budget_target_input.setSuffix(" s")
+        self.budget_target_input.setSpecialValueText("不限时")
+        self.budget_target_input.setToolTip("抽帧目标耗时，按实测单帧耗时限制帧数")
+        self.budget_check.toggled.connect(lambda checked: self.steps_input.setEnabled(not checked))
+        budget_row_layout.addWidget(self.budget_check)
+        budget_row_layout.addWidget(self.budget_target_input, 1)
+        auto_layout.addRow("帧数预算:", budget_row_widget)
+
+        # 窗口择优：在每个抽帧点附近挑最清晰的一帧（需要 numpy）
+        best_row_widget = QtWidgets.QWidget()
+        best_row_layout = QtWidgets.QHBoxLayout(best_row_widget)
+        best_row_layout.setContentsMargins(0, 0, 0, 0)
+        self.best_check = QtWidgets.QCheckBox("择优")
+        self.best_window_input = QtWidgets.QSpinBox()
+        self.best_window_input.setRange(100, 10000)
+        self.best_window_input.setSingleStep(100)
+        self.best_window_input.setValue(1000)
+        self.best_window_input.setSuffix(" ms")
+        best_row_layout.addWidget(self.best_check)
+        best_row_layout.addWidget(self.best_window_input, 1)
+        if snapcore.snapscore is None:
+            self.best_check.setEnabled(False)
+            self.best_check.setToolTip("需要安装 numpy")
+        auto_layout.addRow("择优窗口:", best_row_widget)
+
+        # 音频波形条（后台流式解码，与抽帧并行）
+        self.waveform_check = QtWidgets.QCheckBox("在信息图下方加音频波形")
+        if snapcore.snapaudio is None:
+            self.waveform_check.setEnabled(False)
+            self.waveform_check.setToolTip("需要安装 numpy")
+        self.waveform_check.toggled.connect(self.start_waveform)
+        auto_layout.addRow("音频:", self.waveform_check)
+
+        # 抽帧解码后端：ffmpeg 命令行 / 进程内 PyAV / 测速后自动选择
+        self.decoder_combo = QtWidgets.QComboBox()
+        self.decoder_combo.addItem("ffmpeg 命令行", None)
+        if snapcore.snapdecode is not None and "pyav" in snapcore.snapdecode.available_backends():
+            self.decoder_combo.addItem("PyAV（进程内）", "pyav")
+            self.decoder_combo.addItem("自动（测速选择）", "auto")
+        auto_layout.addRow("解码:", self.decoder_combo)
+
+        # 低分辨率代理：预览、拖动、逐帧与择优打分在代理上进行，截图仍取自源文件
+        self.proxy_check = QtWidgets.QCheckBox("大文件用低分辨率代理预览")
+        self.proxy_check.toggled.connect(self.on_proxy_toggled)
+        auto_layout.addRow("代理:", self.proxy_check)
         auto_layout.addRow("Pattern选择:", pattern_row_widget)
 
         # 浏览按钮
         self.browse_pattern_btn = QtWidgets.QPushButton("浏览新Pattern")
         auto_layout.addRow("", self.browse_pattern_btn)
 
+        # 输出版式（可多选，一次生成多个尺寸）
+        self.layout_list = QtWidgets.QListWidget()
+        self.layout_list.setMaximumHeight(80)
+        self.layout_profiles = snapcore.load_layout_profiles()
+        for name, profile in self.layout_profiles.items():
+            item = QtWidgets.QListWidgetItem(f"{name} ({profile.columns}列 {profile.cell_width}px / {profile.canvas_width}px)")
+            item.setData(QtCore.Qt.UserRole, name)
+            item.setFlags(item.flags() | QtCore.Qt.ItemIsUserCheckable)
+            item.setCheckState(QtCore.Qt.Checked if name == "default" else QtCore.Qt.Unchecked)
+            self.layout_list.addItem(item)
+        auto_layout.addRow("输出版式:", self.layout_list)
+
         self.auto_group.setLayout(auto_layout)
         control_layout.addWidget(self.auto_group)
 
@@ -185,8 +396,7 @@ class VideoStoryboard(QtWidgets.QMainWindow):
         self.load_patterns()
 
         # --- 添加帧数计数器 ---
-        self.frame_count = 0  # 初始化帧数
-        self.frame_count_label = QtWidgets.QLabel(f"当前帧数: {self.frame_count}")
+        self.frame_count_label = QtWidgets.QLabel("当前帧数: 0")
         self.frame_count_label.setStyleSheet("font-weight: bold;")  # 可选：加粗显示
         control_layout.addWidget(self.frame_count_label)
 
@@ -245,10 +455,14 @@ class VideoStoryboard(QtWidgets.QMainWindow):
             wid=str(int(self.video_widget.winId())),
             ytdl=False,
             osc=False,  # 关闭自带 OSC
-            log_handler=print,
-            loglevel="info"
+            log_handler=snaplog.mpv_log_handler,  # 只入队，不在 mpv 事件线程里写控制台
+            loglevel=snaplog.mpv_loglevel()
         )
 
+        self.log_view = LogView(self, self.player)
+        self.addDockWidget(QtCore.Qt.BottomDockWidgetArea, self.log_view)
+        self.log_view.hide()
+
         # --- 定时器更新进度条 ---
         self.update_timer = QtCore.QTimer()
         self.update_timer.setInterval(200)
@@ -269,9 +483,34 @@ class VideoStoryboard(QtWidgets.QMainWindow):
         self.generate_btn.clicked.connect(self.generate_storyboard)
         self.browse_pattern_btn.clicked.connect(self.browse_pattern)
 
-        self.screenshots = []
+        self.frames = snapcore.FrameCollection()  # 当前所有截图，按时间排序
         self.video_file = None
         self.video_dir = None  # 新增：存储视频文件所在目录
+        self.cache = snapcache.default_cache()  # 抽帧 / 标注 / 故事板结果缓存
+        self.waveform_future = None  # 当前视频的音频包络（后台计算）
+        self.pending_captures = set()  # 已请求、尚未处理完的手动截图时间
+        self.capture_worker = CaptureWorker(self)
+        self.capture_worker.captured.connect(self.on_capture_done)
+        self.capture_worker.failed.connect(self.on_capture_failed)
+        self.capture_worker.start()
+
+        # 逐帧步进：暂停时在后台预解码播放头前后的帧（需要 numpy）
+        self.frame_ring = snapcore.snapdecode.FrameRing() if snapcore.snapdecode is not None else None
+        self.step_pos = None  # 正在显示的缓冲帧时间（ms），None 表示未在步进
+        self.step_overlay = None
+        self.ring_timer = QtCore.QTimer(self)
+        self.ring_timer.setSingleShot(True)
+        self.ring_timer.setInterval(300)  # 连续 seek 时只在停下后填充一次
+        self.ring_timer.timeout.connect(self.fill_frame_ring)
+        self.pause_changed.connect(self.on_pause_changed)
+
+        self.proxy = None  # 当前视频已生成的代理
+        self.proxy_future = None
+        self.playing_proxy = False  # mpv 当前播放的是否为代理
+        self.proxy_ready.connect(self.on_proxy_ready)
+        self.player.observe_property("pause", lambda name, value: self.pause_changed.emit(bool(value)))
+        self.frame_store = None  # 当前视频已解码的帧（内存映射，跨会话保留）
+        self.originals = None  # 当前视频的全分辨率原图
 
         # 键盘事件
         self.video_widget.setFocusPolicy(QtCore.Qt.StrongFocus)
@@ -295,9 +534,13 @@ class VideoStoryboard(QtWidgets.QMainWindow):
     def slider_seek(self, value):
         if self.video_file and self.player.duration is not None:
             self.update_timer.stop()  # 暂停定时器
-            t = value / 1000.0 * self.player.duration
-            print(f"[DEBUG] Seek to {t:.2f}s (slider value: {value}, duration: {self.player.duration})")
+            duration = self.player.duration
+            t = value / 1000.0 * duration
+            log.debug("Seek to %.2fs (slider value: %s, duration: %s)", t, value, duration)
             self.player.seek(t, reference="absolute")  # 移除 precise=True
+            self.end_step()
+            if self.player.pause:
+                self.schedule_ring_fill()
             QtCore.QTimer.singleShot(500, self.update_timer.start)  # 500ms 后恢复定时器
     def slider_press(self):
         self.slider_is_pressed = True
@@ -355,94 +598,298 @@ class VideoStoryboard(QtWidgets.QMainWindow):
         )
         if filename:
             self.player.play(filename)
+            self.playing_proxy = False
+            self.proxy = self.proxy_future = None
             self.video_file = filename
             self.video_dir = os.path.dirname(filename)  # 存储视频文件目录
-            print(f"[INFO] 打开视频: {filename}, 目录: {self.video_dir}")
+            log.info(f"打开视频: {filename}, 目录: {self.video_dir}")
+            self.waveform_future = None
+            self.start_waveform()
+            self.originals = snaporiginals.open_store(filename)
+            self.open_frame_store()
+            self.end_step()
+            if self.frame_ring is not None:
+                self.frame_ring.clear()
+            if self.proxy_check.isChecked():
+                self.start_proxy()
+
+    # --- 音频波形：勾选后立即在后台开始解码，生成故事板时再取结果 ---
+    def start_waveform(self):
+        if self.video_file and self.waveform_check.isChecked() and self.waveform_future is None:
+            log.info("后台计算音频波形...")
+            self.waveform_future = snapcore.start_waveform(self.video_file, cache=self.cache)
+
+    def waveform_result(self):
+        if not self.waveform_check.isChecked() or self.waveform_future is None:
+            return None
+        try:
+            return self.waveform_future.result()
+        except Exception as e:
+            log.warning(f"音频波形计算失败: {e}")
+            return None
+
+    # --- 帧存储：重新打开视频时直接恢复上次的帧，不再解码 ---
+    def open_frame_store(self):
+        self.clear_thumbnails()
+        self.frame_store = None
+        if snapcore.snapframes is None or snapcore.Image is None:
+            return
+        try:
+            self.frame_store = snapcore.snapframes.open_store(self.video_file)
+        except OSError as e:
+            log.warning(f"帧存储不可用: {e}")
+            return
+        for t_ms in self.frame_store.times():
+            self.add_thumbnail(snapcore.screenshot_path(self.video_dir, t_ms), t_ms, source="restored")
+        if len(self.frame_store):
+            log.info(f"从帧存储恢复 {len(self.frame_store)} 帧")
+
+    def original_path(self, filepath):
+        """截图对应的未标注原图，没有时返回 None（兼容旧版 backup/ 下的直接拷贝）"""
+        original = self.originals.path(filepath) if self.originals else None
+        if original is None:
+            legacy = os.path.join(self.video_dir, "backup", os.path.basename(filepath))
+            original = legacy if os.path.isfile(legacy) else None
+        return original
+
+    def stored_frame(self, t_ms):
+        """帧存储中该时间点的像素视图，不在其中时返回 None"""
+        if self.frame_store is None:
+            return None
+        return self.frame_store.frame(t_ms)
+
+    def clear_thumbnails(self):
+        """只移除界面上的缩略图，不删除文件"""
+        for record in self.frames:
+            record.widget.setParent(None)
+        self.frames.clear()
+        self.update_frame_count()
+
+    def update_frame_count(self):
+        self.frame_count_label.setText(f"当前帧数: {len(self.frames)}")
 
     def toggle_play_pause(self):
         self.player.pause = not self.player.pause
 
+    # --- 低分辨率代理 ---
+    def start_proxy(self):
+        if not self.video_file or self.proxy_future is not None:
+            return
+        self.flash_message("后台生成低分辨率代理...")
+        future = snapproxy.start_proxy(self.video_file)
+        self.proxy_future = future
+        future.add_done_callback(self.proxy_ready.emit)
+
+    def on_proxy_ready(self, future):
+        if future is not self.proxy_future:
+            return  # 已切换到其他视频
+        try:
+            self.proxy = future.result()
+        except Exception as e:
+            log.warning(f"代理生成失败: {e}")
+            self.flash_message(f"代理生成失败: {e}")
+            self.proxy_future = None
+            return
+        log.info(f"代理就绪: {self.proxy.path}")
+        if self.proxy_check.isChecked():
+            self.switch_playback(True)
+
+    def on_proxy_toggled(self, checked):
+        if checked and self.proxy is None:
+            self.start_proxy()
+        elif self.proxy is not None:
+            self.switch_playback(checked)
+
+    def switch_playback(self, use_proxy):
+        """在源文件与代理之间切换播放，保持当前位置与暂停状态"""
+        if use_proxy == self.playing_proxy or not self.video_file:
+            return
+        t_ms = self.source_time_ms() or 0
+        paused = bool(self.player.pause)
+        self.end_step()
+        if self.frame_ring is not None:
+            self.frame_ring.clear()
+        if use_proxy:
+            path, start = self.proxy.path, self.proxy.to_proxy(t_ms)
+        else:
+            path, start = self.video_file, t_ms
+        self.player.loadfile(path, start=f"{start / 1000:.3f}", pause="yes" if paused else "no")
+        self.playing_proxy = use_proxy
+        self.flash_message("播放代理" if use_proxy else "播放源文件")
+
+    def playing_file(self):
+        return self.proxy.path if self.playing_proxy else self.video_file
+
+    def source_time_ms(self, t_ms=None):
+        """播放位置（或给定的播放器时间）换算到源文件时间"""
+        if t_ms is None:
+            if self.player.time_pos is None:
+                return None
+            t_ms = int(self.player.time_pos * 1000)
+        return self.proxy.to_source(t_ms) if self.playing_proxy else t_ms
+
+    # --- 逐帧步进 ---
+    def on_pause_changed(self, paused):
+        if paused:
+            self.schedule_ring_fill()
+        else:
+            self.end_step()
+            if self.frame_ring is not None:
+                self.frame_ring.clear()
+
+    def schedule_ring_fill(self):
+        if self.frame_ring is not None and self.video_file:
+            self.ring_timer.start()
+
+    def fill_frame_ring(self):
+        if not self.video_file or not self.player.pause or self.player.time_pos is None:
+            return
+        video_file, decoder = self.playing_file(), self.decoder_combo.currentData() or "ffmpeg"
+        center_ms = self.step_pos if self.step_pos is not None else int(self.player.time_pos * 1000)
+        self.frame_ring.fill(lambda: snapcore.snapdecode.open_backend(video_file, decoder, self.cache), center_ms)
+
+    def step_frame(self, delta):
+        if not self.video_file or self.player.time_pos is None:
+            return
+        if not self.player.pause:
+            self.player.pause = True
+        current = self.step_pos if self.step_pos is not None else int(self.player.time_pos * 1000)
+        hit = self.frame_ring.step(current, delta) if self.frame_ring is not None else None
+        if hit is None:
+            # 缓冲外：交给 mpv 逐帧，并围绕新位置重新预解码
+            self.end_step()
+            self.player.command("frame-step" if delta > 0 else "frame-back-step")
+            self.schedule_ring_fill()
+            return
+        t_ms, pixels = hit
+        self.step_pos = t_ms
+        self.show_step_frame(pixels)
+        self.player.seek(t_ms / 1000, reference="absolute", precision="exact")  # mpv 随后对齐到同一帧
+        self.flash_message(f"帧 {snapcore.ms_to_timestamp(t_ms)}", 1000)
+
+    def show_step_frame(self, pixels):
+        """缓冲帧立即以 OSD 覆盖层显示，不等 mpv 从关键帧重新解码"""
+        if snapcore.Image is None or not hasattr(self.player, "create_image_overlay"):
+            return
+        try:
+            osd_w, osd_h = self.player.osd_width, self.player.osd_height
+            if not osd_w or not osd_h:
+                return
+            h, w = pixels.shape[:2]
+            scale = min(osd_w / w, osd_h / h)
+            size = (max(1, int(w * scale)), max(1, int(h * scale)))
+            img = snapcore.Image.fromarray(pixels).resize(size, snapcore.Image.BILINEAR).convert("RGBA")
+            if self.step_overlay is None:
+                self.step_overlay = self.player.create_image_overlay()
+            self.step_overlay.update(img, pos=((osd_w - size[0]) // 2, (osd_h - size[1]) // 2))
+        except Exception as e:
+            log.warning(f"覆盖层显示失败: {e}")
+
+    def end_step(self):
+        self.step_pos = None
+        if self.step_overlay is not None:
+            try:
+                self.step_overlay.remove()
+            except Exception:
+                pass
+            self.step_overlay = None
+
     # --- 截图并添加时间戳 ---
     def screenshot_video(self):
         if self.player.time_pos is None:
             QtWidgets.QMessageBox.warning(self, "提示", "视频尚未播放")
             return
-        t_ms = int(self.player.time_pos * 1000)
-        totalSec = t_ms // 1000
-        ms = t_ms % 1000
-        h = totalSec // 3600
-        m = (totalSec % 3600) // 60
-        s = totalSec % 60
-        timestamp = f"{h:02}.{m:02}.{s:02}.{ms:03}"
-        outfile = os.path.join(self.video_dir, f"Screenshot={timestamp}=.jpg")
-        self.player.command("screenshot-to-file", outfile)
-        print(f"[INFO] 截图: {outfile}")
-
-        # 添加时间戳
-        self.add_timestamp_to_image(outfile, timestamp)
-        self.add_thumbnail(outfile)
+        t_ms = self.source_time_ms()
+        pixels = None
+        if self.step_pos is not None:
+            # 步进中：时间精确到该帧；播放源文件时直接用缓冲里的帧（代理的帧分辨率太低，改从源文件抽取）
+            t_ms = self.source_time_ms(self.step_pos)
+            if self.frame_ring is not None and not self.playing_proxy:
+                pixels = self.frame_ring.get(self.step_pos)
+        if t_ms in self.pending_captures:
+            return
+        outfile = snapcore.screenshot_path(self.video_dir, t_ms)
+        if self.capture_worker.jobs.full():
+            self.flash_message("截图处理中，请稍候...")
+            return
+        # 异步请求截图，立即返回；备份、添加时间戳和缩略图由 CaptureWorker 完成
+        if pixels is not None:
+            pending = None
+        elif self.playing_proxy:
+            video_file = self.video_file
+            pending = lambda: snapcore.extract_frame(video_file, t_ms, outfile, cache=self.cache)
+        elif hasattr(self.player, "command_async"):
+            pending = self.player.command_async("screenshot-to-file", outfile)
+        else:
+            self.player.command("screenshot-to-file", outfile)
+            pending = None
+        self.capture_worker.submit(t_ms, outfile, pending, pixels,
+                                   (self.video_dir, self.originals, self.frame_store, self.cache))
+        self.pending_captures.add(t_ms)
+        log.info(f"截图: {outfile}")
+
+    def on_capture_done(self, t_ms, outfile, image):
+        self.pending_captures.discard(t_ms)
+        self.add_thumbnail(outfile, t_ms, thumbnail=image)
+
+    def on_capture_failed(self, t_ms, error):
+        self.pending_captures.discard(t_ms)
+        log.warning(f"截图 {snapcore.ms_to_timestamp(t_ms)} 失败: {error}")
+        self.flash_message(f"截图失败: {error}")
 
     def add_timestamp_to_image(self, image_file, timestamp):
         """为截图添加时间戳"""
-        print(f"[INFO] 为截图 {image_file} 添加时间戳 {timestamp}")
-        # 创建备份目录
-        backup_dir = os.path.join(self.video_dir, "backup")
-        if not os.path.exists(backup_dir):
-            os.makedirs(backup_dir)
-        # 备份原始截图
-        backup_file = os.path.join(backup_dir, os.path.basename(image_file))
-        try:
-            shutil.copy(image_file, backup_file)
-            print(f"[INFO] 已备份截图 -> {backup_file}")
-        except Exception as e:
-            print(f"[WARN] 备份失败: {e}")
-
-        # 写入 keyframes.txt
-        keyframes_file = os.path.join(self.video_dir, "keyframes.txt")
-        with open(keyframes_file, "a", encoding="utf-8") as f:
-            f.write(timestamp + "\n")
-
-        # 使用 ImageMagick 添加时间戳
-        subprocess.run([
-            "magick", image_file,
-            "-resize", "600x",
-            "-gravity", "SouthWest",
-            "-font", "Consolas-Italic",
-            "-pointsize", "24",
-            "-fill", "white",
-            "-stroke", "black",
-            "-strokewidth", "4",
-            "-annotate", "+10+10", timestamp,
-            "-fill", "white",
-            "-stroke", "none",
-            "-annotate", "+10+10", timestamp,
-            image_file
-        ])
-
-    def add_thumbnail(self, filepath):
+        stamp_capture(image_file, timestamp, self.video_dir, self.originals, self.frame_store, self.cache)
+
+    def add_thumbnail(self, filepath, t_ms, source="manual", scores=None, thumbnail=None):
+        """按时间顺序插入缩略图；同一时间点已有截图时只刷新它的图像。thumbnail: 已缩好的 QImage"""
+        record = snapcore.FrameRecord(t_ms, filepath, buffer=self.stored_frame(t_ms), source=source, scores=scores)
+        index, added = self.frames.add(record)
+        pixmap = QtGui.QPixmap.fromImage(thumbnail) if thumbnail is not None else None
+        if not added:
+            existing = self.frames.get(t_ms)
+            existing.buffer = record.buffer
+            if pixmap is None:
+                pixmap = self.thumbnail_pixmap(existing)
+            existing.widget.findChild(QtWidgets.QLabel).setPixmap(pixmap)
+            log.debug(f"{record.timestamp} 已有截图，不重复添加")
+            return
         widget = QtWidgets.QWidget()
         layout = QtWidgets.QHBoxLayout(widget)
-        pixmap = QtGui.QPixmap(filepath).scaledToWidth(120)
+        if pixmap is None:
+            pixmap = self.thumbnail_pixmap(record)
         label = QtWidgets.QLabel()
         label.setPixmap(pixmap)
         layout.addWidget(label)
         del_btn = QtWidgets.QPushButton("❌")
         del_btn.setMaximumWidth(24)
         layout.addWidget(del_btn)
-        self.thumb_layout.addWidget(widget)
-        self.screenshots.append((filepath, widget))
-        self.frame_count += 1  # 增加帧数计数
-        self.frame_count_label.setText(f"当前帧数: {self.frame_count}")  # 更新显示
-        del_btn.clicked.connect(lambda: self.remove_thumbnail(filepath, widget))
-
-    def remove_thumbnail(self, filepath, widget):
-        widget.setParent(None)
-        self.screenshots = [x for x in self.screenshots if x[0] != filepath]
-        if os.path.exists(filepath):
-            os.remove(filepath)
-            print(f"[INFO] 删除截图: {filepath}")
-        self.frame_count -= 1  # 减少帧数计数
-        self.frame_count_label.setText(f"当前帧数: {self.frame_count}")  # 更新显示
+        record.widget = widget
+        self.thumb_layout.insertWidget(index, widget)
+        self.update_frame_count()
+        del_btn.clicked.connect(lambda: self.remove_thumbnail(record.t_ms))
+
+    def thumbnail_pixmap(self, record):
+        if record.buffer is None:
+            return QtGui.QPixmap(record.path).scaledToWidth(120)
+        # QImage 直接包装映射内存，缩放时才生成新的像素
+        h, w = record.buffer.shape[:2]
+        image = QtGui.QImage(record.buffer.data, w, h, w * 4, QtGui.QImage.Format_RGBX8888)
+        return QtGui.QPixmap.fromImage(image.scaledToWidth(120, QtCore.Qt.SmoothTransformation))
+
+    def remove_thumbnail(self, t_ms):
+        record = self.frames.remove(t_ms)
+        if record is None:
+            return
+        record.widget.setParent(None)
+        if self.frame_store is not None:
+            self.frame_store.remove(t_ms)
+        if self.originals is not None:
+            self.originals.remove(record.path)
+        if os.path.exists(record.path):
+            os.remove(record.path)
+            log.info(f"删除截图: {record.path}")
+        self.update_frame_count()
 
     # --- 自动抽帧 ---
     def auto_snap(self):
@@ -454,68 +901,58 @@ class VideoStoryboard(QtWidgets.QMainWindow):
             steps = int(self.steps_input.text())
         except:
             pass
-        print(f"[INFO] 自动抽取 {steps} 帧")
-        self.flash_message(f"[INFO] 自动抽取 {steps} 帧")
-        duration_ms = int(subprocess.check_output(["mediainfo", "--Inform=Video;%Duration%", self.video_file]).decode().strip())
-        offset = 1000
-        times = [offset + int(i * (duration_ms - 2 * offset) / (steps - 1)) for i in range(steps)]
+        duration_ms = snapcore.probe_duration_ms(self.video_file, self.cache)
+        best_window_ms = self.best_window_input.value() if self.best_check.isChecked() else 0
+        backend = snapcore.open_decoder(self.video_file, self.decoder_combo.currentData(), self.cache)
+        try:
+            if self.budget_check.isChecked():
+                budget = snapcore.FrameBudget(target_s=self.budget_target_input.value() or None)
+                times = snapcore.budget_times(self.video_file, budget, duration_ms, best_window_ms, self.cache, backend)
+            else:
+                times = snapcore.snap_times(duration_ms, steps)
+            log.info(f"自动抽取 {len(times)} 帧")
+            self.flash_message(f"[INFO] 自动抽取 {len(times)} 帧")
+            self.extract_frames(times, duration_ms, best_window_ms, backend)
+        finally:
+            if backend is not None:
+                backend.close()
+        self.flash_message("自动抽帧完成")
+
+    def extract_frames(self, times, duration_ms, best_window_ms, backend=None):
         for idx, t_ms in enumerate(times):
-            totalSec = t_ms // 1000
-            ms = t_ms % 1000
-            h = totalSec // 3600
-            m = (totalSec % 3600) // 60
-            s = totalSec % 60
-            timestamp = f"{h:02}.{m:02}.{s:02}.{ms:03}"
-            outfile = os.path.join(self.video_dir, f"Screenshot={timestamp}=.jpg")
-            print(f"[INFO] [{idx+1}/{len(times)}] 截图时间 {h:02}:{m:02}:{s:02}.{ms:03} -> {outfile}")
-            subprocess.run([
-                "ffmpeg", "-hide_banner", "-loglevel", "error",
-                "-ss", f"{h:02}:{m:02}:{s:02}.{ms:03}",
-                "-i", self.video_file,
-                "-frames:v", "1",
-                "-q:v", "2",
-                outfile
-            ])
+            t_ms, scores = snapcore.refine_time(self.video_file, t_ms, best_window_ms, duration_ms, cache=self.cache,
+                                                proxy=self.proxy if self.proxy_check.isChecked() else None)
+            if scores:
+                log.debug(f"择优 {snapcore.ms_to_timestamp(t_ms)} 得分 {scores}")
+            timestamp = snapcore.ms_to_timestamp(t_ms)
+            outfile = snapcore.screenshot_path(self.video_dir, t_ms)
+            log.info(f"[{idx+1}/{len(times)}] 截图时间 {timestamp} -> {outfile}")
+            snapcore.extract_frame(self.video_file, t_ms, outfile, cache=self.cache, backend=backend)
             # 添加时间戳
             self.add_timestamp_to_image(outfile, timestamp)
-            self.add_thumbnail(outfile)
-        self.flash_message("自动抽帧完成")
+            self.add_thumbnail(outfile, t_ms, source="auto", scores=scores)
 
     # --- 生成视频信息图片 ---
     def generate_video_info_image(self):
         if not self.video_file:
             return None
-        print("[INFO] 生成视频信息图片...")
+        log.info("生成视频信息图片...")
         # print(os.path.basename(self.video_file))
         self.flash_signal.emit("[INFO] 生成视频信息图片...")
-        output_txt = os.path.join(self.video_dir, "output.txt")
-        # 调用 mediainfo 生成文本信息
-        subprocess.run(f'mediainfo --Inform="file://template_mediainfo.txt" "{self.video_file}" > "{output_txt}"', shell=True)
-        # 读取文件内容，替换路径为纯文件名
-        with open(output_txt, "r", encoding="utf-8") as f:
-            content = f.read()
-        basename = os.path.basename(self.video_file)
-        content = content.replace(self.video_file, basename)
-        with open(output_txt, "w", encoding="utf-8") as f:
-            f.write(content)
-        
-        out_img = os.path.join(self.video_dir, "out.png")
-        # 用 ImageMagick 生成透明背景图片
-        subprocess.run([
-            "magick", "-size", "1920x320", "xc:transparent",
-            "-font", "YaHei-Consolas-Hybrid.ttf",
-            "-fill", "white", "-pointsize", "24",
-            "-stroke", "black", "-strokewidth", "2",
-            "-annotate", "+60+60", "@" + output_txt,
-            "-fill", "white", "-stroke", "none",
-            "-annotate", "+60+60", "@" + output_txt,
-            out_img
-        ])
-        return out_img
+        return snapcore.generate_video_info_image(self.video_file, self.video_dir, cache=self.cache,
+                                                  waveform=self.waveform_result())
 
     # --- 生成最终Storyboard ---
+    def selected_layouts(self):
+        profiles = []
+        for i in range(self.layout_list.count()):
+            item = self.layout_list.item(i)
+            if item.checkState() == QtCore.Qt.Checked:
+                profiles.append(self.layout_profiles[item.data(QtCore.Qt.UserRole)])
+        return profiles
+
     def generate_storyboard(self):
-        self.worker = StoryboardWorker(self)
+        self.worker = StoryboardWorker(self, profiles=self.selected_layouts())
         self.worker.progress.connect(self.flash_message)
         self.worker.finished.connect(self.on_storyboard_finished)
         self.worker.start()
@@ -524,9 +961,21 @@ class VideoStoryboard(QtWidgets.QMainWindow):
         self.flash_message(f"完成生成: {final_file}")
  
  
+    def closeEvent(self, event):
+        self.capture_worker.stop()
+        super().closeEvent(event)
+
     # --- 键盘操作 ---
     def keyPressEvent(self, event):
-        if event.key() == QtCore.Qt.Key_Left:
+        if event.key() in (QtCore.Qt.Key_Left, QtCore.Qt.Key_Right, QtCore.Qt.Key_Up, QtCore.Qt.Key_Down):
+            self.end_step()
+            if self.player.pause:
+                self.schedule_ring_fill()
+        if event.key() == QtCore.Qt.Key_Comma:
+            self.step_frame(-1)
+        elif event.key() == QtCore.Qt.Key_Period:
+            self.step_frame(1)
+        elif event.key() == QtCore.Qt.Key_Left:
             self.player.seek(-5)
         elif event.key() == QtCore.Qt.Key_Right:
             self.player.seek(5)
@@ -538,6 +987,8 @@ class VideoStoryboard(QtWidgets.QMainWindow):
             self.toggle_play_pause()
         elif event.key() == QtCore.Qt.Key_S:
             self.screenshot_video()
+        elif event.key() == QtCore.Qt.Key_F12:
+            self.log_view.setVisible(not self.log_view.isVisible())
         else:
             super().keyPressEvent(event)
 
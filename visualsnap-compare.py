@@ -0,0 +1,226 @@
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+import dataclasses
+import concurrent.futures
+
+try:
+    from PIL import ImageDraw
+except ImportError:
+    ImageDraw = None
+
+import snapcore
+import snapcache
+import snapinfo
+import snaplog
+
+# --- 多版本对比故事板：同一母版的多个编码在同一组时间点抽帧，每行一个时间点、每列一个输入 ---
+#
+# 时间点按最短的输入计算一次，所有输入共用；每个输入是进程池中的一个任务（抽帧 + mediainfo 信息图），
+# 各输入并行，总耗时接近最慢的单个输入。每列上方是该输入的信息，按列宽直接排版（字号随列宽缩小），
+# 不把整宽的信息图缩小到一列。
+#
+# 用法:
+#   python visualsnap-compare.py D:/qc/master.mkv D:/qc/x264-crf18.mkv D:/qc/x265-crf20.mkv --steps 12
+#   python visualsnap-compare.py a.mkv b.mkv --layout preview --decoder pyav --out D:/qc
+
+log = snaplog.get_logger("compare")
+HEADER_MARGIN = 20  # 信息四周保留的透明边距
+HEADER_MIN_FONT = 12  # 列太窄时字号不再缩小，过长的取值截断
+
+
+def shared_times(video_files, steps, cache=None):
+    """按最短的输入取时间点，保证每个输入在每个时间点都有帧"""
+    durations = [snapcore.probe_duration_ms(v, cache) for v in video_files]
+    shortest = min(durations)
+    if max(durations) - shortest > 1000:
+        log.warning(f"输入时长不一致（{snapcore.ms_to_timestamp(shortest)} ~ "
+                    f"{snapcore.ms_to_timestamp(max(durations))}），按最短的取时间点")
+    return snapcore.snap_times(shortest, steps)
+
+
+def compare_name(video_files, fmt="jpg"):
+    return f"Compare-{os.path.basename(video_files[0])}+{len(video_files) - 1}.{fmt}"
+
+
+# --- 进程池任务：一个输入的全部帧与信息图 ---
+def extract_input(video_file, times, work_dir, header=True, decoder=None, use_cache=True):
+    """在 work_dir 中抽取所有时间点的帧，返回 ({时间: 路径}, 信息, 耗时)；
+    信息为 snapinfo.header_lines 的 [(标签, 取值)]，没有 Pillow 时为信息图路径，header=False 时为 None"""
+    start = time.perf_counter()
+    cache = snapcache.default_cache() if use_cache else None
+    os.makedirs(work_dir, exist_ok=True)
+    frames = {}
+    backend = snapcore.open_decoder(video_file, decoder, cache)
+    try:
+        for t_ms in times:
+            outfile = snapcore.screenshot_path(work_dir, t_ms)
+            snapcore.extract_frame(video_file, t_ms, outfile, cache=cache, backend=backend)
+            if os.path.exists(outfile):
+                frames[t_ms] = outfile
+    finally:
+        if backend is not None:
+            backend.close()
+    info = None
+    if header and snapcore.Image is not None:
+        info = snapinfo.header_lines(video_file, snapinfo.probe(video_file, cache))
+    elif header:
+        info = snapcore.generate_video_info_image(video_file, work_dir, cache=cache)
+    return frames, info, time.perf_counter() - start
+
+
+def extract_all(video_files, times, work_dir, header=True, decoder=None, use_cache=True, jobs=None, progress=None):
+    """每个输入一个进程池任务；返回与 video_files 对应的 [(帧, 信息)]"""
+    progress = progress or log.info
+    results = [None] * len(video_files)
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs or len(video_files)) as pool:
+        futures = {pool.submit(extract_input, v, times, os.path.join(work_dir, f"input-{i}"), header, decoder,
+                               use_cache): i
+                   for i, v in enumerate(video_files)}
+        for fut in concurrent.futures.as_completed(futures):
+            i = futures[fut]
+            frames, info, seconds = fut.result()
+            progress(f"[{i + 1}/{len(video_files)}] {os.path.basename(video_files[i])}: "
+                     f"{len(frames)} 帧 ({seconds:.1f}s)")
+            results[i] = (frames, info)
+    return results
+
+
+# --- 拼接：行 = 时间点，列 = 输入 ---
+def fit_text(font, text, width):
+    """超出 width 时从末尾截断并加省略号"""
+    if font.getlength(text) <= width:
+        return text
+    while text and font.getlength(text + "…") > width:
+        text = text[:-1]
+    return text + "…"
+
+
+def column_header(lines, width):
+    """在 width 宽的透明图上排版一个输入的信息：字号缩到最长一行放得下，白字黑描边"""
+    avail = width - 2 * HEADER_MARGIN
+    # 首行是文件名，长度不定，不参与字号计算，放不下时截断
+    texts = [label + value for label, value in lines[1:] or lines]
+    size = snapinfo.FONT_SIZE
+    font = snapinfo.header_font(size)
+    # 字宽按像素取整，不与字号成正比，逐级缩小直到放得下
+    while size > HEADER_MIN_FONT and max(font.getlength(t) for t in texts) > avail:
+        size -= 1
+        font = snapinfo.header_font(size)
+    ascent, descent = font.getmetrics()
+    step = ascent + descent + 2
+    img = snapcore.Image.new("RGBA", (width, 2 * HEADER_MARGIN + step * len(lines)), (0, 0, 0, 0))
+    draw = ImageDraw.Draw(img)
+    for i, (label, value) in enumerate(lines):
+        draw.text((HEADER_MARGIN, HEADER_MARGIN + i * step), fit_text(font, label + value, avail), font=font,
+                  fill="white", stroke_width=snapinfo.STROKE_WIDTH, stroke_fill="black")
+    return img
+
+
+def column_headers(infos, profile, width):
+    """各输入的信息按列宽排版后放在对应列的上方，返回整宽的 RGBA 图"""
+    columns = len(infos)
+    pitch_w = profile.cell_width + 2 * profile.gap
+    x0 = (width - columns * pitch_w) // 2
+    headers = [column_header(lines, pitch_w) for lines in infos]
+    strip = snapcore.Image.new("RGBA", (width, max(h.height for h in headers)), (0, 0, 0, 0))
+    for col, img in enumerate(headers):
+        strip.alpha_composite(img, (x0 + col * pitch_w, 0))
+    return strip
+
+
+def render_compare(rows, infos, profile, pattern_file, out_file, work_dir):
+    """rows: [(时间戳, [各输入的帧路径])]；infos: extract_input 返回的各输入信息。按输入数设列数，复用单视频故事板的拼接"""
+    columns = len(rows[0][1])
+    profile = dataclasses.replace(profile, name="compare", columns=columns)
+    if snapcore.Image is None:
+        return _render_compare_magick(rows, infos, profile, pattern_file, out_file, work_dir)
+    decoded = [(snapcore.decode_frame(path, profile.cell_width), timestamp)
+               for timestamp, paths in rows for path in paths]
+    width = max(profile.canvas_width, columns * (profile.cell_width + 2 * profile.gap))
+    header = column_headers(infos, profile, width) if infos and profile.header else None
+    return snapcore.render_profile(decoded, header, profile, pattern_file, out_file)
+
+
+def _render_compare_magick(rows, info_imgs, profile, pattern_file, out_file, work_dir):
+    """无 Pillow 时：信息图裁边后作为第一行，与已标注的帧一起交给 montage"""
+    files = []
+    if info_imgs and profile.header:
+        for i, path in enumerate(info_imgs):
+            trimmed = os.path.join(work_dir, f"header-{i}.png")
+            subprocess.run(["magick", path, "-trim", "+repage", "-bordercolor", "none",
+                            "-border", str(HEADER_MARGIN), trimmed])
+            files.append(trimmed)
+    for r, (timestamp, paths) in enumerate(rows):
+        for c, path in enumerate(paths):
+            cell = os.path.join(work_dir, f"cell-{r:04}-{c:02}.jpg")
+            shutil.copyfile(path, cell)
+            snapcore.annotate_timestamp(cell, timestamp, width=profile.cell_width)
+            files.append(cell)
+    result = snapcore.compose_storyboard(out_file, files, pattern_file, work_dir, out_dir=work_dir, profile=profile,
+                                         fmt=os.path.splitext(out_file)[1].lstrip("."))
+    shutil.move(result, out_file)
+    return out_file
+
+
+def compare_storyboard(video_files, steps=12, pattern_file=None, out_dir=None, profile=None, fmt="jpg",
+                       decoder=None, use_cache=True, jobs=None, progress=None):
+    """为多个输入生成一张对比故事板，返回输出路径"""
+    if len(video_files) < 2:
+        raise ValueError("至少需要两个输入")
+    progress = progress or log.info
+    profile = profile or snapcore.LAYOUT_PROFILES["default"]
+    out_dir = out_dir or os.path.dirname(os.path.abspath(video_files[0]))
+    cache = snapcache.default_cache() if use_cache else None
+    times = shared_times(video_files, steps, cache)
+    work_dir = tempfile.mkdtemp(prefix="visualsnap-compare-")
+    try:
+        results = extract_all(video_files, times, work_dir, profile.header, decoder, use_cache, jobs, progress)
+        # 只保留所有输入都抽到帧的时间点，保证每行对齐
+        rows = [(snapcore.ms_to_timestamp(t), [frames[t] for frames, _ in results])
+                for t in times if all(t in frames for frames, _ in results)]
+        if not rows:
+            raise RuntimeError("没有所有输入都能抽到帧的时间点")
+        if len(rows) < len(times):
+            log.warning(f"{len(times) - len(rows)} 个时间点有输入抽帧失败，已跳过")
+        infos = [info for _, info in results] if profile.header else None
+        progress("拼接对比图...")
+        out_file = os.path.join(out_dir, compare_name(video_files, fmt))
+        return render_compare(rows, infos, profile, pattern_file, out_file, work_dir)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="多个编码版本的对比故事板")
+    parser.add_argument("videos", nargs="+", help="两个或更多视频（同一内容的不同编码）")
+    parser.add_argument("--steps", type=int, default=12, help="时间点数（每行一个）")
+    parser.add_argument("--layout", default="default", help="版式（决定格子宽度、留白、背景与是否带信息图）")
+    parser.add_argument("--decoder", default=None, choices=["ffmpeg", "pyav", "auto"], help="抽帧解码后端")
+    parser.add_argument("--jobs", type=int, default=None, help="并行进程数（默认每个输入一个）")
+    parser.add_argument("--pattern", default=None, help="pattern 文件名（pattern/ 目录下）")
+    parser.add_argument("--format", default="jpg", choices=snapcore.STORYBOARD_FORMATS)
+    parser.add_argument("--out", default=None, help="输出目录（默认第一个视频所在目录）")
+    parser.add_argument("--no-cache", action="store_true", help="不读写中间产物缓存")
+    parser.add_argument("--log-level", default=None, choices=["DEBUG", "INFO", "WARN"],
+                        help="日志级别（默认 INFO，或环境变量 VISUALSNAP_LOG_LEVEL）")
+    parser.add_argument("--log-file", default=snaplog.DEFAULT_FILE, help="同时写入的日志文件")
+    args = parser.parse_args(argv)
+    snaplog.setup(args.log_level, args.log_file)
+    if len(args.videos) < 2:
+        parser.error("至少需要两个输入")
+
+    pattern_file = snapcore.find_pattern(args.pattern) if args.pattern else snapcore.default_pattern_file()
+    start = time.perf_counter()
+    output = compare_storyboard(args.videos, args.steps, pattern_file, args.out, snapcore.parse_layout(args.layout),
+                                args.format, args.decoder, not args.no_cache, args.jobs)
+    log.info(f"完成 ({time.perf_counter() - start:.1f}s): {output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
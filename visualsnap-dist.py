@@ -0,0 +1,409 @@
+import os
+import io
+import re
+import sys
+import json
+import time
+import base64
+import bisect
+import socket
+import shutil
+import argparse
+import tempfile
+import threading
+import subprocess
+import socketserver
+import concurrent.futures
+
+import snapcore
+import snapcache
+import snaplog
+
+# --- 分段并行抽帧：按关键帧切分时间轴，交给多个本地进程或远程节点，按时间合并成一张故事板 ---
+#
+# 关键帧只在各切分点附近探测（ffprobe -read_intervals + -skip_frame nokey），不顺序读整个文件。
+# 帧足够密的段从段起点（关键帧）顺序解码一遍，只输出所需的帧；稀疏的段仍逐帧定位抽取。
+#
+# 用法:
+#   # 本机 4 个工作进程
+#   python visualsnap-dist.py run D:/rec/a.mkv --steps 60 --local 4
+#   # 远程节点（需能以相同路径访问视频，如共享存储）
+#   python visualsnap-dist.py worker --listen 0.0.0.0:9700
+#   python visualsnap-dist.py run /mnt/rec/a.mkv --local 2 --worker 10.0.0.5:9700 --worker 10.0.0.6:9700
+#   # 扩展性测试：分别用 1/2/4/8 个本地进程抽帧，输出耗时与加速比
+#   python visualsnap-dist.py bench D:/rec/a.mkv --steps 120 --workers 1,2,4,8
+#
+# 协议（TCP，每行一个 JSON）:
+#   请求  {"video": 路径, "times": [ms, ...], "width": 缩放宽度, "start": 段起点 ms}
+#   响应  {"t_ms": ms, "jpeg": base64} 每帧一行，最后 {"done": true} 或 {"error": 信息}
+
+log = snaplog.get_logger("dist")
+DEFAULT_PORT = 9700
+SEGMENTS_PER_WORKER = 2  # 多切几段，快的节点可以多领
+FRAME_WIDTH = max(p.cell_width for p in snapcore.LAYOUT_PROFILES.values())
+CONNECT_TIMEOUT = 10
+FRAME_TIMEOUT = 120  # 远程节点两帧之间的最长等待（秒），超时后该段改由本地进程处理
+KEYFRAME_PACKETS = 600  # 在每个切分点附近读的包数，需覆盖一个 GOP（60fps 下 10 秒）
+ONE_PASS_SPACING_MS = 10000  # 段内平均间隔小于此值时从段起点顺序解码一遍，否则逐帧定位
+SHOWINFO_PTS = re.compile(r"pts_time:\s*([-0-9.]+)")
+
+
+# --- 切分 ---
+def keyframe_times(video_file, near_ms):
+    """near_ms 中每个时间点附近的关键帧时间（ms）。每个点只从它之前的关键帧起读 KEYFRAME_PACKETS 个包、
+    只解码关键帧，不读整个文件"""
+    intervals = ",".join(f"{t / 1000:.3f}%+#{KEYFRAME_PACKETS}" for t in near_ms)
+    out = subprocess.check_output([
+        "ffprobe", "-v", "error", "-select_streams", "v:0", "-skip_frame", "nokey",
+        "-read_intervals", intervals,
+        "-show_entries", "frame=pts_time", "-of", "csv=p=0", video_file
+    ]).decode("utf-8", "replace")
+    times = []
+    for line in out.splitlines():
+        pts = line.strip().rstrip(",")
+        if pts not in ("", "N/A"):
+            times.append(int(float(pts) * 1000))
+    return sorted(set(times))
+
+
+def cut_points(duration_ms, count):
+    """按时长把时间轴均分成 count 段的边界（含 0 与 duration_ms）"""
+    return [duration_ms * i // count for i in range(count + 1)]
+
+
+def split_segments(times, duration_ms, count, keyframes=None):
+    """把抽帧时间按 count 段切开，段边界对齐到最近的关键帧；返回 [(起点, 终点, [时间...])]"""
+    count = max(1, min(count, len(times)))
+    bounds = cut_points(duration_ms, count)
+    if keyframes:
+        for i in range(1, count):
+            bounds[i] = min(keyframes, key=lambda k: abs(k - bounds[i]))
+    bounds = sorted(set(bounds))
+    segments = []
+    for start, end in zip(bounds, bounds[1:]):
+        seg_times = [t for t in times if start <= t < end or (end == bounds[-1] and t == end)]
+        if seg_times:
+            segments.append((start, end, seg_times))
+    return segments
+
+
+# --- 工作端：抽帧并缩小，返回 JPEG 字节 ---
+def run_segment(video_file, times, width=FRAME_WIDTH, use_cache=True, start_ms=None):
+    """在当前进程中抽取一段内的所有帧，返回 [(t_ms, jpeg 字节)]。
+    给出段起点（关键帧）且帧足够密时整段一遍解码，失败或遗漏的时间点再逐帧抽取"""
+    cache = snapcache.default_cache() if use_cache else None
+    work_dir = tempfile.mkdtemp(prefix="visualsnap-seg-")
+    results = []
+    try:
+        decoded = {}
+        if start_ms is not None and (times[-1] - start_ms) / len(times) <= ONE_PASS_SPACING_MS:
+            decoded = decode_segment(video_file, start_ms, times, width, work_dir)
+        for t_ms in times:
+            if t_ms in decoded:
+                with open(decoded[t_ms], "rb") as f:
+                    results.append((t_ms, f.read()))
+                continue
+            outfile = snapcore.screenshot_path(work_dir, t_ms)
+            snapcore.extract_frame(video_file, t_ms, outfile, cache=cache)
+            if not os.path.exists(outfile):
+                continue
+            results.append((t_ms, shrink_jpeg(outfile, width)))
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return results
+
+
+def decode_segment(video_file, start_ms, times, width, work_dir):
+    """一个 ffmpeg 进程从段起点顺序解码，select 只输出每个时间点上或之后的第一帧；返回 {t_ms: 路径}。
+    段起点对齐关键帧，定位后不需要丢弃前一个 GOP 的帧"""
+    rel = [(t - start_ms) / 1000 for t in times]
+    select = "+".join(f"gte(t,{r:.3f})*not(gte(prev_t,{r:.3f}))" for r in rel)
+    proc = subprocess.run([
+        "ffmpeg", "-hide_banner", "-nostats", "-loglevel", "info",
+        "-ss", f"{start_ms / 1000:.3f}",
+        "-i", video_file,
+        "-t", f"{rel[-1] + 1:.3f}",
+        "-an", "-sn",
+        "-vf", f"select='{select}',showinfo,scale='min(iw,{width})':-2",
+        "-fps_mode", "passthrough", "-q:v", "2",
+        os.path.join(work_dir, "seg-%05d.jpg"),
+    ], capture_output=True)
+    # 第 i 个输出文件对应第 i 条 showinfo；每个时间点取第一个不早于它的输出帧
+    pts = [float(m) for m in SHOWINFO_PTS.findall(proc.stderr.decode("utf-8", "replace"))]
+    decoded = {}
+    for t_ms, r in zip(times, rel):
+        i = bisect.bisect_left(pts, r - 0.0005)
+        path = os.path.join(work_dir, f"seg-{i + 1:05}.jpg")
+        if i < len(pts) and os.path.exists(path):
+            decoded[t_ms] = path
+    if len(decoded) < len(times):
+        log.debug(f"整段解码遗漏 {len(times) - len(decoded)} 帧，逐帧补抽")
+    return decoded
+
+
+def shrink_jpeg(path, width):
+    """缩到 width 宽再传输，节点间只传所需分辨率"""
+    if snapcore.Image is None:
+        subprocess.run(["magick", path, "-resize", f"{width}x>", path])
+        with open(path, "rb") as f:
+            return f.read()
+    img = snapcore.decode_frame(path, width)
+    if img.width > width:
+        img = img.resize((width, round(img.height * width / img.width)), snapcore.Image.LANCZOS)
+    buf = io.BytesIO()
+    img.save(buf, "JPEG", quality=92)
+    return buf.getvalue()
+
+
+class SegmentHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            try:
+                job = json.loads(line)
+                log.info(f"{self.client_address[0]} 请求 {len(job['times'])} 帧: {job['video']}")
+                for t_ms, data in run_segment(job["video"], job["times"], job.get("width", FRAME_WIDTH),
+                                              job.get("cache", True), job.get("start")):
+                    self.send({"t_ms": t_ms, "jpeg": base64.b64encode(data).decode("ascii")})
+                self.send({"done": True})
+            except Exception as e:
+                self.send({"error": str(e)})
+
+    def send(self, obj):
+        self.wfile.write(json.dumps(obj).encode("utf-8") + b"\n")
+        self.wfile.flush()
+
+
+class WorkerServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+# --- 协调端 ---
+def parse_address(addr):
+    host, _, port = addr.rpartition(":")
+    return (host or "127.0.0.1", int(port or DEFAULT_PORT))
+
+
+def remote_segment(addr, video_file, times, width, use_cache=True, start_ms=None):
+    """超过 FRAME_TIMEOUT 秒没有收到下一帧时抛出 socket.timeout"""
+    with socket.create_connection(parse_address(addr), timeout=CONNECT_TIMEOUT) as sock:
+        sock.settimeout(FRAME_TIMEOUT)
+        with sock.makefile("rwb") as f:
+            f.write(json.dumps({"video": video_file, "times": times, "width": width,
+                                "cache": use_cache, "start": start_ms}).encode("utf-8") + b"\n")
+            f.flush()
+            results = []
+            for line in f:
+                msg = json.loads(line)
+                if "error" in msg:
+                    raise RuntimeError(f"{addr}: {msg['error']}")
+                if msg.get("done"):
+                    return results
+                results.append((msg["t_ms"], base64.b64decode(msg["jpeg"])))
+    raise RuntimeError(f"{addr}: 连接中断")
+
+
+def extract_distributed(video_file, times, local=1, remotes=(), segments=None, width=FRAME_WIDTH, use_cache=True,
+                        align=True, duration_ms=None, progress=None):
+    """把 times 分段交给 local 个本地进程和 remotes 中的节点，返回按时间排序的 [(t_ms, jpeg 字节)]；
+    align: 段边界对齐到切分点附近的关键帧"""
+    progress = progress or (lambda msg: None)
+    slots = ["local"] * max(0, local) + list(remotes)
+    if not slots:
+        raise ValueError("至少需要一个本地进程或远程节点")
+    duration_ms = duration_ms or (max(times) + 1)
+    count = max(1, min(segments or len(slots) * SEGMENTS_PER_WORKER, len(times)))
+    keyframes = None
+    if align and count > 1:
+        try:
+            keyframes = keyframe_times(video_file, cut_points(duration_ms, count)[1:-1])
+        except (OSError, subprocess.CalledProcessError) as e:
+            log.warning(f"无法读取关键帧，按时长均分: {e}")
+    segs = split_segments(times, duration_ms, count, keyframes)
+    pending = list(reversed(segs))
+    cond = threading.Condition()
+    frames = {}
+    errors = []
+    state = {"outstanding": len(segs), "alive": len(slots)}  # 未完成的段数、仍在运行的槽位数
+
+    pool = concurrent.futures.ProcessPoolExecutor(max_workers=local) if local > 0 else None
+
+    def next_segment():
+        # 没有待领的段但还有段在处理中时等待：处理它的远程节点可能失败并把段放回
+        with cond:
+            while not pending and state["outstanding"] and not errors:
+                cond.wait()
+            if not pending or errors:
+                return None
+            return pending.pop()
+
+    def slot_loop(slot):
+        # 每个槽位循环领取下一段，直到所有段完成；远程节点失败时把该段放回，由仍在运行的槽位处理；
+        # 远程节点卡住（读超时）时该段直接交给本地进程池，节点不再领取新段
+        try:
+            while True:
+                segment = next_segment()
+                if segment is None:
+                    return
+                start, end, seg_times = segment
+                stalled = False
+                try:
+                    if slot == "local":
+                        result = pool.submit(run_segment, video_file, seg_times, width, use_cache, start).result()
+                    else:
+                        try:
+                            result = remote_segment(slot, video_file, seg_times, width, use_cache, start)
+                        except socket.timeout:
+                            if pool is None:
+                                raise
+                            log.warning(f"节点 {slot} 超过 {FRAME_TIMEOUT}s 没有送回帧，"
+                                        f"段 {start}-{end}ms 改由本地进程处理")
+                            stalled = True
+                            result = pool.submit(run_segment, video_file, seg_times, width, use_cache,
+                                                 start).result()
+                except Exception as e:
+                    with cond:
+                        if slot != "local" and state["alive"] > 1:
+                            log.warning(f"节点 {slot} 失败，段 {start}-{end}ms 交给其他节点: {e}")
+                            pending.append(segment)
+                        else:
+                            errors.append(e)
+                        cond.notify_all()
+                    return
+                with cond:
+                    for t_ms, data in result:
+                        frames[t_ms] = data
+                    state["outstanding"] -= 1
+                    progress(f"[{len(frames)}/{len(times)}] 段 {snapcore.ms_to_timestamp(start)} 完成 "
+                             f"({'local' if stalled else slot})")
+                    cond.notify_all()
+                if stalled:
+                    return
+        finally:
+            with cond:
+                state["alive"] -= 1
+                cond.notify_all()
+
+    try:
+        threads = [threading.Thread(target=slot_loop, args=(slot,), daemon=True) for slot in slots]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+    finally:
+        if pool:
+            pool.shutdown()
+    if errors:
+        raise errors[0]
+    if pending:
+        raise RuntimeError(f"{len(pending)} 段没有可用的节点处理")
+    return sorted(frames.items())
+
+
+def distributed_storyboard(video_file, steps=30, local=1, remotes=(), segments=None, pattern_file=None,
+                           out_dir=None, profiles=None, fmt="jpg", use_cache=True, progress=None):
+    """与 snapcore.auto_storyboard 相同的输出，抽帧阶段分段并行；返回输出路径列表"""
+    progress = progress or log.info
+    profiles = profiles or [snapcore.LAYOUT_PROFILES["default"]]
+    out_dir = out_dir or os.path.dirname(os.path.abspath(video_file))
+    cache = snapcache.default_cache() if use_cache else None
+    duration_ms = snapcore.probe_duration_ms(video_file, cache)
+    times = snapcore.snap_times(duration_ms, steps)
+    width = max(p.cell_width for p in profiles)
+    results = extract_distributed(video_file, times, local, remotes, segments, width, use_cache,
+                                  duration_ms=duration_ms, progress=progress)
+    work_dir = tempfile.mkdtemp(prefix="visualsnap-dist-")
+    try:
+        collection = snapcore.FrameCollection()
+        for t_ms, data in results:
+            path = snapcore.screenshot_path(work_dir, t_ms)
+            with open(path, "wb") as f:
+                f.write(data)
+            collection.add(snapcore.FrameRecord(t_ms, path, source="auto"))
+        if not len(collection):
+            raise RuntimeError(f"未能从 {video_file} 抽取任何帧")
+        info_img = None
+        if any(p.header for p in profiles):
+            progress("生成视频信息图片...")
+            info_img = snapcore.generate_video_info_image(video_file, work_dir, cache=cache)
+        progress("拼接截图...")
+        frames = [(r.path, r.timestamp) for r in collection]
+        return snapcore.render_layouts(video_file, frames, profiles, pattern_file, out_dir, info_img=info_img,
+                                       fmt=fmt, cache=cache, work_dir=work_dir)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def bench(video_file, steps, worker_counts, remotes=()):
+    """不使用缓存，分别以不同本地进程数抽帧，打印扩展性曲线"""
+    duration_ms = snapcore.probe_duration_ms(video_file)
+    times = snapcore.snap_times(duration_ms, steps)
+    rows = []
+    for n in worker_counts:
+        start = time.perf_counter()
+        frames = extract_distributed(video_file, times, n, remotes, duration_ms=duration_ms, use_cache=False)
+        rows.append((n, len(frames), time.perf_counter() - start))
+    base = rows[0][2] * rows[0][0]  # 折算成单进程耗时
+    nodes = f" + {len(remotes)} 远程" if remotes else ""
+    print(f"{'进程数':>6}{'帧数':>6}{'耗时(s)':>10}{'加速比':>8}{'效率':>8}")
+    for n, count, seconds in rows:
+        speedup = base / seconds if seconds else 0
+        print(f"{str(n) + nodes:>6}{count:>6}{seconds:>10.2f}{speedup:>8.2f}{speedup / n * 100:>7.0f}%")
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="分段并行抽帧 / 生成故事板")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    run = sub.add_parser("run", help="分段并行生成故事板")
+    run.add_argument("video")
+    run.add_argument("--steps", type=int, default=30, help="抽帧数")
+    run.add_argument("--local", type=int, default=os.cpu_count() or 1, help="本地工作进程数")
+    run.add_argument("--worker", action="append", default=[], metavar="HOST:PORT", help="远程节点，可重复")
+    run.add_argument("--segments", type=int, default=None, help="切分段数（默认每个节点 2 段）")
+    run.add_argument("--pattern", default=None, help="pattern 文件名（pattern/ 目录下）")
+    run.add_argument("--layout", action="append", default=None, help="输出版式，可重复")
+    run.add_argument("--format", default="jpg", choices=snapcore.STORYBOARD_FORMATS)
+    run.add_argument("--out", default=None, help="输出目录（默认视频所在目录）")
+    run.add_argument("--no-cache", action="store_true", help="不读写中间产物缓存")
+
+    worker = sub.add_parser("worker", help="作为远程节点监听抽帧请求")
+    worker.add_argument("--listen", default=f"127.0.0.1:{DEFAULT_PORT}", help="监听地址")
+
+    b = sub.add_parser("bench", help="测试不同进程数下的抽帧耗时")
+    b.add_argument("video")
+    b.add_argument("--steps", type=int, default=60)
+    b.add_argument("--workers", default="1,2,4,8", help="逗号分隔的本地进程数")
+    b.add_argument("--worker", action="append", default=[], metavar="HOST:PORT", help="同时使用的远程节点")
+    parser.add_argument("--log-level", default=None, choices=["DEBUG", "INFO", "WARN"],
+                        help="日志级别（默认 INFO，或环境变量 VISUALSNAP_LOG_LEVEL）")
+    parser.add_argument("--log-file", default=snaplog.DEFAULT_FILE, help="同时写入的日志文件")
+    args = parser.parse_args(argv)
+    snaplog.setup(args.log_level, args.log_file)
+
+    if args.command == "worker":
+        server = WorkerServer(parse_address(args.listen), SegmentHandler)
+        log.info(f"抽帧节点已启动: {args.listen}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            log.info("节点已停止")
+        return 0
+    if args.command == "bench":
+        bench(args.video, args.steps, [int(n) for n in args.workers.split(",")], args.worker)
+        return 0
+
+    pattern_file = snapcore.find_pattern(args.pattern) if args.pattern else snapcore.default_pattern_file()
+    profiles = [snapcore.parse_layout(spec) for spec in (args.layout or ["default"])]
+    start = time.perf_counter()
+    outputs = distributed_storyboard(args.video, args.steps, args.local, args.worker, args.segments, pattern_file,
+                                     args.out, profiles, args.format, not args.no_cache)
+    log.info(f"完成 ({time.perf_counter() - start:.1f}s): {', '.join(outputs)}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,302 @@
+import os
+import json
+import shutil
+import asyncio
+import argparse
+import tempfile
+import concurrent.futures
+from urllib.parse import urlsplit, parse_qs
+
+import snapcore
+import snapcache
+import snaplog
+
+# --- 本地 HTTP 故事板服务 ---
+#
+# 用法:
+#   python visualsnap-server.py --port 8765 --workers 2
+#   curl -o sb.jpg "http://127.0.0.1:8765/storyboard?path=D:/rec/a.mp4&frames=30&pattern=pink.png&layout=preview&format=jpg"
+# window=1000 表示在每个抽帧点附近 1 秒内挑最清晰的帧；waveform=1 在信息图下方加音频波形条；
+# decoder=ffmpeg/pyav/auto 选择抽帧解码后端。
+# 也可以 POST /storyboard，body 为同名字段的 JSON。
+# 结果按 (视频指纹, 参数) 存入 snapcache；同时到达的相同请求只计算一次。
+
+log = snaplog.get_logger("server")
+CHUNK_SIZE = 256 * 1024
+CONTENT_TYPES = {"jpg": "image/jpeg", "png": "image/png", "webp": "image/webp"}
+STATUS_TEXT = {200: "OK", 400: "Bad Request", 403: "Forbidden", 404: "Not Found",
+               405: "Method Not Allowed", 413: "Payload Too Large", 500: "Internal Server Error"}
+MAX_BODY = 64 * 1024
+
+
+class RequestError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def parse_params(fields):
+    """把 query / JSON 字段整理成规范化的参数字典"""
+    if not isinstance(fields, dict):
+        raise RequestError(400, "JSON body 必须是对象")
+    path = fields.get("path")
+    if not path:
+        raise RequestError(400, "缺少 path 参数")
+    if not isinstance(path, str):
+        raise RequestError(400, "path 必须是字符串")
+    try:
+        frames = int(fields.get("frames", 30))
+    except (TypeError, ValueError):
+        raise RequestError(400, "frames 必须是整数")
+    if not 1 <= frames <= 500:
+        raise RequestError(400, "frames 超出范围 (1-500)")
+    try:
+        window = int(fields.get("window", 0))
+    except (TypeError, ValueError):
+        raise RequestError(400, "window 必须是整数（毫秒）")
+    if not 0 <= window <= 10000:
+        raise RequestError(400, "window 超出范围 (0-10000 ms)")
+    try:
+        profile = snapcore.parse_layout(str(fields.get("layout", "default")))
+    except ValueError:
+        raise RequestError(400, "layout 为版式名（default/4col/preview/print…）或形如 4x 的列数")
+    fmt = str(fields.get("format", "jpg")).lower()
+    if fmt == "jpeg":
+        fmt = "jpg"
+    if fmt not in snapcore.STORYBOARD_FORMATS:
+        raise RequestError(400, f"format 只支持 {', '.join(snapcore.STORYBOARD_FORMATS)}")
+    decoder = fields.get("decoder") or None
+    if decoder not in (None, "ffmpeg", "pyav", "auto"):
+        raise RequestError(400, "decoder 只支持 ffmpeg / pyav / auto")
+    pattern = fields.get("pattern")
+    if pattern is not None and not isinstance(pattern, str):
+        raise RequestError(400, "pattern 必须是字符串")
+    if pattern in (None, ""):
+        pattern_file = snapcore.default_pattern_file()
+    elif pattern == "none":
+        pattern_file = None
+    else:
+        pattern_file = snapcore.find_pattern(pattern)
+        if not pattern_file:
+            raise RequestError(400, f"找不到 pattern: {pattern}")
+    return {
+        "path": os.path.realpath(path),
+        "frames": frames,
+        "profile": profile,
+        "window": window,
+        "waveform": str(fields.get("waveform", "0")).lower() in ("1", "true", "yes"),
+        "format": fmt,
+        "pattern": pattern_file,
+        "decoder": decoder,
+    }
+
+
+class StoryboardServer:
+    def __init__(self, cache, workers=2, allow_dirs=None):
+        self.cache = cache
+        self.pool = concurrent.futures.ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="storyboard")
+        self.allow_dirs = [os.path.join(os.path.realpath(d), "") for d in (allow_dirs or [])]
+        self.inflight = {}  # key -> asyncio.Future，相同请求合并
+        self.waiters = {}  # key -> 等待同一 Future 的请求数
+        self.temp_users = {}  # 临时结果文件 -> 尚未发送完的请求数
+        self.stats = {"requests": 0, "cache_hits": 0, "deduplicated": 0, "computed": 0, "errors": 0}
+
+    def check_allowed(self, path):
+        # 先查允许目录：目录外的路径一律 403，不透露文件是否存在
+        if self.allow_dirs and not any(path.startswith(d) for d in self.allow_dirs):
+            raise RequestError(403, "该路径不在允许的目录内")
+        if not os.path.isfile(path):
+            raise RequestError(404, f"文件不存在: {path}")
+        if not snapcore.is_video_file(path):
+            raise RequestError(400, "不支持的视频格式")
+
+    # --- 以下两个方法会读文件 / 查索引，放到线程池执行 ---
+    def lookup(self, params):
+        key = snapcore.auto_storyboard_key(self.cache, params["path"], params["frames"], params["pattern"],
+                                           [params["profile"]], params["format"], params["window"],
+                                           params["waveform"])
+        return key, self.cache.get(key)
+
+    def render(self, params, key):
+        """生成故事板，返回 (文件路径, 是否为发送后需删除的临时文件)"""
+        work_dir = tempfile.mkdtemp(prefix="visualsnap-http-")
+        try:
+            final_file, = snapcore.auto_storyboard(
+                params["path"], steps=params["frames"], pattern_file=params["pattern"],
+                out_dir=work_dir, profiles=[params["profile"]], fmt=params["format"],
+                best_window_ms=params["window"], waveform=params["waveform"], cache=self.cache,
+                decoder=params["decoder"])
+            cached = self.cache.get(key)
+            if cached:
+                return cached, False
+            # 缓存被禁用或已被淘汰，临时文件发送后删除
+            fd, tmp = tempfile.mkstemp(suffix="." + params["format"], prefix="visualsnap-http-")
+            os.close(fd)
+            shutil.move(final_file, tmp)
+            return tmp, True
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    async def get_storyboard(self, params):
+        loop = asyncio.get_running_loop()
+        key, cached = await loop.run_in_executor(None, self.lookup, params)
+        if cached:
+            self.stats["cache_hits"] += 1
+            return cached, False
+        fut = self.inflight.get(key)
+        if fut is not None:
+            self.stats["deduplicated"] += 1
+            self.waiters[key] += 1
+            return await asyncio.shield(fut)
+        fut = loop.create_future()
+        self.inflight[key] = fut
+        self.waiters[key] = 0
+        try:
+            self.stats["computed"] += 1
+            log.info(f"生成故事板 {params['path']} (key {key[:12]})")
+            result = await loop.run_in_executor(self.pool, self.render, params, key)
+            if result[1]:
+                self.temp_users[result[0]] = 1 + self.waiters[key]
+            fut.set_result(result)
+            return result
+        except Exception as e:
+            fut.set_exception(e)
+            fut.exception()  # 无人等待时避免 "never retrieved" 警告
+            raise
+        finally:
+            del self.inflight[key]
+            del self.waiters[key]
+
+    def release_temp(self, path):
+        self.temp_users[path] -= 1
+        if self.temp_users[path] <= 0:
+            del self.temp_users[path]
+            os.remove(path)
+
+    # --- HTTP ---
+    async def read_request(self, reader):
+        request_line = (await reader.readline()).decode("latin-1").strip()
+        if not request_line:
+            return None
+        try:
+            method, target, _ = request_line.split(" ", 2)
+        except ValueError:
+            raise RequestError(400, "请求行格式错误")
+        headers = {}
+        while True:
+            line = (await reader.readline()).decode("latin-1")
+            if line in ("\r\n", "\n", ""):
+                break
+            name, _, value = line.partition(":")
+            headers[name.strip().lower()] = value.strip()
+        body = b""
+        length = int(headers.get("content-length", 0) or 0)
+        if length > MAX_BODY:
+            raise RequestError(413, "请求体过大")
+        if length:
+            body = await reader.readexactly(length)
+        return method.upper(), target, headers, body
+
+    async def send_headers(self, writer, status, content_type, length):
+        writer.write((
+            f"HTTP/1.1 {status} {STATUS_TEXT.get(status, '')}\r\n"
+            f"Content-Type: {content_type}\r\n"
+            f"Content-Length: {length}\r\n"
+            f"Connection: close\r\n\r\n"
+        ).encode("latin-1"))
+        await writer.drain()
+
+    async def send_json(self, writer, status, obj):
+        data = json.dumps(obj, ensure_ascii=False).encode("utf-8")
+        await self.send_headers(writer, status, "application/json; charset=utf-8", len(data))
+        writer.write(data)
+        await writer.drain()
+
+    async def send_file(self, writer, path, content_type):
+        loop = asyncio.get_running_loop()
+        with open(path, "rb") as f:
+            await self.send_headers(writer, 200, content_type, os.fstat(f.fileno()).st_size)
+            while True:
+                chunk = await loop.run_in_executor(None, f.read, CHUNK_SIZE)
+                if not chunk:
+                    break
+                writer.write(chunk)
+                await writer.drain()
+
+    async def handle(self, reader, writer):
+        try:
+            request = await self.read_request(reader)
+            if request is None:
+                return
+            method, target, headers, body = request
+            url = urlsplit(target)
+            if url.path == "/health":
+                await self.send_json(writer, 200, {"status": "ok", "inflight": len(self.inflight), **self.stats})
+                return
+            if url.path != "/storyboard":
+                raise RequestError(404, "未知路径")
+            if method == "GET":
+                fields = {k: v[-1] for k, v in parse_qs(url.query).items()}
+            elif method == "POST":
+                try:
+                    fields = json.loads(body or b"{}")
+                except ValueError:
+                    raise RequestError(400, "body 不是合法 JSON")
+            else:
+                raise RequestError(405, "只支持 GET / POST")
+            self.stats["requests"] += 1
+            params = parse_params(fields)
+            self.check_allowed(params["path"])
+            result, temporary = await self.get_storyboard(params)
+            try:
+                await self.send_file(writer, result, CONTENT_TYPES[params["format"]])
+            finally:
+                if temporary:
+                    self.release_temp(result)
+        except RequestError as e:
+            await self.send_json(writer, e.status, {"error": str(e)})
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except Exception as e:
+            self.stats["errors"] += 1
+            log.warning(f"请求处理失败: {e}")
+            try:
+                await self.send_json(writer, 500, {"error": str(e)})
+            except ConnectionError:
+                pass
+        finally:
+            writer.close()
+
+    async def serve(self, host, port):
+        server = await asyncio.start_server(self.handle, host, port)
+        log.info(f"故事板服务已启动: http://{host}:{port}/storyboard")
+        async with server:
+            await server.serve_forever()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="本地 HTTP 故事板服务")
+    parser.add_argument("--host", default="127.0.0.1", help="监听地址（默认仅本机）")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--workers", type=int, default=2, help="后台生成故事板的并发数")
+    parser.add_argument("--cache-dir", default=snapcache.DEFAULT_ROOT, help="缓存目录")
+    parser.add_argument("--cache-max-mb", type=float, default=None, help="缓存上限（MB）")
+    parser.add_argument("--allow", action="append", metavar="DIR", help="只允许处理这些目录下的视频，可重复")
+    parser.add_argument("--log-level", default=None, choices=["DEBUG", "INFO", "WARN"],
+                        help="日志级别（默认 INFO，或环境变量 VISUALSNAP_LOG_LEVEL）")
+    parser.add_argument("--log-file", default=snaplog.DEFAULT_FILE, help="同时写入的日志文件")
+    args = parser.parse_args(argv)
+    snaplog.setup(args.log_level, args.log_file)
+
+    cache = snapcache.ArtifactCache(args.cache_dir, args.cache_max_mb)
+    server = StoryboardServer(cache, workers=args.workers, allow_dirs=args.allow)
+    try:
+        asyncio.run(server.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        log.info("服务已停止")
+    finally:
+        server.pool.shutdown(wait=False)
+
+
+if __name__ == "__main__":
+    main()
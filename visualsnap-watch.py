@@ -0,0 +1,441 @@
+import os
+import sys
+import json
+import time
+import queue
+import select
+import sqlite3
+import struct
+import argparse
+import threading
+import collections
+import ctypes
+import ctypes.util
+
+import snapcore
+import snapcache
+import snaplog
+
+# --- 监视目录，自动为新视频生成故事板（无界面的后台服务） ---
+#
+# 用法:
+#   python visualsnap-watch.py -w D:\ingest 0 -w D:\archive 5 --workers 2
+# 优先级数值越小越先处理；已完成的文件记录在 state.db 中，重启后不会重做。
+
+log = snaplog.get_logger("watch")
+MAX_ATTEMPTS = 3  # 同一版本的文件最多处理几次
+RETRY_DELAY = 60.0  # 首次失败后等待的秒数，之后每次加倍（文件可能仍在写入）
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE_SELF = 0x00000400
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_DELETE_SELF
+EVENT_HEADER = struct.Struct("iIII")
+
+
+# --- inotify（仅 Linux，失败时退回轮询） ---
+class InotifyWatcher:
+    def __init__(self, dirs):
+        libc_name = ctypes.util.find_library("c")
+        if not sys.platform.startswith("linux") or not libc_name:
+            raise OSError("inotify 不可用")
+        self.libc = ctypes.CDLL(libc_name, use_errno=True)
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 失败")
+        self.wd_dirs = {}
+        for d in dirs:
+            for root, subdirs, _ in os.walk(d):
+                self.add_watch(root)
+
+    def add_watch(self, path):
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), WATCH_MASK)
+        if wd < 0:
+            log.warning(f"inotify 无法监视 {path}: errno {ctypes.get_errno()}")
+            return
+        self.wd_dirs[wd] = path
+
+    def read_events(self, timeout):
+        """等待最多 timeout 秒，返回发生变化的文件路径列表"""
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+        paths = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = data[offset:offset + length].rstrip(b"\0")
+            offset += length
+            parent = self.wd_dirs.get(wd)
+            if parent is None or not name:
+                continue
+            path = os.path.join(parent, os.fsdecode(name))
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    self.add_watch(path)
+            else:
+                paths.append(path)
+        return paths
+
+    def close(self):
+        os.close(self.fd)
+
+
+# --- 状态数据库 ---
+class StateDB:
+    def __init__(self, db_path):
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS media (
+                path TEXT PRIMARY KEY,
+                size INTEGER,
+                mtime_ns INTEGER,
+                status TEXT,
+                output TEXT,
+                error TEXT,
+                attempts INTEGER DEFAULT 0,
+                updated REAL,
+                next_attempt_at REAL DEFAULT 0
+            )""")
+        columns = {row[1] for row in self.conn.execute("PRAGMA table_info(media)")}
+        if "next_attempt_at" not in columns:  # 旧版本创建的数据库
+            self.conn.execute("ALTER TABLE media ADD COLUMN next_attempt_at REAL DEFAULT 0")
+        # 上次异常退出时仍在处理中的任务，重新排队
+        self.conn.execute("UPDATE media SET status='pending' WHERE status='running'")
+        self.conn.commit()
+
+    def is_done(self, path, st):
+        """文件已成功处理、已放弃重试，或失败后还没到下次重试时间（大小/修改时间未变时）"""
+        with self.lock:
+            row = self.conn.execute("SELECT size, mtime_ns, status, attempts, next_attempt_at FROM media WHERE path=?",
+                                    (path,)).fetchone()
+        if row is None:
+            return False
+        size, mtime_ns, status, attempts, next_attempt_at = row
+        if size != st.st_size or mtime_ns != st.st_mtime_ns:
+            return False
+        if status == "failed":
+            return attempts >= MAX_ATTEMPTS or time.time() < (next_attempt_at or 0)
+        return status == "done"
+
+    def mark(self, path, st, status, output=None, error=None):
+        with self.lock:
+            # 文件变化后重新计数；失败后按 RETRY_DELAY * 2^(次数-1) 推迟下次尝试
+            self.conn.execute("""
+                INSERT INTO media (path, size, mtime_ns, status, output, error, attempts, updated, next_attempt_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, 0)
+                ON CONFLICT(path) DO UPDATE SET
+                    size=excluded.size, mtime_ns=excluded.mtime_ns, status=excluded.status,
+                    output=excluded.output, error=excluded.error, updated=excluded.updated,
+                    attempts=CASE WHEN excluded.status='done' THEN 0
+                                  WHEN media.size != excluded.size OR media.mtime_ns != excluded.mtime_ns
+                                      THEN excluded.attempts
+                                  ELSE media.attempts + (excluded.status='running') END,
+                    next_attempt_at=CASE WHEN excluded.status='failed'
+                                         THEN excluded.updated + ? * (1 << MAX(media.attempts - 1, 0))
+                                         ELSE 0 END
+                """, (path, st.st_size, st.st_mtime_ns, status, output, error, int(status == "running"), time.time(),
+                      RETRY_DELAY))
+            self.conn.commit()
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+# --- 吞吐量与队列深度 ---
+class Metrics:
+    def __init__(self, window=600):
+        self.lock = threading.Lock()
+        self.window = window
+        self.started = time.time()
+        self.done = 0
+        self.failed = 0
+        self.in_flight = 0
+        self.completions = collections.deque()
+        self.busy_seconds = 0.0
+
+    def job_started(self):
+        with self.lock:
+            self.in_flight += 1
+
+    def job_finished(self, ok, seconds):
+        now = time.time()
+        with self.lock:
+            self.in_flight -= 1
+            self.busy_seconds += seconds
+            if ok:
+                self.done += 1
+                self.completions.append(now)
+            else:
+                self.failed += 1
+
+    def snapshot(self, queue_depth, pending):
+        now = time.time()
+        with self.lock:
+            while self.completions and now - self.completions[0] > self.window:
+                self.completions.popleft()
+            span = min(self.window, max(now - self.started, 1.0))
+            return {
+                "uptime_s": round(now - self.started, 1),
+                "done": self.done,
+                "failed": self.failed,
+                "in_flight": self.in_flight,
+                "queue_depth": queue_depth,
+                "settling": pending,
+                "throughput_per_min": round(len(self.completions) * 60.0 / span, 2),
+                "avg_job_s": round(self.busy_seconds / max(self.done + self.failed, 1), 2),
+            }
+
+
+class WatchService:
+    def __init__(self, watch_dirs, state_db, workers=2, steps=30, pattern_file=None, out_dir=None, profiles=None,
+                 best_window_ms=0, waveform=False, settle_seconds=10.0, poll_interval=30.0, metrics_file=None,
+                 metrics_interval=60.0, cache=None, decoder=None, proxy=False, budget=None):
+        self.watch_dirs = watch_dirs  # [(目录, 优先级)]
+        self.db = StateDB(state_db)
+        self.steps = steps
+        self.pattern_file = pattern_file
+        self.out_dir = out_dir
+        self.profiles = profiles
+        self.best_window_ms = best_window_ms
+        self.waveform = waveform
+        self.decoder = decoder
+        self.proxy = proxy
+        self.budget = budget  # snapcore.FrameBudget，给出时代替固定的 steps
+        self.settle_seconds = settle_seconds
+        self.poll_interval = poll_interval
+        self.metrics_file = metrics_file
+        self.metrics_interval = metrics_interval
+        self.metrics = Metrics()
+        self.cache = cache
+        self.jobs = queue.PriorityQueue()
+        self.seq = 0
+        self.settling = {}  # path -> (size, mtime_ns, 稳定开始时间, 优先级)
+        self.queued = set()
+        self.queued_lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.threads = [threading.Thread(target=self.worker_loop, name=f"snap-worker-{i}", daemon=True)
+                        for i in range(max(1, workers))]
+
+    def priority_of(self, path):
+        best = None
+        path = os.path.abspath(path)
+        for d, prio in self.watch_dirs:
+            if path.startswith(os.path.join(d, "")):
+                best = prio if best is None else min(best, prio)
+        return 0 if best is None else best
+
+    # --- 发现文件 ---
+    def notice(self, path):
+        """发现新的/变化的文件：放入稳定性观察表，等文件不再增长后再入队"""
+        if not snapcore.is_video_file(path):
+            return
+        with self.queued_lock:
+            if path in self.queued:
+                return
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            self.settling.pop(path, None)
+            return
+        if self.db.is_done(path, st):
+            return
+        prev = self.settling.get(path)
+        if prev is None or prev[0] != st.st_size or prev[1] != st.st_mtime_ns:
+            self.settling[path] = (st.st_size, st.st_mtime_ns, time.time(), self.priority_of(path))
+
+    def scan(self):
+        """轮询扫描（inotify 不可用时的主要手段，可用时也定期兜底）"""
+        for d, _ in self.watch_dirs:
+            for root, _, names in os.walk(d):
+                for name in names:
+                    self.notice(os.path.join(root, name))
+
+    def check_settled(self):
+        now = time.time()
+        for path, (size, mtime_ns, since, prio) in list(self.settling.items()):
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                del self.settling[path]
+                continue
+            if st.st_size != size or st.st_mtime_ns != mtime_ns:
+                self.settling[path] = (st.st_size, st.st_mtime_ns, now, prio)
+            elif st.st_size > 0 and now - since >= self.settle_seconds:
+                del self.settling[path]
+                self.enqueue(path, prio, st)
+
+    def enqueue(self, path, prio, st):
+        with self.queued_lock:
+            if path in self.queued:
+                return
+            self.queued.add(path)
+        self.seq += 1
+        # 同优先级按修改时间先后处理
+        self.jobs.put((prio, st.st_mtime_ns, self.seq, path))
+        log.info(f"入队 (优先级 {prio}): {path}")
+
+    # --- 处理 ---
+    def worker_loop(self):
+        while not self.stop_event.is_set():
+            try:
+                prio, _, _, path = self.jobs.get(timeout=1.0)
+            except queue.Empty:
+                continue
+            try:
+                self.process(path)
+            finally:
+                with self.queued_lock:
+                    self.queued.discard(path)
+                self.jobs.task_done()
+
+    def process(self, path):
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return
+        if self.db.is_done(path, st):
+            return
+        self.db.mark(path, st, "running")
+        self.metrics.job_started()
+        t0 = time.time()
+        try:
+            outputs = snapcore.auto_storyboard(
+                path, steps=self.steps, pattern_file=self.pattern_file, out_dir=self.out_dir,
+                profiles=self.profiles, best_window_ms=self.best_window_ms,
+                waveform=self.waveform, cache=self.cache, decoder=self.decoder,
+                proxy=self.proxy, budget=self.budget,
+                progress=lambda msg: log.debug(f"{os.path.basename(path)}: {msg}"))
+        except Exception as e:
+            self.metrics.job_finished(False, time.time() - t0)
+            self.db.mark(path, st, "failed", error=str(e))
+            log.warning(f"处理失败 {path}: {e}")
+            return
+        self.metrics.job_finished(True, time.time() - t0)
+        self.db.mark(path, st, "done", output=";".join(outputs))
+        log.info(f"完成 {path} -> {', '.join(outputs)} ({time.time() - t0:.1f}s)")
+
+    def report_metrics(self):
+        snap = self.metrics.snapshot(self.jobs.qsize(), len(self.settling))
+        log.info(f"metrics {json.dumps(snap, ensure_ascii=False)}")
+        if self.metrics_file:
+            tmp = self.metrics_file + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(snap, f, ensure_ascii=False, indent=2)
+            os.replace(tmp, self.metrics_file)
+
+    # --- 主循环 ---
+    def run(self):
+        for t in self.threads:
+            t.start()
+        try:
+            watcher = InotifyWatcher([d for d, _ in self.watch_dirs])
+            log.info("使用 inotify 监视目录")
+        except OSError as e:
+            watcher = None
+            log.info(f"{e}，改用轮询（每 {self.poll_interval:.0f}s）")
+        self.scan()
+        last_scan = last_report = time.time()
+        tick = min(1.0, self.settle_seconds / 2) if self.settle_seconds > 0 else 0.5
+        try:
+            while not self.stop_event.is_set():
+                if watcher:
+                    for path in watcher.read_events(tick):
+                        self.notice(path)
+                else:
+                    time.sleep(tick)
+                now = time.time()
+                if now - last_scan >= self.poll_interval:
+                    self.scan()
+                    last_scan = now
+                self.check_settled()
+                if now - last_report >= self.metrics_interval:
+                    self.report_metrics()
+                    last_report = now
+        except KeyboardInterrupt:
+            log.info("收到中断，等待进行中的任务结束...")
+        finally:
+            self.stop_event.set()
+            for t in self.threads:
+                t.join()
+            if watcher:
+                watcher.close()
+            self.report_metrics()
+            self.db.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="监视目录并自动为新视频生成故事板")
+    parser.add_argument("-w", "--watch", action="append", nargs="+", metavar=("DIR", "PRIORITY"), required=True,
+                        help="监视目录，可选优先级（数值越小越优先，默认 0），可重复")
+    parser.add_argument("--workers", type=int, default=2, help="并行处理数")
+    parser.add_argument("--steps", type=int, default=30, help="每个视频抽帧数")
+    parser.add_argument("--budget", action="store_true",
+                        help="按时长与章节自动决定帧数（代替 --steps），章节按长度分配")
+    parser.add_argument("--target-seconds", type=float, default=None, metavar="S",
+                        help="每个视频抽帧的目标耗时，按实测单帧耗时限制帧数（隐含 --budget）")
+    parser.add_argument("--best-window", type=int, default=0, metavar="MS",
+                        help="在每个抽帧点附近 MS 毫秒窗口内挑最清晰的帧（0 = 不择优，需要 numpy）")
+    parser.add_argument("--waveform", action="store_true", help="在信息图下方加音频波形条（需要 numpy）")
+    parser.add_argument("--decoder", default=None, choices=["ffmpeg", "pyav", "auto"],
+                        help="抽帧解码后端（默认直接调用 ffmpeg；auto 按视频测速选最快的）")
+    parser.add_argument("--proxy", action="store_true",
+                        help="择优打分在低分辨率代理上进行（4K/8K 大文件更快，最终帧仍取自源文件）")
+    parser.add_argument("--pattern", default=None, help="背景 Pattern 图片（默认 pattern/ 下第一张）")
+    parser.add_argument("--layout", action="append", default=None,
+                        help="输出版式（default/4col/preview/print 或 layouts.json 中的名字），可重复")
+    parser.add_argument("--out", default=None, help="故事板输出目录（默认视频所在目录）")
+    parser.add_argument("--state-db", default=None, help="状态数据库路径（默认 ~/.visualsnap/state.db）")
+    parser.add_argument("--settle", type=float, default=10.0, help="文件停止增长多少秒后才处理")
+    parser.add_argument("--poll", type=float, default=30.0, help="轮询扫描间隔（秒）")
+    parser.add_argument("--metrics-file", default=None, help="定期写出 JSON 指标的文件")
+    parser.add_argument("--no-cache", action="store_true", help="不使用中间产物缓存")
+    parser.add_argument("--metrics-interval", type=float, default=60.0, help="指标输出间隔（秒）")
+    parser.add_argument("--log-level", default=None, choices=["DEBUG", "INFO", "WARN"],
+                        help="日志级别（默认 INFO，或环境变量 VISUALSNAP_LOG_LEVEL）")
+    parser.add_argument("--log-file", default=snaplog.DEFAULT_FILE, help="同时写入的日志文件")
+    args = parser.parse_args(argv)
+    snaplog.setup(args.log_level, args.log_file)
+
+    watch_dirs = []
+    for item in args.watch:
+        d = os.path.abspath(item[0])
+        prio = int(item[1]) if len(item) > 1 else 0
+        if not os.path.isdir(d):
+            parser.error(f"目录不存在: {d}")
+        watch_dirs.append((d, prio))
+
+    state_db = args.state_db
+    if not state_db:
+        state_dir = os.path.join(os.path.expanduser("~"), ".visualsnap")
+        os.makedirs(state_dir, exist_ok=True)
+        state_db = os.path.join(state_dir, "state.db")
+
+    service = WatchService(
+        watch_dirs, state_db,
+        workers=args.workers, steps=args.steps,
+        pattern_file=args.pattern or snapcore.default_pattern_file(),
+        out_dir=args.out, profiles=[snapcore.parse_layout(name) for name in args.layout or ["default"]],
+        best_window_ms=args.best_window, waveform=args.waveform, settle_seconds=args.settle, poll_interval=args.poll,
+        metrics_file=args.metrics_file, metrics_interval=args.metrics_interval,
+        cache=None if args.no_cache else snapcache.default_cache(), decoder=args.decoder,
+        proxy=args.proxy,
+        budget=snapcore.FrameBudget(target_s=args.target_seconds) if args.budget or args.target_seconds else None,
+    )
+    service.run()
+
+
+if __name__ == "__main__":
+    main()